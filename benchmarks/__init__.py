@@ -0,0 +1,10 @@
+"""
+benchmarks
+~~~~~~~~~~
+
+Benchmarks for tracking Xenops performance, every benchmark prints a JSON result so runs can be compared between
+commits.
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
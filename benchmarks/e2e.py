@@ -0,0 +1,149 @@
+"""
+benchmarks.e2e
+~~~~~~~~~~~~~~
+
+End-to-end benchmarks with the synthetic services.
+
+Usage::
+
+    python -m benchmarks.e2e --sizes 10000 100000 1000000 --output e2e.json
+    python -m benchmarks.e2e --scenarios trigger --sizes 10000 --latency 0.001
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import os
+import shutil
+import argparse
+import tempfile
+import time
+
+from xenops.conf import settings
+from xenops.connector import Connector
+from xenops.connector.storage import ConnectorStorage
+from xenops.data import DataMapObject, DataTypeFactory
+from xenops.service import ServiceFactory
+
+from benchmarks import synthetic
+from benchmarks.report import emit
+
+SCENARIOS = ['converters', 'export', 'identity', 'trigger']
+
+
+class BenchmarkApp:
+    """Minimal application for benchmarks without project settings"""
+
+    def __init__(self):
+        """Init BenchmarkApp"""
+        self.connectors = {}
+        self.routing = {'enhancers': {}, 'processes': {}}
+
+
+def create_connector(app, code, service_code, storage_path=':memory:'):
+    """
+    Create connector with service default mapping
+
+    :param BenchmarkApp app:
+    :param str code:
+    :param str service_code:
+    :param str storage_path:
+    :return xenops.connector.Connector:
+    """
+    service = ServiceFactory.get(service_code)
+    mapping = {type_code: {converter.attribute: converter for converter in service_type.mapping}
+               for type_code, service_type in service.types.items()}
+    app.connectors[code] = Connector(app, ConnectorStorage(storage_path, code), code, service, mapping=mapping)
+    return app.connectors[code]
+
+
+def bench_converters(size, options):
+    """Import every mapped attribute of size records"""
+    records = [synthetic.make_record(index) for index in range(size)]
+
+    start = time.perf_counter()
+    for record in records:
+        for converter in synthetic.SOURCE_MAPPING:
+            converter.import_attribute(record)
+    return time.perf_counter() - start, size * len(synthetic.SOURCE_MAPPING)
+
+
+def bench_export(size, options):
+    """Create DataMapObjects and export them to the target mapping"""
+    app = BenchmarkApp()
+    source = create_connector(app, 'source', 'synthetic_source')
+    target = create_connector(app, 'target', 'synthetic_target')
+    datatype = DataTypeFactory.get('product')
+    target_mapping = target.get_mapping(datatype)
+    records = [synthetic.make_record(index) for index in range(size)]
+
+    start = time.perf_counter()
+    for record in records:
+        DataMapObject(source, datatype, [], record).export_to(target_mapping)
+    return time.perf_counter() - start, size
+
+
+def bench_identity(size, options):
+    """Resolve local ids for new objects and again for known objects"""
+    app = BenchmarkApp()
+    source = create_connector(app, 'source', 'synthetic_source', os.path.join(options.data_path, 'identity.sqlite'))
+    datatype = DataTypeFactory.get('product')
+    records = [synthetic.make_record(index) for index in range(size)]
+
+    start = time.perf_counter()
+    for run in range(2):
+        for record in records:
+            DataMapObject(source, datatype, [], record).get_local_id()
+    return time.perf_counter() - start, size * 2
+
+
+def bench_trigger(size, options):
+    """Run full Application.trigger from synthetic source to synthetic target"""
+    from benchmarks import settings as benchmark_settings
+    from xenops.app import Application
+
+    settings.load(benchmark_settings)
+    settings.BASE_DATA_PATH = os.path.join(options.data_path, 'trigger-{}'.format(size))
+
+    connectors = benchmark_settings.CONNECTORS
+    connectors['source']['service_config'].update(count=size, latency=options.latency)
+    connectors['target']['service_config'].update(latency=options.latency)
+
+    with Application() as app:
+        start = time.perf_counter()
+        app.trigger('product', 'source')
+        return time.perf_counter() - start, size
+
+
+def main(argv=None):
+    """Run benchmarks and print JSON results"""
+    parser = argparse.ArgumentParser(prog='benchmarks.e2e')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000, 1000000])
+    parser.add_argument('--latency', type=float, default=0, help='Simulated service latency per call in seconds')
+    parser.add_argument('--output', help='Also write JSON result to file')
+    options = parser.parse_args(argv)
+
+    synthetic.register()
+    options.data_path = tempfile.mkdtemp(prefix='xenops-benchmark-')
+
+    results = []
+    try:
+        for scenario in options.scenarios:
+            for size in options.sizes:
+                seconds, operations = globals()['bench_{}'.format(scenario)](size, options)
+                results.append({
+                    'scenario': scenario,
+                    'size': size,
+                    'latency': options.latency,
+                    'seconds': seconds,
+                    'operations': operations,
+                    'operations_per_second': operations / seconds if seconds else None,
+                })
+    finally:
+        shutil.rmtree(options.data_path, ignore_errors=True)
+
+    emit('e2e', results, options.output)
+
+
+if __name__ == '__main__':
+    main()
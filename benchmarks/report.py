@@ -0,0 +1,56 @@
+"""
+benchmarks.report
+~~~~~~~~~~~~~~~~~
+
+Machine readable benchmark output.
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import sys
+import json
+import platform
+import subprocess
+
+
+def git_commit():
+    """
+    Get current git commit
+
+    :return str:
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    """
+    Get environment info added to every result
+
+    :return dict:
+    """
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+    }
+
+
+def emit(benchmark, results, output=None):
+    """
+    Print results as JSON and optionally write them to a file
+
+    :param str benchmark:
+    :param list results:
+    :param str output:
+    """
+    report = {'benchmark': benchmark, 'environment': environment(), 'results': results}
+    content = json.dumps(report, indent=2, default=str)
+
+    if output:
+        with open(output, 'w') as f:
+            f.write(content)
+
+    sys.stdout.write(content + '\n')
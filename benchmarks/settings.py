@@ -0,0 +1,25 @@
+"""
+benchmarks.settings
+~~~~~~~~~~~~~~~~~~~
+
+Project settings used by the end-to-end trigger benchmark, count and latency are set by the benchmark.
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+CONFIG_SNAPSHOT = False
+
+CONNECTORS = {
+    'source': {
+        'service': 'synthetic_source',
+        'service_config': {'count': 1000, 'latency': 0},
+        'mapping': {},
+        'triggers': [{'type': 'product', 'page_size': 500}],
+    },
+    'target': {
+        'service': 'synthetic_target',
+        'service_config': {'latency': 0},
+        'mapping': {},
+        'processes': [{'type': 'product'}],
+    },
+}
@@ -0,0 +1,84 @@
+"""
+benchmarks.startup
+~~~~~~~~~~~~~~~~~~
+
+Measure cold start time of the xenops command line.
+
+Usage::
+
+    python -m benchmarks.startup --runs 20
+    XENOPS_SETTINGS=settings python -m benchmarks.startup --args trigger pim product --list
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+COMMAND = 'import sys; from xenops import execute_from_command_line; execute_from_command_line(sys.argv)'
+
+
+def run_command(args, env):
+    """
+    Run xenops command in a new interpreter
+
+    :param list args:
+    :param dict env:
+    :return float: seconds
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', COMMAND] + args, env=env, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL, check=False)
+    return time.perf_counter() - start
+
+
+def import_times(env, top=10):
+    """
+    Get slowest imports of xenops package with -X importtime
+
+    :param dict env:
+    :param int top:
+    :return list:
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import xenops'], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=False)
+    imports = []
+    for line in result.stderr.decode().splitlines():
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        imports.append({'module': parts[2].strip(), 'cumulative_us': int(parts[1])})
+    return sorted(imports, key=lambda item: item['cumulative_us'], reverse=True)[:top]
+
+
+def main(argv=None):
+    """Run startup benchmark and print JSON result"""
+    parser = argparse.ArgumentParser(prog='benchmarks.startup')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--args', nargs=argparse.REMAINDER, default=['--help'], help='xenops command line arguments')
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.getcwd(), env.get('PYTHONPATH')]))
+
+    run_command(args.args, env)  # warm file system cache
+    times = [run_command(args.args, env) for _ in range(args.runs)]
+
+    print(json.dumps({
+        'benchmark': 'startup',
+        'args': args.args,
+        'runs': args.runs,
+        'min': min(times),
+        'median': statistics.median(times),
+        'max': max(times),
+        'imports': import_times(env),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
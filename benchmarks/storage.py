@@ -0,0 +1,202 @@
+"""
+benchmarks.storage
+~~~~~~~~~~~~~~~~~~
+
+Micro-benchmark and load test of ConnectorStorage at different identifier table sizes.
+
+Usage::
+
+    python -m benchmarks.storage --sizes 10000 100000 1000000 10000000 --output storage.json
+    python -m benchmarks.storage --sizes 100000 --threads 4 --duration 10
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import os
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import datetime
+
+from xenops.connector.runstats import percentile
+from xenops.connector.storage import ConnectorStorage
+from xenops.data import DataType
+
+from benchmarks.report import emit
+
+DATATYPE = DataType('product', {}, 'sku')
+
+
+def populate(storage, size, batch_size=100000):
+    """
+    Fill identifiers table with size rows in bulk
+
+    :param ConnectorStorage storage:
+    :param int size:
+    :param int batch_size:
+    """
+    query = """INSERT INTO identifiers (type_code, local_id, object_id) VALUES (?, ?, ?)"""
+    for offset in range(0, size, batch_size):
+        rows = [(DATATYPE.code, 'local-{}'.format(i), 'object-{}'.format(i))
+                for i in range(offset, min(offset + batch_size, size))]
+        with storage.connection as conn:
+            conn.executemany(query, rows)
+
+
+def measure(name, size, operations, function):
+    """
+    Measure latency of every call
+
+    :param str name:
+    :param int size:
+    :param list operations: Arguments per call
+    :param Callable function:
+    :return dict:
+    """
+    latencies = []
+    start = time.perf_counter()
+    for args in operations:
+        call_start = time.perf_counter()
+        function(*args)
+        latencies.append(time.perf_counter() - call_start)
+    seconds = time.perf_counter() - start
+
+    return result(name, size, latencies, seconds)
+
+
+def result(name, size, latencies, seconds, **extra):
+    """
+    Create result dict with latency percentiles
+
+    :param str name:
+    :param int size:
+    :param list latencies:
+    :param float seconds:
+    :return dict:
+    """
+    data = {
+        'operation': name,
+        'size': size,
+        'operations': len(latencies),
+        'seconds': seconds,
+        'operations_per_second': len(latencies) / seconds if seconds else None,
+        'p50': percentile(latencies, 50),
+        'p90': percentile(latencies, 90),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies) if latencies else None,
+    }
+    data.update(extra)
+    return data
+
+
+def concurrent_load(path, size, options):
+    """
+    Run readers and writers with their own storage connection on the same database file
+
+    :param str path:
+    :param int size:
+    :param argparse.Namespace options:
+    :return list:
+    """
+    stop = threading.Event()
+    stats = {'read': [], 'write': []}
+    errors = {'read': 0, 'write': 0}
+    lock = threading.Lock()
+
+    def worker(kind, index):
+        storage = ConnectorStorage(path, 'bench-{}-{}'.format(kind, index))
+        rng = random.Random(index)
+        latencies = []
+        failed = 0
+        counter = 0
+        while not stop.is_set():
+            call_start = time.perf_counter()
+            if kind == 'read':
+                storage.get_local_id(DATATYPE, 'object-{}'.format(rng.randrange(size)))
+            elif not storage.set_object_id(DATATYPE, 'local-w{}-{}'.format(index, counter), 'new-{}'.format(counter)):
+                failed += 1
+            latencies.append(time.perf_counter() - call_start)
+            counter += 1
+        with lock:
+            stats[kind] += latencies
+            errors[kind] += failed
+
+    threads = [threading.Thread(target=worker, args=('read', i)) for i in range(options.threads)]
+    threads += [threading.Thread(target=worker, args=('write', i)) for i in range(options.writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(options.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return [
+        result('concurrent_read', size, stats['read'], options.duration, threads=options.threads,
+               errors=errors['read']),
+        result('concurrent_write', size, stats['write'], options.duration, threads=options.writers,
+               errors=errors['write']),
+    ]
+
+
+def bench_size(size, options):
+    """
+    Run all storage benchmarks for identifier table size
+
+    :param int size:
+    :param argparse.Namespace options:
+    :return list:
+    """
+    path = os.path.join(options.data_path, 'storage-{}.sqlite'.format(size))
+    storage = ConnectorStorage(path, 'bench')
+    populate(storage, size)
+
+    rng = random.Random(size)
+    ids = [rng.randrange(size) for _ in range(options.operations)]
+    date = datetime.datetime(2017, 1, 1)
+    results = [
+        measure('get_local_id', size, [(DATATYPE, 'object-{}'.format(i)) for i in ids], storage.get_local_id),
+        measure('get_object_id', size, [(DATATYPE, 'local-{}'.format(i)) for i in ids], storage.get_object_id),
+        measure('set_object_id', size, [(DATATYPE, 'local-n{}'.format(i), 'object-n{}'.format(i))
+                                        for i in range(options.operations)], storage.set_object_id),
+        measure('set_last_run', size, [('trigger-{}'.format(i % 10), date) for i in range(options.operations)],
+                storage.set_last_run),
+        measure('update_local_id', size, [('local-{}'.format(i), 'merged-{}'.format(i))
+                                          for i in ids[:options.update_operations]], storage.update_local_id),
+    ]
+
+    if options.threads or options.writers:
+        results += concurrent_load(path, size, options)
+
+    storage.connection.close()
+    os.remove(path)
+    return results
+
+
+def main(argv=None):
+    """Run storage benchmarks and print JSON results"""
+    parser = argparse.ArgumentParser(prog='benchmarks.storage')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000, 1000000])
+    parser.add_argument('--operations', type=int, default=2000, help='Operations per point benchmark')
+    parser.add_argument('--update-operations', type=int, default=100, help='Operations for update_local_id')
+    parser.add_argument('--threads', type=int, default=4, help='Concurrent reader threads')
+    parser.add_argument('--writers', type=int, default=1, help='Concurrent writer threads')
+    parser.add_argument('--duration', type=float, default=5, help='Seconds of concurrent load test')
+    parser.add_argument('--output', help='Also write JSON result to file')
+    options = parser.parse_args(argv)
+
+    options.data_path = tempfile.mkdtemp(prefix='xenops-benchmark-')
+    results = []
+    try:
+        for size in options.sizes:
+            results += bench_size(size, options)
+    finally:
+        shutil.rmtree(options.data_path, ignore_errors=True)
+
+    emit('storage', results, options.output)
+
+
+if __name__ == '__main__':
+    main()
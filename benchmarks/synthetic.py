@@ -0,0 +1,145 @@
+"""
+benchmarks.synthetic
+~~~~~~~~~~~~~~~~~~~~
+
+Synthetic in-process services for benchmarks. The source service generates product records, the target service
+resolves identities and exports every object. Both simulate latency with the service_config ``latency`` option.
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import time
+import datetime
+
+from xenops.data import DataTypeFactory
+from xenops.data.converter import Attribute, Mapper, DateTime
+from xenops.service import ServiceFactory, TriggerPage
+
+GENDERS = {'m': 1, 'f': 2, 'u': 3}
+
+PRODUCT_TYPE = {
+    'generic_attribute_id': 'sku',
+    'attributes': {
+        'sku': {'type': str},
+        'name': {'type': str},
+        'price': {'type': float},
+        'qty': {'type': int},
+        'gender': {'type': str},
+        'updated_at': {'type': datetime.datetime},
+    }
+}
+
+SOURCE_MAPPING = [
+    Attribute('id', 'id'),
+    Attribute('sku', 'sku'),
+    Attribute('name', 'info.name'),
+    Attribute('price', 'pricing.price'),
+    Attribute('qty', 'stock.warehouse.qty'),
+    Mapper('gender', 'info.gender', GENDERS),
+    DateTime('updated_at', 'meta.updated_at'),
+]
+
+TARGET_MAPPING = [
+    Attribute('sku', 'code'),
+    Attribute('name', 'title'),
+    Attribute('price', 'price.amount'),
+    Attribute('qty', 'inventory.qty'),
+    Mapper('gender', 'gender', {'m': 'Male', 'f': 'Female', 'u': 'Unisex'}),
+    DateTime('updated_at', 'modified', date_format='%Y-%m-%dT%H:%M:%S'),
+]
+
+
+def make_record(index):
+    """
+    Create raw source record
+
+    :param int index:
+    :return dict:
+    """
+    return {
+        'id': index,
+        'sku': 'sku-{:08d}'.format(index),
+        'info': {
+            'name': 'Synthetic product {}'.format(index),
+            'gender': 1 + index % 3,
+        },
+        'pricing': {'price': round(1 + index % 1000 / 10.0, 2)},
+        'stock': {'warehouse': {'qty': index % 50}},
+        'meta': {'updated_at': '2017-01-{:02d} 10:{:02d}:00'.format(1 + index % 28, index % 60)},
+    }
+
+
+def simulate_latency(service_config):
+    """
+    Sleep configured latency
+
+    :param dict service_config:
+    """
+    latency = service_config.get('latency', 0)
+    if latency:
+        time.sleep(latency)
+
+
+def source_trigger(request):
+    """Yield configured number of records in pages"""
+    count = request.service_config.get('count', 1000)
+    page_size = request.trigger_config.get('page_size', 100)
+    start = request.cursor or 0
+
+    for offset in range(start, count, page_size):
+        simulate_latency(request.service_config)
+        end = min(offset + page_size, count)
+        yield TriggerPage([make_record(index) for index in range(offset, end)], cursor=end)
+
+
+def source_get(request):
+    """Get single record"""
+    simulate_latency(request.service_config)
+    return make_record(int(request.object_id))
+
+
+def target_get(request):
+    """Find target object by sku"""
+    simulate_latency(request.service_config)
+    return {'id': 'target-{}'.format(request.generic_id), 'code': request.generic_id}
+
+
+def target_process(request):
+    """Resolve identity and export every data object"""
+    simulate_latency(request.service_config)
+    for data_object in request.data_objects:
+        request.get_object_id(data_object)
+        request.get_export_data(data_object)
+    return 1
+
+
+def register():
+    """Register synthetic datatype and services"""
+    DataTypeFactory.register('product', PRODUCT_TYPE)
+
+    ServiceFactory.register({
+        'code': 'synthetic_source',
+        'verbose_name': 'Synthetic source',
+        'type': {
+            'product': {
+                'id': Attribute('id', 'id'),
+                'update_at': DateTime('updated_at', 'meta.updated_at'),
+                'mapping': SOURCE_MAPPING,
+                'trigger': source_trigger,
+                'get': source_get,
+            }
+        }
+    })
+
+    ServiceFactory.register({
+        'code': 'synthetic_target',
+        'verbose_name': 'Synthetic target',
+        'type': {
+            'product': {
+                'id': Attribute('id', 'id'),
+                'mapping': TARGET_MAPPING,
+                'get': target_get,
+                'process': target_process,
+            }
+        }
+    })
@@ -11,7 +11,7 @@ setup(
     version="0.0.1",
     description="Xenops is a simple program to sync data like (customers/products) between different systems",
     long_description=readme(),
-    packages=find_packages(),
+    packages=find_packages(exclude=['tests', 'tests.*', 'benchmarks', 'benchmarks.*']),
     include_package_data=True,
     classifiers = [
         'License :: OSI Approved :: GNU General Public License v3 (GPLv3)',
@@ -24,4 +24,7 @@ setup(
     download_url = 'https://github.com/krukas/Xenops/releases/tag/0.0.1',
     keywords = ['Xenops', 'Connector', 'Enterprise Service Bus', 'ESB'],
     install_requires = [],
+    extras_require = {
+        'msgpack': ['msgpack'],
+    },
 )
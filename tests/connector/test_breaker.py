@@ -0,0 +1,49 @@
+import time
+import unittest
+import logging
+
+from xenops.connector.breaker import CircuitBreaker
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_opens_on_error_rate(self):
+        breaker = CircuitBreaker(error_rate=0.5, min_calls=4)
+        for success in [True, False, True]:
+            breaker.record(success)
+        self.assertTrue(breaker.allow())
+
+        breaker.record(False)
+        self.assertEqual(breaker.state, CircuitBreaker.STATE_OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_slow_calls_count_as_failed(self):
+        breaker = CircuitBreaker(min_calls=2, slow_call_seconds=1)
+        breaker.record(True, 2)
+        breaker.record(True, 3)
+
+        self.assertFalse(breaker.allow())
+
+    def test_half_open_trial(self):
+        breaker = CircuitBreaker(min_calls=1, open_seconds=0.01)
+        breaker.record(False)
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.02)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+        breaker.record(False)
+        self.assertEqual(breaker.state, CircuitBreaker.STATE_OPEN)
+
+        time.sleep(0.02)
+        self.assertTrue(breaker.allow())
+        breaker.record(True)
+        self.assertEqual(breaker.state, CircuitBreaker.STATE_CLOSED)
+        self.assertTrue(breaker.allow())
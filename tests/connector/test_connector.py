@@ -0,0 +1,708 @@
+import os
+import shutil
+import tempfile
+import unittest
+import logging
+import threading
+import time
+import zlib
+import decimal
+import datetime
+from unittest import mock
+
+from xenops.data import DataTypeFactory, DataMapObject
+from xenops.data.converter import Attribute, DateTime
+from xenops.service import ServiceFactory, TriggerPage, ProcessRequest
+from xenops.connector import Connector
+from xenops.connector.configparser import ConnectorConfig, InvalidConnectorConfig
+from xenops.connector.shard import Shard, InvalidShard
+from xenops.connector.breaker import CircuitBreaker, CircuitOpen
+from xenops.connector.storage import ConnectorStorage
+from xenops.connector.pool import ExportPool
+from xenops.connector.workqueue import WorkQueue
+from xenops.metrics import metrics
+from xenops.worker import Worker
+
+
+class App:
+
+    def __init__(self):
+        self.connectors = {}
+        self.queue = None
+        self.spool_path = None
+
+    def get_queue(self):
+        return self.queue
+
+    def get_spool_path(self, connector_code, trigger_code):
+        return os.path.join(self.spool_path, connector_code, trigger_code)
+
+    @property
+    def routing(self):
+        return ConnectorConfig().parse_routing({
+            code: {'enhancers': connector.enhancers, 'processes': connector.processes}
+            for code, connector in self.connectors.items()
+        })
+
+    def add_connector(self, code, service_code, **kwargs):
+        service = ServiceFactory.get(service_code)
+        mapping = {type_code: {c.attribute: c for c in service_type.mapping}
+                   for type_code, service_type in service.types.items()}
+        self.connectors[code] = Connector(
+            self, ConnectorStorage(':memory:'), code, service, mapping=mapping, **kwargs)
+        return self.connectors[code]
+
+
+class TestConnector(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        DataTypeFactory.register('product', {'generic_attribute_id': 'sku', 'attributes': {'sku': {}}})
+        self.processed = []
+        self.trigger_requests = []
+
+        ServiceFactory.register({
+            'code': 'test_source',
+            'type': {
+                'product': {
+                    'id': Attribute('id', 'id'),
+                    'mapping': [Attribute('sku', 'sku')],
+                    'trigger': self.trigger,
+                }
+            }
+        })
+        ServiceFactory.register({
+            'code': 'test_target',
+            'type': {
+                'product': {
+                    'mapping': [Attribute('sku', 'code')],
+                    'process': self.process,
+                }
+            }
+        })
+
+        self.app = App()
+        self.source = self.app.add_connector('source', 'test_source', triggers={'product': {'type': 'product'}})
+        self.target = self.app.add_connector('target', 'test_target', processes=[{'type': 'product'}])
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def trigger(self, request):
+        self.trigger_requests.append(request)
+        yield TriggerPage([{'id': 1, 'sku': 'a'}, {'id': 2, 'sku': 'b'}], cursor=1)
+        yield TriggerPage([{'id': 3, 'sku': 'c'}], cursor=2)
+
+    def process(self, request):
+        for data_object in request.data_objects:
+            self.processed.append(request.get_export_data(data_object))
+        return 1
+
+    def test_execute_trigger(self):
+        self.source.execute_trigger('product')
+
+        self.assertEqual(self.processed, [{'code': 'a'}, {'code': 'b'}, {'code': 'c'}])
+        self.assertIsNotNone(self.source.storage.get_last_run('product'))
+        self.assertIsNone(self.source.storage.get_cursor('product'))
+
+    def test_execute_trigger_without_prefetch(self):
+        self.source.triggers['product']['prefetch'] = 0
+        self.source.execute_trigger('product')
+
+        self.assertEqual(len(self.processed), 3)
+
+    def test_execute_trigger_resumes_cursor(self):
+        def failing_process(request):
+            if request.get_export_data(request.data_objects[0])['code'] == 'c':
+                raise KeyboardInterrupt()
+
+        self.target.service.types['product'].process_function = failing_process
+
+        with self.assertRaises(KeyboardInterrupt):
+            self.source.execute_trigger('product')
+
+        self.assertEqual(self.source.storage.get_cursor('product'), 1)
+
+        self.target.service.types['product'].process_function = self.process
+        self.source.execute_trigger('product')
+
+        self.assertEqual(self.trigger_requests[-1].cursor, 1)
+        self.assertIsNone(self.source.storage.get_cursor('product'))
+
+    def test_execute_trigger_resumes_cursor_with_same_last_run(self):
+        base = datetime.datetime(2020, 1, 1)
+        objects = [{'id': i, 'sku': str(i), 'updated': base + datetime.timedelta(minutes=i)} for i in range(1, 6)]
+
+        def trigger(request):
+            items = [data for data in objects if request.last_run is None or data['updated'] > request.last_run]
+            page = request.cursor or 0
+            while page is not None:
+                next_page = page + 1 if (page + 1) * 2 < len(items) else None
+                yield TriggerPage(items[page * 2:page * 2 + 2], cursor=next_page)
+                page = next_page
+
+        def failing_process(request):
+            if request.get_export_data(request.data_objects[0])['code'] == '3':
+                raise KeyboardInterrupt()
+            self.process(request)
+
+        source_type = self.source.service.types['product']
+        source_type.trigger_function = trigger
+        source_type.update_converter = Attribute('updated', 'updated')
+        self.source.triggers['product']['prefetch'] = 0
+        self.target.service.types['product'].process_function = failing_process
+
+        with self.assertRaises(KeyboardInterrupt):
+            self.source.execute_trigger('product')
+        self.assertEqual(self.processed, [{'code': '1'}, {'code': '2'}])
+
+        self.target.service.types['product'].process_function = self.process
+        self.source.execute_trigger('product')
+
+        self.assertEqual(self.processed[2:], [{'code': '3'}, {'code': '4'}, {'code': '5'}])
+
+    def test_execute_trigger_batch_process(self):
+        batches = []
+        service_type = self.target.service.types['product']
+        service_type.process_function = lambda request: batches.append(len(request.data_objects))
+        service_type.capabilities.batch_size = 2
+
+        self.source.execute_trigger('product')
+
+        self.assertEqual(batches, [2, 1])
+
+    def test_execute_trigger_idempotent_retry(self):
+        calls = []
+
+        def process(request):
+            calls.append(request)
+            if len(calls) == 1:
+                raise Exception('Temporary error')
+
+        service_type = self.target.service.types['product']
+        service_type.process_function = process
+        service_type.capabilities.idempotent = True
+
+        self.source.execute_trigger('product')
+
+        self.assertEqual(len(calls), 4)
+
+    def test_get_many_fallback_to_get(self):
+        service_type = self.source.service.types['product']
+        service_type.get_function = lambda request: {'id': request.object_id, 'sku': 'sku-{}'.format(request.object_id)}
+        service_type.capabilities.concurrency = 2
+
+        objects = self.source.get_many(service_type.datatype, object_ids=[1, 2])
+
+        self.assertEqual([data.get('sku') for data in objects], ['sku-1', 'sku-2'])
+
+    def test_get_single_flight(self):
+        calls = []
+
+        def get(request):
+            calls.append(request.object_id)
+            time.sleep(0.05)
+            return {'id': request.object_id, 'sku': 'sku-{}'.format(request.object_id)}
+
+        service_type = self.source.service.types['product']
+        service_type.get_function = get
+
+        objects = [None] * 3
+
+        def run(index):
+            objects[index] = self.source.get(service_type.datatype, 1)
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(calls, [1])
+        self.assertEqual([data_object.get('sku') for data_object in objects], ['sku-1'] * 3)
+        self.assertIsNot(objects[0].data, objects[1].data)
+
+    def test_execute_trigger_metrics(self):
+        metrics.reset()
+
+        self.source.execute_trigger('product')
+
+        output = metrics.render()
+        self.assertIn('xenops_trigger_fetch_seconds_count{connector="source",datatype="product"} 3', output)
+        self.assertIn('xenops_process_seconds_count{connector="target",datatype="product"} 3', output)
+        self.assertIn('xenops_export_seconds_count{connector="target",datatype="product"} 3', output)
+        self.assertIn('xenops_trigger_objects_total{connector="source",datatype="product"} 3.0', output)
+
+    def test_execute_trigger_run_stats(self):
+        self.target.service.types['product'].process_function = lambda request: [
+            request.get_export_payload(data_object) for data_object in request.data_objects]
+        self.source.execute_trigger('product')
+
+        runs = self.source.storage.get_runs('product')
+
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(runs[0]['status'], 'success')
+        self.assertEqual(runs[0]['seen'], 3)
+        self.assertEqual(runs[0]['processed'], 3)
+        self.assertEqual(runs[0]['bytes_exported'], 3 * len('{"code": "a"}'))
+        self.assertEqual(runs[0]['latencies']['target']['count'], 3)
+
+    def test_execute_trigger_queue_and_worker(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.app.queue = WorkQueue(os.path.join(path, 'queue.sqlite'))
+
+        self.source.execute_trigger('product', queue=True)
+
+        self.assertEqual(self.processed, [])
+        self.assertEqual(self.app.queue.counts(), {'pending': 3})
+
+        handled = Worker(self.app, batch_size=2).run(stop_when_empty=True)
+
+        self.assertEqual(handled, 3)
+        self.assertEqual(self.processed, [{'code': 'a'}, {'code': 'b'}, {'code': 'c'}])
+        self.assertEqual(self.app.queue.counts(), {})
+        self.app.queue.close()
+
+    def test_worker_releases_failed_objects(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.app.queue = WorkQueue(os.path.join(path, 'queue.sqlite'))
+        self.target.service.types['product'].process_function = lambda request: 1 / 0
+
+        self.source.execute_trigger('product', queue=True)
+        Worker(self.app).run(max_items=3)
+
+        self.assertEqual(self.app.queue.counts(), {'pending': 3})
+        self.app.queue.close()
+
+    def test_execute_trigger_process_pool(self):
+        self.source.execute_trigger('product', process_pool=2, chunk_size=1)
+
+        self.assertEqual(self.processed, [{'code': 'a'}, {'code': 'b'}, {'code': 'c'}])
+
+    def test_execute_trigger_process_pool_uses_exports(self):
+        pool_exports = []
+        self.target.service.types['product'].process_function = lambda request: pool_exports.append(
+            request.data_objects[0].exports)
+
+        self.source.execute_trigger('product', process_pool=1)
+
+        self.assertEqual(pool_exports[0], {'target': {'code': 'a'}})
+
+    def test_process_pool_falls_back_in_process(self):
+        datatype = DataTypeFactory.get('product')
+        state = ExportPool.create_state(self.source, datatype, self.source.get_processes_config('product'))
+        pool = ExportPool(state, 1)
+        self.addCleanup(pool.close)
+
+        exports = pool.export([{'id': 1, 'sku': 'a'}, {'id': 2, 'sku': 'b', 'callback': lambda: None}])
+
+        self.assertEqual(exports, [{'target': {'code': 'a'}}, {'target': {'code': 'b'}}])
+
+    def test_execute_trigger_shards(self):
+        shards = [Shard(index, 2) for index in range(2)]
+
+        self.source.execute_trigger('product', shard=shards[0])
+        self.assertIs(self.trigger_requests[-1].shard, shards[0])
+        self.assertIsNotNone(self.source.storage.get_last_run(shards[0].storage_key('product')))
+        self.assertIsNone(self.source.storage.get_last_run('product'))
+
+        self.source.execute_trigger('product', shard=shards[1])
+        self.assertEqual(sorted(self.processed, key=lambda data: data['code']),
+                         [{'code': 'a'}, {'code': 'b'}, {'code': 'c'}])
+        self.assertEqual(self.source.storage.get_last_run('product'),
+                         self.source.storage.get_last_run(shards[0].storage_key('product')))
+
+    def test_shard_partition_key(self):
+        self.source.service.types['product'].partition_key_function = lambda data: data['sku'] == 'a'
+        shard = Shard(zlib.crc32(b'True') % 2, 2)
+
+        self.source.execute_trigger('product', shard=shard)
+
+        self.assertEqual(self.processed, [{'code': 'a'}])
+        self.assertEqual(self.source.storage.get_runs('product')[-1]['skipped'], 2)
+
+    def test_shard_parse(self):
+        shard = Shard.parse('1/4')
+        self.assertEqual((shard.index, shard.count), (1, 4))
+        self.assertEqual(str(shard), '1/4')
+
+        for value in ['4/4', '-1/2', 'a/b', '1']:
+            with self.assertRaises(InvalidShard):
+                Shard.parse(value)
+
+    def test_export_shared_by_targets_with_same_mapping(self):
+        self.app.add_connector('target2', 'test_target', processes=[{'type': 'product'}])
+        exports = []
+        export_to = DataMapObject.export_to
+
+        def counting_export_to(data_object, mapping, locale=None):
+            exports.append(data_object)
+            return export_to(data_object, mapping, locale)
+
+        with mock.patch.object(DataMapObject, 'export_to', counting_export_to):
+            self.source.execute_trigger('product')
+
+        self.assertEqual(len(self.processed), 6)
+        self.assertEqual(len(exports), 3)
+
+    def test_export_payload_cache(self):
+        other = self.app.add_connector('other', 'test_target')
+        other.mapping = {'product': {}}
+        data_object = self.source.create_data_object(DataTypeFactory.get('product'), {'id': 1, 'sku': 'a'})
+        request = ProcessRequest(self.target, {}, [data_object])
+
+        payload = request.get_export_payload(data_object)
+        self.assertEqual(payload, '{"code": "a"}')
+        self.assertIs(request.get_export_payload(data_object), payload)
+        self.assertEqual(request.get_export_payload(data_object, serializer=repr), "{'code': 'a'}")
+        self.assertEqual(ProcessRequest(other, {}, [data_object]).get_export_payload(data_object), '{}')
+
+    def test_execute_trigger_spool_and_replay(self):
+        self.app.spool_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.app.spool_path)
+
+        self.source.execute_trigger('product', spool=True, spool_format='json', spool_compress=True)
+        self.assertEqual(self.processed, [])
+        self.assertIsNone(self.source.storage.get_cursor('product'))
+
+        run_stats = self.source.replay('product', keep=True)
+        self.assertEqual(self.processed, [{'code': 'a'}, {'code': 'b'}, {'code': 'c'}])
+        self.assertEqual((run_stats.seen, run_stats.processed), (3, 3))
+
+        self.source.replay('product')
+        self.assertEqual(len(self.processed), 6)
+        self.assertEqual(self.source.replay('product').seen, 0)
+
+    def test_export_delta(self):
+        deltas = []
+
+        def delta_process(request):
+            deltas.extend(request.get_export_delta(data_object) for data_object in request.data_objects)
+
+        self.target.service.types['product'].process_function = delta_process
+        self.source.execute_trigger('product')
+        self.source.execute_trigger('product')
+
+        self.assertEqual(deltas, [{'code': 'a'}, {'code': 'b'}, {'code': 'c'}, {}, {}, {}])
+
+        self.source.service.types['product'].trigger_function = lambda request: [
+            {'id': 1, 'sku': 'x'}, {'id': 2, 'sku': 'b'}]
+        del deltas[:]
+        self.source.execute_trigger('product')
+
+        self.assertEqual(deltas, [{'code': 'x'}, {}])
+
+        self.source.service.types['product'].trigger_function = lambda request: [{'id': 1}]
+        del deltas[:]
+        self.source.execute_trigger('product')
+        self.source.execute_trigger('product')
+
+        self.assertEqual(deltas, [{'code': None}, {}])
+
+    def test_export_delta_not_saved_on_failure(self):
+        def failing_process(request):
+            request.get_export_delta(request.data_objects[0])
+            raise Exception('Failed')
+
+        self.target.service.types['product'].process_function = failing_process
+        self.source.execute_trigger('product')
+
+        data_object = self.source.create_data_object(DataTypeFactory.get('product'), {'id': 1, 'sku': 'a'})
+        self.assertEqual(ProcessRequest(self.target, {}, [data_object]).get_export_delta(data_object), {'code': 'a'})
+
+    def test_process_attribute_subscription(self):
+        self.target.processes = [{'type': 'product', 'attributes': ['sku']}]
+
+        self.source.execute_trigger('product')
+        self.source.execute_trigger('product')
+
+        self.assertEqual(len(self.processed), 3)
+        self.assertEqual(self.source.storage.get_runs('product')[-1]['skipped'], 3)
+
+        self.source.service.types['product'].trigger_function = lambda request: [
+            {'id': 1, 'sku': 'x'}, {'id': 2, 'sku': 'b'}]
+        self.source.execute_trigger('product')
+
+        self.assertEqual(self.processed[3:], [{'code': 'x'}])
+
+    def test_priority_attributes(self):
+        self.app.queue = WorkQueue(':memory:')
+        self.source.execute_trigger('product', queue=True, priority_attributes={'sku': 10})
+        self.assertEqual({item['data']['sku'] for item in self.app.queue.claim('worker', limit=3)}, {'a', 'b', 'c'})
+
+        self.source.service.types['product'].trigger_function = lambda request: [
+            {'id': 1, 'sku': 'a'}, {'id': 2, 'sku': 'b'}, {'id': 3, 'sku': 'x'}]
+        self.source.execute_trigger('product', queue=True, priority_attributes={'sku': 10})
+
+        self.assertEqual([item['data']['sku'] for item in self.app.queue.claim('worker', limit=1)], ['x'])
+
+    def test_priority_snapshots_not_saved_on_failure(self):
+        def failing_process(request):
+            raise Exception('Failed')
+
+        datatype = DataTypeFactory.get('product')
+        process_function = self.target.service.types['product'].process_function
+        self.target.service.types['product'].process_function = failing_process
+        self.source.execute_trigger('product', priority_attributes={'sku': 10})
+
+        local_ids = [self.source.storage.get_local_id(datatype, object_id) for object_id in (1, 2, 3)]
+        self.assertEqual(self.source.storage.get_attribute_snapshots(datatype, 'priority', local_ids), {})
+
+        self.target.service.types['product'].process_function = process_function
+        self.source.execute_trigger('product', priority_attributes={'sku': 10})
+        self.assertEqual(len(self.source.storage.get_attribute_snapshots(datatype, 'priority', local_ids)), 3)
+
+    def test_service_priority_orders_page(self):
+        self.source.service.types['product'].priority_function = lambda data: 5 if data['sku'] == 'b' else 0
+        self.source.triggers['product']['page_size'] = 10
+        self.source.service.types['product'].trigger_function = lambda request: [
+            {'id': 1, 'sku': 'a'}, {'id': 2, 'sku': 'b'}, {'id': 3, 'sku': 'c'}]
+
+        self.source.execute_trigger('product')
+
+        self.assertEqual(self.processed, [{'code': 'b'}, {'code': 'a'}, {'code': 'c'}])
+
+    def test_process_timeout(self):
+        calls = []
+
+        def process(request):
+            calls.append(request)
+            time.sleep(1)
+
+        self.target.timeout = 0.01
+        self.target.service.types['product'].process_function = process
+        self.target.service.types['product'].capabilities.idempotent = True
+
+        self.source.execute_trigger('product')
+
+        self.assertEqual(self.source.storage.get_runs('product')[-1]['failed'], 3)
+        self.assertEqual(len(calls), 3)
+
+    def test_abandoned_calls_limit_per_connector(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.target.timeout = 0.01
+        self.target.abandoned.limit = 1
+        self.target.service.types['product'].process_function = lambda request: release.wait()
+        self.source.timeout = 1
+        self.source.service.types['product'].get_function = lambda request: {'id': request.object_id, 'sku': 'a'}
+
+        with mock.patch.object(self.target, 'record_call') as record_call:
+            self.source.execute_trigger('product')
+
+        self.assertEqual(self.target.abandoned.count, 1)
+        self.assertEqual(record_call.call_count, 1)
+        self.assertEqual(self.source.get(DataTypeFactory.get('product'), 1).get('sku'), 'a')
+
+    def test_circuit_breaker_parks_objects(self):
+        self.target.breaker = CircuitBreaker(min_calls=1, open_seconds=60)
+        self.target.breaker.record(False)
+
+        self.source.execute_trigger('product')
+
+        self.assertEqual(self.processed, [])
+        self.assertEqual(self.source.storage.count_parked(), {('target', 'product'): 3})
+        self.assertEqual(self.source.storage.get_runs('product')[-1]['skipped'], 3)
+
+        self.target.breaker.open_seconds = 0
+        self.source.service.types['product'].trigger_function = lambda request: []
+        self.source.execute_trigger('product')
+
+        self.assertEqual(self.processed, [{'code': 'a'}, {'code': 'b'}, {'code': 'c'}])
+        self.assertEqual(self.source.storage.count_parked(), {})
+
+    def test_circuit_breaker_get(self):
+        self.source.breaker = CircuitBreaker(min_calls=1, open_seconds=60)
+        self.source.breaker.record(False)
+
+        with self.assertRaises(CircuitOpen):
+            self.source.get(DataTypeFactory.get('product'), 1)
+        with self.assertRaises(CircuitOpen):
+            self.source.get_many(DataTypeFactory.get('product'), [1, 2])
+
+    def test_enhancers_loaded_with_get_many(self):
+        requests = []
+        ServiceFactory.register({
+            'code': 'test_erp',
+            'type': {
+                'product': {
+                    'mapping': [Attribute('price', 'price')],
+                    'get_many': lambda request: requests.append(request) or [
+                        {'price': object_id} for object_id in request.object_ids],
+                }
+            }
+        })
+        self.app.add_connector('erp', 'test_erp', enhancers=[{'type': 'product', 'attributes': ['price']}])
+        self.source.mapping['product']['id'] = Attribute('id', 'id')
+        self.target.mapping['product']['price'] = Attribute('price', 'price')
+
+        self.source.execute_trigger('product')
+
+        self.assertEqual([request.object_ids for request in requests], [[1, 2], [3]])
+        self.assertEqual(self.processed, [
+            {'code': 'a', 'price': 1}, {'code': 'b', 'price': 2}, {'code': 'c', 'price': 3}])
+
+    def test_materialize_enhancer_reads_local_store(self):
+        remote_gets = []
+        ServiceFactory.register({
+            'code': 'test_erp',
+            'type': {
+                'product': {
+                    'id': Attribute('id', 'id'),
+                    'mapping': [Attribute('sku', 'sku'), Attribute('price', 'price')],
+                    'trigger': lambda request: [TriggerPage([{'id': 10, 'sku': 'a', 'price': 5}], cursor=None)],
+                    'get': lambda request: remote_gets.append(request) or {'id': 10, 'sku': 'a', 'price': 6},
+                }
+            }
+        })
+        erp = self.app.add_connector(
+            'erp', 'test_erp', triggers={'product': {'type': 'product', 'materialize': ['price']}},
+            enhancers=[{'type': 'product', 'attributes': ['price']}])
+        self.target.mapping['product']['price'] = Attribute('price', 'price')
+        datatype = DataTypeFactory.get('product')
+
+        self.source.execute_trigger('product')
+        self.assertEqual(self.processed[0], {'code': 'a', 'price': 6})
+        self.assertEqual(len(remote_gets), 3)
+
+        erp.execute_trigger('product')
+        self.assertEqual(erp.find_local(datatype, 'price', 5)[0].get('sku'), 'a')
+        self.assertEqual(erp.get_local(datatype, object_id=10).get('price'), 5)
+
+        self.processed = []
+        remote_gets.clear()
+        self.source.execute_trigger('product')
+        self.assertEqual(self.processed[0], {'code': 'a', 'price': 5})
+        self.assertEqual(self.processed[1], {'code': 'b', 'price': 6})
+        self.assertEqual(len(remote_gets), 2)
+
+        erp.triggers['product']['materialize_max_age'] = 60
+        erp.storage.set_last_run('product', datetime.datetime.now() - datetime.timedelta(minutes=5))
+        erp.materialized_checks.clear()
+        self.assertFalse(erp.is_materialized(datatype))
+        self.assertIsNone(erp.get_local(datatype, object_id=10))
+
+    def test_materialize_keeps_types(self):
+        ServiceFactory.register({
+            'code': 'test_erp',
+            'type': {
+                'product': {
+                    'id': Attribute('id', 'id'),
+                    'mapping': [Attribute('sku', 'sku'), DateTime('updated', 'updated')],
+                    'trigger': lambda request: [
+                        {'id': 10, 'sku': 'a', 'updated': '2020-01-02 03:04:05', 'price': decimal.Decimal('1.5')}],
+                }
+            }
+        })
+        erp = self.app.add_connector('erp', 'test_erp', triggers={'product': {'type': 'product', 'materialize': True}})
+        datatype = DataTypeFactory.get('product')
+
+        erp.execute_trigger('product')
+        data_object = erp.get_local(datatype, object_id=10)
+
+        self.assertEqual(data_object.get('updated'), datetime.datetime(2020, 1, 2, 3, 4, 5))
+        self.assertEqual(data_object.data['price'], decimal.Decimal('1.5'))
+
+    def test_materialize_prunes_deleted_objects(self):
+        objects = [{'id': 10, 'sku': 'a'}, {'id': 11, 'sku': 'b'}]
+        ServiceFactory.register({
+            'code': 'test_erp',
+            'type': {
+                'product': {
+                    'id': Attribute('id', 'id'),
+                    'mapping': [Attribute('sku', 'sku')],
+                    'trigger': lambda request: [TriggerPage(list(objects), cursor=None)],
+                }
+            }
+        })
+        erp = self.app.add_connector('erp', 'test_erp', triggers={'product': {'type': 'product', 'materialize': True}})
+        datatype = DataTypeFactory.get('product')
+
+        erp.execute_trigger('product')
+        del objects[1]
+        erp.execute_trigger('product')
+        self.assertIsNotNone(erp.get_local(datatype, object_id=11))
+
+        erp.storage.execute_query('DELETE FROM triggers WHERE trigger_code = ?', ['product'])
+        erp.execute_trigger('product')
+        self.assertIsNotNone(erp.get_local(datatype, object_id=10))
+        self.assertIsNone(erp.get_local(datatype, object_id=11))
+        self.assertEqual(erp.find_local(datatype, 'sku', 'b'), [])
+
+    def test_materialized_sharded_watermark(self):
+        ServiceFactory.register({
+            'code': 'test_erp',
+            'type': {'product': {'id': Attribute('id', 'id'), 'mapping': [Attribute('sku', 'sku')]}}
+        })
+        shard = Shard(0, 2)
+        erp = self.app.add_connector(
+            'erp', 'test_erp', triggers={'product': {'type': 'product', 'materialize': True, 'shard': shard}})
+        datatype = DataTypeFactory.get('product')
+
+        erp.storage.set_last_run(shard.storage_key('product'), datetime.datetime.now())
+        self.assertFalse(erp.is_materialized(datatype))
+
+        erp.materialized_checks.clear()
+        for key in shard.storage_keys('product'):
+            erp.storage.set_last_run(key, datetime.datetime.now())
+        self.assertTrue(erp.is_materialized(datatype))
+
+    def test_process_chain(self):
+        chained = []
+        ServiceFactory.register({
+            'code': 'test_shop',
+            'type': {
+                'product': {
+                    'mapping': [Attribute('sku', 'ref')],
+                    'process': lambda request: chained.extend(
+                        request.get_export_data(data_object) for data_object in request.data_objects),
+                }
+            }
+        })
+        self.app.add_connector('shop', 'test_shop', processes=[{'type': 'product', 'from': ['target']}])
+
+        def process(request):
+            for data_object in request.data_objects:
+                data = request.get_export_data(data_object)
+                request.emit(data_object, dict(data, code=data['code'].upper()))
+            return 1
+
+        self.target.service.types['product'].process_function = process
+        self.source.execute_trigger('product')
+
+        self.assertEqual(chained, [{'ref': 'A'}, {'ref': 'B'}, {'ref': 'C'}])
+        self.assertEqual(self.source.storage.get_runs('product')[-1]['processed'], 6)
+
+    def test_process_chain_failure(self):
+        ServiceFactory.register({
+            'code': 'test_shop',
+            'type': {
+                'product': {
+                    'mapping': [Attribute('sku', 'ref')],
+                    'process': mock.Mock(side_effect=Exception('Shop down')),
+                }
+            }
+        })
+        self.app.add_connector('shop', 'test_shop', processes=[{'type': 'product', 'from': ['target']}])
+        datatype = DataTypeFactory.get('product')
+        data_objects = [self.source.create_data_object(datatype, {'id': 1, 'sku': 'a'})]
+
+        failed = self.source.process_data_objects(data_objects, self.source.get_processes_config('product'))
+
+        self.assertEqual(self.processed, [{'code': 'a'}])
+        self.assertEqual(failed, data_objects)
+
+    def test_process_chain_cycle(self):
+        self.app.add_connector('other', 'test_target', processes=[{'type': 'product', 'from': ['target']}])
+        self.target.processes = [{'type': 'product', 'from': ['other']}]
+
+        with self.assertRaises(InvalidConnectorConfig):
+            self.app.routing
+
+    def test_process_chain_unknown_connector(self):
+        self.target.processes = [{'type': 'product', 'from': ['unknown']}]
+
+        with self.assertRaises(InvalidConnectorConfig):
+            self.app.routing
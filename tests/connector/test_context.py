@@ -0,0 +1,110 @@
+import unittest
+import threading
+import http.client
+from unittest import mock
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from xenops.connector.context import ConnectorContext
+from xenops.connector.http import HTTPPool
+
+
+class Connector:
+    code = 'test'
+    service_config = {}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    clients = set()
+
+    def do_GET(self):
+        Handler.clients.add(self.client_address)
+        body = b'{"path": "' + self.path.encode() + b'"}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestConnectorContext(unittest.TestCase):
+
+    def test_lazy_resource(self):
+        created = []
+        context = ConnectorContext(Connector())
+        context.register('client', lambda: created.append(1) or 'client')
+
+        self.assertEqual(created, [])
+        self.assertEqual(context.get('client'), 'client')
+        self.assertEqual(context.get('client'), 'client')
+        self.assertEqual(created, [1])
+
+    def test_unknown_resource(self):
+        with self.assertRaises(KeyError):
+            ConnectorContext(Connector()).get('unknown')
+
+    def test_close(self):
+        closed = []
+        context = ConnectorContext(Connector())
+        context.register('client', lambda: 'client', close=closed.append)
+        context.register('unused', lambda: 'unused', close=closed.append)
+        context.get('client')
+
+        context.close()
+
+        self.assertEqual(closed, ['client'])
+
+    def test_register_closes_created_resource(self):
+        closed = []
+        context = ConnectorContext(Connector())
+        context.register('client', lambda: 'old', close=closed.append)
+        context.get('client')
+
+        context.register('client', lambda: 'new', close=closed.append)
+
+        self.assertEqual(closed, ['old'])
+        self.assertEqual(context.get('client'), 'new')
+
+    def test_default_http_pool(self):
+        self.assertIsInstance(ConnectorContext(Connector()).http, HTTPPool)
+
+
+class TestHTTPPool(unittest.TestCase):
+
+    def setUp(self):
+        Handler.clients = set()
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuse_connection(self):
+        pool = HTTPPool(timeout=5)
+
+        for i in range(3):
+            response = pool.get('{}/product/{}?a=1'.format(self.url, i))
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.json(), {'path': '/product/{}?a=1'.format(i)})
+
+        pool.close()
+        self.assertEqual(len(Handler.clients), 1)
+
+    def test_retry_only_idempotent_after_send(self):
+        connection = mock.Mock()
+        connection.getresponse.side_effect = http.client.RemoteDisconnected('closed')
+        pool = HTTPPool()
+
+        with mock.patch.object(pool, '_acquire', return_value=(connection, True)):
+            with self.assertRaises(http.client.RemoteDisconnected):
+                pool.post(self.url, body={'sku': 'a'})
+            self.assertEqual(connection.request.call_count, 1)
+
+            with self.assertRaises(http.client.RemoteDisconnected):
+                pool.get(self.url)
+            self.assertEqual(connection.request.call_count, 3)
@@ -0,0 +1,32 @@
+import unittest
+
+from xenops.connector.prefetch import Prefetcher
+
+
+class TestPrefetcher(unittest.TestCase):
+
+    def test_prefetch_order(self):
+        self.assertEqual(list(Prefetcher(range(10), size=2)), list(range(10)))
+
+    def test_prefetch_empty(self):
+        self.assertEqual(list(Prefetcher([])), [])
+
+    def test_prefetch_exception(self):
+        def pages():
+            yield 1
+            raise ValueError('page error')
+
+        result = []
+        with self.assertRaises(ValueError):
+            for item in Prefetcher(pages()):
+                result.append(item)
+
+        self.assertEqual(result, [1])
+
+    def test_prefetch_stop_early(self):
+        prefetcher = Prefetcher(iter(range(1000)))
+
+        for item in prefetcher:
+            break
+
+        self.assertTrue(prefetcher.stopped.is_set())
@@ -0,0 +1,73 @@
+import unittest
+from datetime import datetime, timedelta
+
+from xenops.connector.runstats import RunStats, percentile, summarize_runs
+from xenops.connector.storage import ConnectorStorage
+
+
+def run(seen, duration, status=RunStats.STATUS_SUCCESS):
+    return {'seen': seen, 'duration': duration, 'status': status, 'latencies': {}}
+
+
+class TestRunStats(unittest.TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 90), 90)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3], 99), 3)
+        self.assertIsNone(percentile([], 50))
+
+    def test_latency_percentiles(self):
+        stats = RunStats('product')
+        for value in [0.1, 0.2, 0.3, 0.4]:
+            stats.add_latency('shop', value)
+
+        latencies = stats.latency_percentiles()
+
+        self.assertEqual(latencies['shop']['count'], 4)
+        self.assertEqual(latencies['shop']['p50'], 0.2)
+        self.assertEqual(latencies['shop']['p99'], 0.4)
+
+    def test_summarize_runs(self):
+        summary = summarize_runs([run(100, 10), run(100, 10), run(100, 20), run(100, 20, RunStats.STATUS_FAILED)])
+
+        self.assertEqual(summary['runs'], 4)
+        self.assertEqual(summary['failed_runs'], 1)
+        self.assertEqual(summary['last_objects_per_second'], 5)
+        self.assertEqual(summary['trend_percent'], -50)
+
+    def test_summarize_no_runs(self):
+        self.assertIsNone(summarize_runs([]))
+
+    def test_storage_runs(self):
+        storage = ConnectorStorage(':memory:')
+        stats = RunStats('product')
+        stats.add(seen=10, processed=9, failed=1, bytes_exported=100)
+        stats.add_latency('shop', 0.5)
+        stats.finish()
+        stats.end_time = stats.start_time + timedelta(seconds=2)
+
+        storage.add_run(stats)
+        storage.add_run(RunStats('category'))  # not finished runs are not saved
+        runs = storage.get_runs('product')
+
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(runs[0]['seen'], 10)
+        self.assertEqual(runs[0]['failed'], 1)
+        self.assertEqual(runs[0]['duration'], 2)
+        self.assertIsInstance(runs[0]['start_time'], datetime)
+        self.assertEqual(runs[0]['latencies']['shop']['p50'], 0.5)
+
+    def test_storage_runs_retention(self):
+        storage = ConnectorStorage(':memory:', runs_retention=3)
+        for trigger_code, seen in [('product', seen) for seen in range(5)] + [('category', 1)]:
+            stats = RunStats(trigger_code)
+            stats.add(seen=seen)
+            stats.finish()
+            storage.add_run(stats)
+
+        self.assertEqual([run['seen'] for run in storage.get_runs('product')], [2, 3, 4])
+        self.assertEqual(len(storage.get_runs('category')), 1)
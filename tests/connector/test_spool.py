@@ -0,0 +1,65 @@
+import os
+import shutil
+import decimal
+import datetime
+import tempfile
+import unittest
+
+from xenops.connector.spool import SpoolWriter, InvalidSegment, read_segment, list_segments, has_msgpack
+
+
+class TestSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_and_read(self, **kwargs):
+        pages = [
+            [{'id': 1, 'sku': 'a'}, {'id': 2, 'sku': 'b'}],
+            [{'id': 3, 'name': 'Ü', 'updated': datetime.datetime(2020, 1, 1), 'price': decimal.Decimal('1.5')}],
+        ]
+        with SpoolWriter(self.directory, **kwargs) as writer:
+            for page in pages:
+                writer.write(page)
+
+        self.assertEqual([page for path in list_segments(self.directory) for page in read_segment(path)], pages)
+
+    def test_json(self):
+        self.write_and_read(codec='json')
+
+    def test_compressed(self):
+        self.write_and_read(codec='json', compress=True)
+
+    @unittest.skipUnless(has_msgpack(), 'msgpack is not installed')
+    def test_msgpack(self):
+        self.write_and_read(codec='msgpack')
+
+    def test_segment_rotation(self):
+        with SpoolWriter(self.directory, codec='json', segment_size=10) as writer:
+            for index in range(3):
+                writer.write([{'id': index}])
+
+        segments = list_segments(self.directory)
+        self.assertEqual(len(segments), 3)
+        self.assertEqual([list(read_segment(path)) for path in segments], [[[{'id': 0}]], [[{'id': 1}]], [[{'id': 2}]]])
+
+    def test_unfinished_segment_is_not_listed(self):
+        writer = SpoolWriter(self.directory, codec='json')
+        writer.write([{'id': 1}])
+
+        self.assertEqual(list_segments(self.directory), [])
+        writer.close()
+        self.assertEqual(len(list_segments(self.directory)), 1)
+
+    def test_truncated_segment(self):
+        with SpoolWriter(self.directory, codec='json') as writer:
+            writer.write([{'id': 1}])
+        path = list_segments(self.directory)[0]
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 2)
+
+        with self.assertRaises(InvalidSegment):
+            list(read_segment(path))
@@ -79,5 +79,41 @@ class TestConverter(unittest.TestCase):
         self.assertEqual(self.storage.get_object_id(self.datatype, 'local_id-1'), None)
         self.assertEqual(self.storage.get_object_id(self.datatype, 'local_id-1-new'), 'object_id-1')
 
+    def test_cursor(self):
+        self.assertIsNone(self.storage.get_cursor('test_trigger_1'))
+
+        self.storage.set_cursor('test_trigger_1', {'page': 3})
+        self.assertEqual(self.storage.get_cursor('test_trigger_1'), {'page': 3})
+
+        self.storage.set_cursor('test_trigger_1', None)
+        self.assertIsNone(self.storage.get_cursor('test_trigger_1'))
+
+    def test_attribute_snapshots(self):
+        self.assertEqual(self.storage.get_attribute_snapshots(self.datatype, 'export', ['local_id-1']), {})
+
+        self.storage.set_attribute_snapshots(self.datatype, 'export', {'local_id-1': {'sku': 'abc'}, 'local_id-2': {}})
+        self.storage.set_attribute_snapshots(self.datatype, 'other', {'local_id-1': {'sku': 'def'}})
+
+        self.assertEqual(
+            self.storage.get_attribute_snapshots(self.datatype, 'export', ['local_id-1', 'local_id-2', 'local_id-3']),
+            {'local_id-1': {'sku': 'abc'}, 'local_id-2': {}}
+        )
+
+    def test_materialized(self):
+        self.storage.set_materialized(self.datatype, [
+            ('1', 'local_id-1', {'id': '1', 'ean': 'x'}, {'ean': 'x'}),
+            ('2', 'local_id-2', {'id': '2', 'ean': 'x'}, {'ean': 'x'}),
+        ], ['ean'])
+        self.storage.set_materialized(
+            self.datatype, [('2', 'local_id-2', {'id': '2', 'ean': 'y'}, {'ean': 'y'})], ['ean'])
+
+        self.assertEqual(self.storage.get_materialized(self.datatype, object_id='1'),
+                         ('1', 'local_id-1', {'id': '1', 'ean': 'x'}, {'ean': 'x'}))
+        self.assertEqual(
+            self.storage.get_materialized(self.datatype, local_id='local_id-2')[2], {'id': '2', 'ean': 'y'})
+        self.assertIsNone(self.storage.get_materialized(self.datatype, object_id='3'))
+        self.assertEqual([row[0] for row in self.storage.find_materialized(self.datatype, 'ean', 'x')], ['1'])
+        self.assertEqual([row[0] for row in self.storage.find_materialized(self.datatype, 'ean', 'y')], ['2'])
+
     def test_execute_invalid_query(self):
         self.assertFalse(self.storage.execute_query("INVALID QUERY"))
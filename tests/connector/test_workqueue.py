@@ -0,0 +1,111 @@
+import os
+import time
+import shutil
+import tempfile
+import decimal
+import datetime
+import unittest
+
+from xenops.connector.workqueue import WorkQueue
+
+
+class TestWorkQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.queue = WorkQueue(os.path.join(self.path, 'queue.sqlite'), max_attempts=2)
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.path)
+
+    def test_put_claim_ack(self):
+        self.queue.put_many('pim', 'product', [{'sku': '1'}, {'sku': '2'}])
+
+        items = self.queue.claim('worker-1', limit=10)
+
+        self.assertEqual([item['data'] for item in items], [{'sku': '1'}, {'sku': '2'}])
+        self.assertEqual(items[0]['connector_code'], 'pim')
+        self.assertEqual(self.queue.claim('worker-2'), [])
+
+        self.queue.ack([item['id'] for item in items])
+        self.assertEqual(self.queue.counts(), {})
+
+    def test_payload_keeps_types(self):
+        data = {
+            'updated_at': datetime.datetime(2017, 5, 1, 12, 30, 0, 500, tzinfo=datetime.timezone.utc),
+            'created_at': datetime.datetime(2017, 5, 1, 12, 30),
+            'release': datetime.date(2017, 6, 1),
+            'price': decimal.Decimal('10.50'),
+            'tags': ['a', {'image': b'\x00\x01'}],
+        }
+        self.queue.put_many('pim', 'product', [data])
+
+        self.assertEqual(self.queue.claim('worker-1')[0]['data'], data)
+
+    def test_claim_by_priority(self):
+        self.queue.put_many('pim', 'product', [{'sku': 'low'}, {'sku': 'high'}], priorities=[0, 5])
+
+        self.assertEqual([item['data']['sku'] for item in self.queue.claim('worker', limit=1)], ['high'])
+
+    def test_priority_aging(self):
+        self.queue.aging_seconds = 0.01
+        self.queue.put_many('pim', 'product', [{'sku': 'old'}])
+        time.sleep(0.05)
+        self.queue.put_many('pim', 'product', [{'sku': 'new'}], priorities=[2])
+
+        self.assertEqual([item['data']['sku'] for item in self.queue.claim('worker')], ['old', 'new'])
+
+    def test_claim_limit(self):
+        self.queue.put_many('pim', 'product', [{'sku': str(i)} for i in range(5)])
+
+        self.assertEqual(len(self.queue.claim('worker-1', limit=3)), 3)
+        self.assertEqual(len(self.queue.claim('worker-2', limit=3)), 2)
+
+    def test_expired_lease(self):
+        self.queue.put_many('pim', 'product', [{'sku': '1'}])
+        self.queue.claim('crashed-worker', lease_seconds=0.01)
+        time.sleep(0.02)
+
+        items = self.queue.claim('worker-2')
+
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0]['attempts'], 2)
+
+    def test_expired_lease_claimed_in_due_order(self):
+        self.queue.put_many('pim', 'product', [{'sku': 'expired'}])
+        self.queue.claim('crashed-worker', lease_seconds=0.01)
+        self.queue.put_many('pim', 'product', [{'sku': '1'}, {'sku': '2'}])
+        time.sleep(0.02)
+
+        self.assertEqual([item['data']['sku'] for item in self.queue.claim('worker-2', limit=2)], ['expired', '1'])
+
+    def test_release_and_fail(self):
+        self.queue.put_many('pim', 'product', [{'sku': '1'}])
+
+        self.queue.release([item['id'] for item in self.queue.claim('worker')], 'error')
+        self.assertEqual(self.queue.counts(), {'pending': 1})
+
+        self.queue.release([item['id'] for item in self.queue.claim('worker')], 'error')
+        self.assertEqual(self.queue.counts(), {'failed': 1})
+
+        self.assertEqual(self.queue.retry_failed(), 1)
+        self.assertEqual(self.queue.counts(), {'pending': 1})
+
+    def test_expired_lease_fails_at_max_attempts(self):
+        self.queue.put_many('pim', 'product', [{'sku': '1'}])
+        self.queue.claim('crashed-worker', lease_seconds=0.01)
+        time.sleep(0.02)
+        self.queue.claim('crashed-worker', lease_seconds=0.01)
+        time.sleep(0.02)
+
+        self.assertEqual(self.queue.claim('worker'), [])
+        self.assertEqual(self.queue.counts(), {'failed': 1})
+
+    def test_shared_between_connections(self):
+        other = WorkQueue(self.queue.db_path)
+        self.queue.put_many('pim', 'product', [{'sku': '1'}])
+
+        self.assertEqual(len(other.claim('worker')), 1)
+        self.assertEqual(self.queue.claim('worker'), [])
+        other.close()
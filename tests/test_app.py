@@ -0,0 +1,62 @@
+import unittest
+import logging
+from unittest import mock
+
+from xenops.app import Application
+from xenops.service import ServiceFactory
+
+
+class EntryPoint:
+
+    def __init__(self, name, code):
+        self.name = name
+        self.code = code
+        self.loaded = False
+
+    def load(self):
+        self.loaded = True
+        return {'code': self.code, 'type': {'product': {}}}
+
+
+class TestApplication(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.app = Application.__new__(Application)
+        self.app.entry_points = None
+        self.entry_points = [
+            EntryPoint('lazy_pim', 'lazy_pim'),
+            EntryPoint('lazy_shop', 'lazy_shop'),
+            EntryPoint('other_name', 'lazy_erp'),
+        ]
+        patcher = mock.patch('xenops.app.iter_service_entry_points', return_value=self.entry_points)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        for entry_point in self.entry_points:
+            ServiceFactory._services.pop(entry_point.code, None)
+
+    def test_load_only_required_services(self):
+        self.app.load_services({'lazy_pim'})
+
+        self.assertEqual([entry_point.loaded for entry_point in self.entry_points], [True, False, False])
+        self.assertIsNotNone(ServiceFactory.get('lazy_pim'))
+
+    def test_load_service_with_other_entry_point_name(self):
+        self.app.load_services({'lazy_erp'})
+
+        self.assertIsNotNone(ServiceFactory.get('lazy_erp'))
+
+    def test_load_all_services(self):
+        self.app.load_services()
+
+        self.assertTrue(all(entry_point.loaded for entry_point in self.entry_points))
+
+    def test_skip_registered_services(self):
+        ServiceFactory.register({'code': 'lazy_pim', 'type': {'product': {}}})
+
+        self.app.load_services({'lazy_pim'})
+
+        self.assertFalse(self.entry_points[0].loaded)
@@ -0,0 +1,154 @@
+import time
+import threading
+import unittest
+
+from xenops.concurrency import (
+    RateLimiter, CallTimeout, SingleFlight, AbandonedCalls, TooManyAbandonedCalls, run_concurrent, run_async_concurrent,
+    call_with_timeout, await_with_timeout
+)
+
+
+class TestConcurrency(unittest.TestCase):
+
+    def test_run_concurrent_order(self):
+        results = run_concurrent(lambda x: x * 2, [1, 2, 3], concurrency=3)
+
+        self.assertEqual(results, [(2, None), (4, None), (6, None)])
+
+    def test_run_concurrent_error(self):
+        def function(x):
+            if x == 2:
+                raise ValueError('error')
+            return x
+
+        results = run_concurrent(function, [1, 2, 3], concurrency=2)
+
+        self.assertEqual(results[0], (1, None))
+        self.assertIsInstance(results[1][1], ValueError)
+
+    def test_run_concurrent_uses_threads(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        results = run_concurrent(lambda x: barrier.wait() is not None, [1, 2, 3], concurrency=3)
+
+        self.assertEqual([error for result, error in results], [None, None, None])
+
+    def test_run_async_concurrent(self):
+        async def function(x):
+            return x + 1
+
+        self.assertEqual(run_async_concurrent(function, [1, 2], concurrency=2), [(2, None), (3, None)])
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(100)
+
+        start = time.monotonic()
+        for i in range(5):
+            limiter.wait()
+
+        self.assertGreaterEqual(time.monotonic() - start, 0.035)
+
+    def test_rate_limiter_no_limit(self):
+        self.assertEqual(RateLimiter(None).reserve(), 0)
+
+    def test_call_with_timeout(self):
+        self.assertEqual(call_with_timeout(lambda x: x + 1, 1, 1), 2)
+
+        with self.assertRaises(CallTimeout):
+            call_with_timeout(time.sleep, 0.01, 1)
+
+        with self.assertRaises(ValueError):
+            call_with_timeout(int, 1, 'a')
+
+    def test_call_with_timeout_abandoned_limit(self):
+        release = threading.Event()
+        calls = []
+        abandoned = AbandonedCalls('shop', limit=1)
+
+        with self.assertRaises(CallTimeout):
+            call_with_timeout(release.wait, 0.01, abandoned=abandoned)
+        self.assertEqual(abandoned.count, 1)
+        with self.assertRaises(TooManyAbandonedCalls):
+            call_with_timeout(calls.append, 1, 'called', abandoned=abandoned)
+        call_with_timeout(calls.append, 1, 'other', abandoned=AbandonedCalls('erp', limit=1))
+        self.assertEqual(calls, ['other'])
+
+        release.set()
+        for _ in range(100):
+            if not abandoned.count:
+                break
+            time.sleep(0.01)
+        call_with_timeout(calls.append, 1, 'called', abandoned=abandoned)
+        self.assertEqual(calls, ['other', 'called'])
+
+    def test_await_with_timeout(self):
+        import asyncio
+
+        async def slow(item):
+            await await_with_timeout(asyncio.sleep(1), 0.01)
+
+        result, error = run_async_concurrent(slow, [1])[0]
+        self.assertIsInstance(error, CallTimeout)
+
+    def test_single_flight(self):
+        flight = SingleFlight()
+        calls = []
+
+        def get(key):
+            calls.append(key)
+            time.sleep(0.05)
+            return {'key': key}
+
+        results = run_concurrent(lambda key: flight.do(key, get, key), ['a', 'a', 'a', 'b'], 4)
+
+        self.assertEqual(sorted(calls), ['a', 'b'])
+        self.assertEqual([result[0] for result, error in results], [{'key': 'a'}] * 3 + [{'key': 'b'}])
+        self.assertEqual(sorted(result[1] for result, error in results), [False, False, True, True])
+        self.assertEqual(flight.calls, {})
+
+    def test_single_flight_error(self):
+        flight = SingleFlight()
+
+        def fail():
+            time.sleep(0.05)
+            raise ValueError('Service down')
+
+        results = run_concurrent(lambda item: flight.do('a', fail), [1, 2], 2)
+
+        self.assertTrue(all(isinstance(error, ValueError) for result, error in results))
+        self.assertEqual(flight.calls, {})
+
+    def test_single_flight_async(self):
+        import asyncio
+
+        flight = SingleFlight()
+        calls = []
+
+        async def get(key):
+            calls.append(key)
+            await asyncio.sleep(0.01)
+            return key
+
+        results = run_async_concurrent(lambda key: flight.do_async(key, get, key), ['a', 'a', 'b'], 3)
+
+        self.assertEqual(calls, ['a', 'b'])
+        self.assertEqual([result for result, error in results], [('a', False), ('a', True), ('b', False)])
+        self.assertEqual(flight.async_calls, {})
+
+    def test_single_flight_async_between_loops(self):
+        import asyncio
+        from xenops.concurrency import run_coroutine
+
+        flight = SingleFlight()
+        calls = []
+
+        async def get():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'a'
+
+        results = run_concurrent(lambda item: run_coroutine(flight.do_async('a', get)), [1, 2], 2)
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(sorted(result for result, error in results), [('a', False), ('a', True)])
+        self.assertEqual(flight.async_calls, {})
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from xenops.metrics import MetricsRegistry, Histogram
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = MetricsRegistry()
+
+    def test_histogram(self):
+        histogram = Histogram(buckets=(1, 5))
+        for value in [0.5, 2, 3, 10]:
+            histogram.observe(value)
+
+        self.assertEqual(histogram.cumulative_counts(), [(1, 1), (5, 3)])
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.sum, 15.5)
+
+    def test_render_histogram(self):
+        self.metrics.observe('xenops_process_seconds', 0.002, connector='shop', datatype='product')
+
+        output = self.metrics.render()
+
+        self.assertIn('# TYPE xenops_process_seconds histogram', output)
+        self.assertIn('xenops_process_seconds_bucket{connector="shop",datatype="product",le="0.005"} 1', output)
+        self.assertIn('xenops_process_seconds_bucket{connector="shop",datatype="product",le="+Inf"} 1', output)
+        self.assertIn('xenops_process_seconds_count{connector="shop",datatype="product"} 1', output)
+
+    def test_render_counter_and_gauge(self):
+        self.metrics.inc('xenops_trigger_objects_total', 10, connector='pim')
+        self.metrics.inc('xenops_trigger_objects_total', 5, connector='pim')
+        self.metrics.set('xenops_trigger_objects_per_second', 2.5, connector='pim')
+
+        output = self.metrics.render()
+
+        self.assertIn('xenops_trigger_objects_total{connector="pim"} 15.0', output)
+        self.assertIn('# TYPE xenops_trigger_objects_per_second gauge', output)
+        self.assertIn('xenops_trigger_objects_per_second{connector="pim"} 2.5', output)
+
+    def test_label_escape(self):
+        self.metrics.inc('test_total', connector='a"b')
+
+        self.assertIn('test_total{connector="a\\"b"} 1.0', self.metrics.render())
+
+    def test_timer(self):
+        with self.metrics.timer('test_seconds', connector='pim'):
+            pass
+
+        self.assertEqual(self.metrics.histograms[('test_seconds', (('connector', 'pim'),))].count, 1)
+
+    def test_write(self):
+        path = tempfile.mkdtemp()
+        self.metrics.inc('test_total')
+        self.metrics.write(os.path.join(path, 'xenops.prom'))
+
+        with open(os.path.join(path, 'xenops.prom')) as f:
+            self.assertIn('test_total 1.0', f.read())
+        shutil.rmtree(path)
+
+    def test_serve(self):
+        self.metrics.inc('test_total')
+        server = self.metrics.serve(port=0)
+
+        try:
+            with urlopen('http://127.0.0.1:{}/metrics'.format(server.server_address[1])) as response:
+                self.assertIn(b'test_total 1.0', response.read())
+
+            with self.assertRaises(HTTPError) as context:
+                urlopen('http://127.0.0.1:{}/other'.format(server.server_address[1]))
+            self.assertEqual(context.exception.code, 404)
+            context.exception.close()
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,53 @@
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+from xenops.data.converter import Attribute
+from xenops.profiling import Profiler, code_group
+
+
+def work():
+    converter = Attribute('sku', 'product.sku')
+    return [converter.import_attribute({'product': {'sku': str(i)}}) for i in range(2000)]
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_code_group(self):
+        self.assertEqual(code_group(Attribute.__init__.__code__.co_filename), 'xenops')
+        self.assertEqual(code_group(os.__file__), 'python')
+        self.assertEqual(code_group(__file__), 'service')
+        self.assertEqual(code_group('~'), 'python')
+
+    def test_pstats(self):
+        output = os.path.join(self.path, 'trigger.pstats')
+
+        with Profiler(output, memory=True, top=5) as profiler:
+            work()
+
+        self.assertTrue(pstats.Stats(output))
+        summary = profiler.summary()
+        self.assertIn('Time per group:', summary)
+        self.assertIn('xenops', summary)
+        self.assertIn('Top 5 allocations:', summary)
+
+    def test_collapsed(self):
+        output = os.path.join(self.path, 'trigger.collapsed')
+
+        with Profiler(output, output_format='collapsed'):
+            for i in range(20):
+                work()
+
+        with open(output) as f:
+            lines = f.read().splitlines()
+
+        self.assertTrue(lines)
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
@@ -0,0 +1,137 @@
+import unittest
+import logging
+
+from xenops.data import DataTypeFactory
+from xenops.data.converter import Attribute
+from xenops.service import ServiceFactory
+from xenops.reconcile import HashTree, Reconciler
+from tests.connector.test_connector import App
+
+
+class TestHashTree(unittest.TestCase):
+
+    def test_diff(self):
+        source = HashTree(buckets=4)
+        target = HashTree(buckets=4)
+        for local_id in ['a', 'b', 'c', 'd']:
+            source.add(local_id, {'name': local_id})
+            target.add(local_id, {'name': local_id})
+
+        self.assertEqual(source.root, target.root)
+        self.assertEqual(source.diff(target), ([], [], 0))
+
+        target.add('b', {'name': 'changed'})
+        target.add('e', {'name': 'e'})
+        source.add('f', {'name': 'f'})
+
+        changed, extra, buckets = source.diff(target)
+        self.assertEqual(sorted(changed), ['b', 'f'])
+        self.assertEqual(extra, ['e'])
+        self.assertLessEqual(buckets, 3)
+
+
+class TestReconciler(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        DataTypeFactory.register('product', {'generic_attribute_id': 'sku', 'attributes': {'sku': {}, 'name': {}}})
+        self.source_data = {str(index): {'id': str(index), 'sku': str(index), 'name': 'Product'} for index in range(50)}
+        self.target_data = {}
+        self.processed = []
+
+        ServiceFactory.register({
+            'code': 'reconcile_source',
+            'type': {
+                'product': {
+                    'id': Attribute('id', 'id'),
+                    'mapping': [Attribute('sku', 'sku'), Attribute('name', 'name')],
+                    'trigger': lambda request: iter(self.source_data.values()),
+                    'get': lambda request: self.source_data[request.object_id],
+                }
+            }
+        })
+        ServiceFactory.register({
+            'code': 'reconcile_target',
+            'type': {
+                'product': {
+                    'id': Attribute('id', 'key'),
+                    'mapping': [Attribute('sku', 'code'), Attribute('name', 'title')],
+                    'trigger': lambda request: iter(self.target_data.values()),
+                    'process': self.process,
+                }
+            }
+        })
+
+        self.app = App()
+        self.source = self.app.add_connector('source', 'reconcile_source', triggers={'product': {'type': 'product'}})
+        self.target = self.app.add_connector('target', 'reconcile_target', processes=[{'type': 'product'}])
+        self.source.execute_trigger('product')
+        self.processed = []
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def process(self, request):
+        for data_object in request.data_objects:
+            data = dict(request.get_export_data(data_object), key='t' + data_object.get('sku'))
+            request.connector.storage.set_object_id(data_object.datatype, data_object.get_local_id(), data['key'])
+            self.target_data[data['key']] = data
+            self.processed.append(data['key'])
+        return 1
+
+    def test_in_sync(self):
+        result = Reconciler(self.source, self.target, DataTypeFactory.get('product'), buckets=8).run()
+
+        self.assertEqual((result.source_count, result.target_count), (50, 50))
+        self.assertEqual(result.changed, [])
+        self.assertEqual(self.processed, [])
+
+    def test_push_only_different_objects(self):
+        self.target_data['t3']['title'] = 'Changed'
+        del self.target_data['t7']
+        self.source_data['9']['name'] = 'New name'
+
+        result = Reconciler(self.source, self.target, DataTypeFactory.get('product'), buckets=8).run()
+
+        self.assertEqual(sorted(self.processed), ['t3', 't7', 't9'])
+        self.assertEqual(result.pushed, 3)
+        self.assertLessEqual(result.different_buckets, 3)
+        self.assertEqual(self.target_data['t9']['title'], 'New name')
+
+    def test_push_full_export_for_delta_services(self):
+        deltas = []
+
+        def delta_process(request):
+            for data_object in request.data_objects:
+                delta = request.get_export_delta(data_object)
+                deltas.append(delta)
+                self.target_data['t' + data_object.get('sku')].update(delta)
+
+        self.target.service.types['product'].process_function = delta_process
+        self.source.execute_trigger('product')
+        self.target_data['t3']['title'] = 'Changed'
+        del deltas[:]
+
+        Reconciler(self.source, self.target, DataTypeFactory.get('product')).run()
+
+        self.assertEqual(deltas, [{'code': '3', 'title': 'Product'}])
+        self.assertEqual(self.target_data['t3']['title'], 'Product')
+
+    def test_dry_run(self):
+        self.target_data['t3']['title'] = 'Changed'
+
+        result = Reconciler(self.source, self.target, DataTypeFactory.get('product')).run(dry_run=True)
+
+        self.assertEqual(len(result.changed), 1)
+        self.assertEqual(self.processed, [])
+
+    def test_new_source_object(self):
+        datatype = DataTypeFactory.get('product')
+        self.source_data['99'] = {'id': '99', 'sku': '99', 'name': 'Product'}
+
+        result = Reconciler(self.source, self.target, datatype).run(dry_run=True)
+        self.assertEqual(result.changed, ['new:99'])
+        self.assertIsNone(self.source.storage.get_local_id(datatype, '99'))
+
+        Reconciler(self.source, self.target, datatype).run()
+        self.assertEqual(self.processed, ['t99'])
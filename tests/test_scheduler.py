@@ -0,0 +1,109 @@
+import time
+import threading
+import unittest
+import logging
+
+from xenops.data import DataTypeFactory
+from xenops.scheduler import TriggerScheduler, TriggerJob, InvalidDependencies
+
+
+class Connector:
+
+    def __init__(self, code, triggers, runs, fail=False):
+        self.code = code
+        self.triggers = triggers
+        self.runs = runs
+        self.fail = fail
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def execute_trigger(self, trigger_code, **options):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.running, self.max_running)
+        time.sleep(0.01)
+        with self.lock:
+            self.running -= 1
+            self.runs.append((self.code, trigger_code, options))
+        if self.fail:
+            raise Exception('Trigger failed')
+
+
+class App:
+
+    def __init__(self, connectors, processes=None):
+        self.connectors = {connector.code: connector for connector in connectors}
+        self.routing = {'enhancers': {}, 'processes': processes or {}}
+
+
+class TestTriggerScheduler(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        DataTypeFactory.register('scheduler_category', {})
+        DataTypeFactory.register('scheduler_product', {'depends_on': ['scheduler_category']})
+        self.runs = []
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_dependencies_run_first(self):
+        app = App([
+            Connector('shop', {'scheduler_product': {'type': 'scheduler_product'}}, self.runs),
+            Connector('pim', {'scheduler_category': {'type': 'scheduler_category'}}, self.runs),
+        ])
+
+        jobs = TriggerScheduler(app, concurrency=4).run(page_size=10)
+
+        self.assertEqual([(code, trigger) for code, trigger, _ in self.runs],
+                         [('pim', 'scheduler_category'), ('shop', 'scheduler_product')])
+        self.assertEqual(self.runs[0][2], {'page_size': 10})
+        self.assertEqual({job.status for job in jobs}, {TriggerJob.STATUS_SUCCESS})
+
+    def test_failed_dependency_skips_trigger(self):
+        app = App([
+            Connector('pim', {'scheduler_category': {'type': 'scheduler_category'}}, self.runs, fail=True),
+            Connector('shop', {'scheduler_product': {'type': 'scheduler_product'}}, self.runs),
+        ])
+
+        jobs = {str(job): job for job in TriggerScheduler(app).run()}
+
+        self.assertEqual(jobs['pim.scheduler_category'].status, TriggerJob.STATUS_FAILED)
+        self.assertEqual(jobs['shop.scheduler_product'].status, TriggerJob.STATUS_SKIPPED)
+        self.assertEqual(len(self.runs), 1)
+
+    def test_target_concurrency(self):
+        source = Connector('source', {'a': {'type': 'a'}, 'b': {'type': 'b'}, 'c': {'type': 'c'}}, self.runs)
+        app = App([source], processes={type_code: [{'connector': 'target'}] for type_code in 'abc'})
+
+        TriggerScheduler(app, concurrency=3, target_concurrency=1).run()
+        self.assertEqual(source.max_running, 1)
+
+        scheduler = TriggerScheduler(app, concurrency=3)
+        self.assertEqual(scheduler.target_concurrency, 1)
+
+        TriggerScheduler(app, concurrency=3, target_concurrency=3).run()
+        self.assertGreater(source.max_running, 1)
+
+    def test_chained_targets(self):
+        source = Connector('source', {'a': {'type': 'a'}}, self.runs)
+        app = App([source], processes={'a': [
+            {'connector': 'erp'},
+            {'connector': 'shop', 'from': ['erp']},
+            {'connector': 'search', 'from': ['shop']},
+            {'connector': 'archive', 'from': ['other']},
+        ]})
+
+        self.assertEqual(TriggerScheduler(app).jobs[0].targets, {'erp', 'shop', 'search'})
+
+    def test_dependency_cycle(self):
+        DataTypeFactory.register('scheduler_category', {'depends_on': ['scheduler_product']})
+        self.addCleanup(DataTypeFactory.register, 'scheduler_category', {'depends_on': []})
+        app = App([
+            Connector('pim', {'scheduler_category': {'type': 'scheduler_category'}}, self.runs),
+            Connector('shop', {'scheduler_product': {'type': 'scheduler_product'}}, self.runs),
+        ])
+
+        with self.assertRaises(InvalidDependencies):
+            TriggerScheduler(app)
@@ -1,7 +1,7 @@
 import unittest
 import logging
 
-from xenops.service import ServiceFactory, TriggerRequest, GetRequest, ProcessRequest, ServiceType
+from xenops.service import ServiceFactory, TriggerRequest, TriggerPage, GetRequest, ProcessRequest, ServiceType
 
 
 class TestConverter(unittest.TestCase):
@@ -104,3 +104,95 @@ class TestConverter(unittest.TestCase):
 
         self.assertEqual(len(data), 1)
         self.assertDictEqual(data[0], {'sku': '123'})
+
+    def test_service_type_trigger_flattens_pages(self):
+        service_type = ServiceType(
+            datatype=None,
+            id_converter=None,
+            update_converter=None,
+            mapping=None,
+            trigger=lambda x: [TriggerPage([{'sku': '1'}, {'sku': '2'}], cursor=2), {'sku': '3'}],
+            get=None,
+            process=None
+        )
+
+        data = list(service_type.trigger({}))
+
+        self.assertEqual([item['sku'] for item in data], ['1', '2', '3'])
+
+    def test_service_type_trigger_pages(self):
+        service_type = ServiceType(
+            datatype=None,
+            id_converter=None,
+            update_converter=None,
+            mapping=None,
+            trigger=lambda x: [{'sku': str(i)} for i in range(5)],
+            get=None,
+            process=None
+        )
+
+        pages = list(service_type.trigger_pages({}, page_size=2))
+
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertIsNone(pages[0].cursor)
+
+    def test_service_type_trigger_pages_keeps_service_pages(self):
+        service_type = ServiceType(
+            datatype=None,
+            id_converter=None,
+            update_converter=None,
+            mapping=None,
+            trigger=lambda x: [{'sku': '1'}, TriggerPage([{'sku': '2'}, {'sku': '3'}], cursor='next')],
+            get=None,
+            process=None
+        )
+
+        pages = list(service_type.trigger_pages({}, page_size=10))
+
+        self.assertEqual([len(page) for page in pages], [1, 2])
+        self.assertEqual(pages[1].cursor, 'next')
+
+    def test_service_register_capabilities(self):
+        ServiceFactory.register({
+            'code': 'pim',
+            'type': {
+                'product': {
+                    'get_many': lambda x: [],
+                    'capabilities': {
+                        'batch_size': 50,
+                        'concurrency': 4,
+                        'rate_limit': 10,
+                        'idempotent': True,
+                    }
+                }
+            }
+        })
+
+        service_type = ServiceFactory.get('pim').types['product']
+
+        self.assertEqual(service_type.capabilities.batch_size, 50)
+        self.assertEqual(service_type.capabilities.concurrency, 4)
+        self.assertEqual(service_type.capabilities.rate_limit, 10)
+        self.assertTrue(service_type.capabilities.idempotent)
+        self.assertFalse(service_type.capabilities.is_async)
+        self.assertTrue(service_type.has_get_many())
+
+    def test_service_register_default_capabilities(self):
+        ServiceFactory.register({'code': 'pim', 'type': {'product': {}}})
+
+        capabilities = ServiceFactory.get('pim').types['product'].capabilities
+
+        self.assertEqual(capabilities.batch_size, 1)
+        self.assertEqual(capabilities.concurrency, 1)
+        self.assertFalse(capabilities.idempotent)
+
+    def test_service_register_async_detected(self):
+        async def process(request):
+            return 1
+
+        ServiceFactory.register({'code': 'pim', 'type': {'product': {'process': process}}})
+
+        service_type = ServiceFactory.get('pim').types['product']
+
+        self.assertTrue(service_type.capabilities.is_async)
+        self.assertEqual(service_type.process(None), 1)
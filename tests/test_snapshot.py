@@ -0,0 +1,142 @@
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+from unittest import mock
+
+from xenops.app import Application
+from xenops.connector.configparser import ConnectorConfig
+from xenops.data.converter import Attribute
+from xenops.service import ServiceFactory
+from xenops.snapshot import ConfigSnapshot
+
+
+def process(request):
+    return 1
+
+
+class Settings:
+
+    IS_PROJECT = True
+
+    def __init__(self, base_path):
+        self.BASE_PATH = base_path
+        self.BASE_DATA_PATH = os.path.join(base_path, 'data')
+        self.values = {
+            'CONNECTORS': {
+                'snapshot_shop': {
+                    'service': 'snapshot_service',
+                    'mapping': {},
+                    'triggers': [{'type': 'product'}],
+                    'processes': [{'type': 'product'}],
+                }
+            }
+        }
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+
+class TestConfigSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.path = tempfile.mkdtemp()
+        self.snapshot = ConfigSnapshot(self.path)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.path)
+
+    def test_save_load(self):
+        self.assertTrue(self.snapshot.save('abc', {'key': 'value'}))
+
+        self.assertEqual(self.snapshot.load('abc'), {'key': 'value'})
+
+    def test_invalid_fingerprint(self):
+        self.snapshot.save('abc', {'key': 'value'})
+
+        self.assertIsNone(self.snapshot.load('def'))
+
+    def test_no_snapshot(self):
+        self.assertIsNone(self.snapshot.load('abc'))
+
+    def test_not_picklable(self):
+        self.assertFalse(self.snapshot.save('abc', {'key': lambda x: x}))
+        self.assertIsNone(self.snapshot.load('abc'))
+
+    def test_fingerprint_changes_with_project_module(self):
+        os.makedirs(os.path.join(self.path, 'services'))
+        module_path = os.path.join(self.path, 'services', 'shop.py')
+        with open(module_path, 'w') as f:
+            f.write('VALUE = 1\n')
+
+        fingerprint = ConfigSnapshot.fingerprint(self.path)
+        self.assertEqual(fingerprint, ConfigSnapshot.fingerprint(self.path))
+
+        with open(module_path, 'w') as f:
+            f.write('VALUE = 2\n')
+        self.assertNotEqual(fingerprint, ConfigSnapshot.fingerprint(self.path))
+
+    def test_fingerprint_ignores_data_path(self):
+        fingerprint = ConfigSnapshot.fingerprint(self.path)
+        os.makedirs(os.path.join(self.path, 'data'))
+        with open(os.path.join(self.path, 'data', 'generated.py'), 'w') as f:
+            f.write('VALUE = 1\n')
+
+        self.assertEqual(fingerprint, ConfigSnapshot.fingerprint(self.path))
+
+    def test_fingerprint_changes_with_xenops_version(self):
+        fingerprint = ConfigSnapshot.fingerprint(self.path)
+
+        with mock.patch('xenops.__version__', '99.0'):
+            self.assertNotEqual(fingerprint, ConfigSnapshot.fingerprint(self.path))
+
+
+class TestApplicationSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.path = tempfile.mkdtemp()
+        self.settings = Settings(self.path)
+        for target in ['xenops.app.settings', 'xenops.connector.connector.settings']:
+            patcher = mock.patch(target, self.settings)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        ServiceFactory.register({
+            'code': 'snapshot_service',
+            'type': {
+                'product': {
+                    'mapping': [Attribute('sku', 'sku')],
+                    'process': process,
+                }
+            }
+        })
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.path)
+
+    def test_application_uses_snapshot(self):
+        self.settings.values['CONFIG_SNAPSHOT'] = True
+
+        with Application():
+            pass
+
+        self.assertTrue(os.path.exists(os.path.join(self.settings.BASE_DATA_PATH, ConfigSnapshot.FILENAME)))
+
+        with mock.patch.object(ConnectorConfig, 'parse', side_effect=AssertionError('Config parsed')):
+            with Application() as app:
+                connector = app.connectors['snapshot_shop']
+
+                self.assertEqual(list(connector.triggers), ['product'])
+                self.assertEqual(connector.service.types['product'].process_function, process)
+                self.assertEqual(len(connector.get_processes_config('product')), 1)
+
+    def test_application_snapshot_disabled_by_default(self):
+        with Application():
+            pass
+
+        self.assertFalse(os.path.exists(os.path.join(self.settings.BASE_DATA_PATH, ConfigSnapshot.FILENAME)))
@@ -0,0 +1,105 @@
+import json
+import unittest
+import logging
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from xenops.data import DataTypeFactory
+from xenops.data.converter import Attribute
+from xenops.service import ServiceFactory
+from xenops.webhook import WebhookServer, InvalidNotification
+from tests.connector.test_connector import App
+
+
+class TestWebhookServer(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        DataTypeFactory.register('product', {'generic_attribute_id': 'sku', 'attributes': {'sku': {}}})
+        self.processed = []
+
+        ServiceFactory.register({
+            'code': 'webhook_source',
+            'type': {
+                'product': {
+                    'id': Attribute('id', 'id'),
+                    'mapping': [Attribute('sku', 'sku')],
+                    'get': self.get,
+                    'get_many': self.get_many,
+                }
+            }
+        })
+        ServiceFactory.register({
+            'code': 'webhook_target',
+            'type': {
+                'product': {
+                    'mapping': [Attribute('sku', 'code')],
+                    'process': self.process,
+                }
+            }
+        })
+
+        self.app = App()
+        self.app.add_connector('source', 'webhook_source')
+        self.app.add_connector('target', 'webhook_target', processes=[{'type': 'product'}])
+        self.server = WebhookServer(self.app, port=0, token='secret')
+        self.host, self.port = self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        logging.disable(logging.NOTSET)
+
+    def get(self, request):
+        if request.object_id == 'bad':
+            raise Exception('Unknown id')
+        return {'id': request.object_id, 'sku': 'fetched-' + request.object_id}
+
+    def get_many(self, request):
+        if 'bad' in request.object_ids:
+            raise Exception('Unknown id')
+        return [{'id': id, 'sku': 'fetched-' + id} for id in request.object_ids]
+
+    def process(self, request):
+        for data_object in request.data_objects:
+            self.processed.append(request.get_export_data(data_object)['code'])
+        return 1
+
+    def post(self, path, body, token='secret'):
+        request = Request('http://{}:{}{}'.format(self.host, self.port, path), data=json.dumps(body).encode('utf-8'),
+                          headers={'X-Xenops-Token': token, 'Content-Type': 'application/json'})
+        with urlopen(request) as response:
+            return response.status, json.loads(response.read().decode('utf-8'))
+
+    def test_notification_is_processed(self):
+        status, body = self.post('/source/product', {'objects': [{'id': '1', 'sku': 'a'}], 'ids': ['2']})
+        self.server.stop()
+
+        self.assertEqual((status, body), (202, {'accepted': 2}))
+        self.assertEqual(sorted(self.processed), ['a', 'fetched-2'])
+
+    def test_failed_get_many_fetches_ids_one_by_one(self):
+        self.post('/source/product', {'ids': ['2', 'bad', '3']})
+        self.server.stop()
+
+        self.assertEqual(sorted(self.processed), ['fetched-2', 'fetched-3'])
+
+    def test_invalid_requests(self):
+        for path, body, token, status in [
+            ('/source/product', {}, 'wrong', 401),
+            ('/unknown/product', {}, 'secret', 404),
+            ('/source/product', {'objects': 'a'}, 'secret', 400),
+        ]:
+            with self.assertRaises(HTTPError) as context:
+                self.post(path, body, token)
+            self.assertEqual(context.exception.code, status)
+
+    def test_notify_unknown_type(self):
+        with self.assertRaises(InvalidNotification):
+            self.server.notify('source', 'unknown', {})
+
+    def test_metrics(self):
+        self.post('/source/product', {'objects': [{'id': '1', 'sku': 'a'}]})
+
+        with urlopen('http://{}:{}/metrics'.format(self.host, self.port)) as response:
+            self.assertIn('xenops_webhook_notifications_total{connector="source",datatype="product"}',
+                          response.read().decode('utf-8'))
@@ -7,6 +7,8 @@ xenops
 """
 from xenops.cli import Command
 
+__version__ = '0.0.1'
+
 
 def execute_from_command_line(argv):
     """Run Xenops command line"""
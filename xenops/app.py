@@ -7,16 +7,40 @@ xenops.app
 """
 import os
 import logging
-from pkg_resources import iter_entry_points
 
 from xenops.conf import settings
+from xenops.metrics import metrics
 from xenops.service import ServiceFactory
 from xenops.data import DataTypeFactory
 from xenops.data.types import default_types
 from xenops.connector import Connector, InvalidConnectorConfig
+from xenops.connector.configparser import ConnectorConfig
+from xenops.snapshot import ConfigSnapshot
 
 logger = logging.getLogger(__name__)
 
+ENTRY_POINT_GROUP = 'xenops.services'
+
+
+def iter_service_entry_points():
+    """
+    Get all installed service entry points without importing them
+
+    Uses importlib.metadata, pkg_resources is only used on Python versions without it because importing it is slow.
+
+    :return list:
+    """
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        from pkg_resources import iter_entry_points
+        return list(iter_entry_points(group=ENTRY_POINT_GROUP, name=None))
+
+    all_entry_points = entry_points()
+    if hasattr(all_entry_points, 'select'):
+        return list(all_entry_points.select(group=ENTRY_POINT_GROUP))
+    return list(all_entry_points.get(ENTRY_POINT_GROUP, []))
+
 
 class Application:
     """Application holds all project data"""
@@ -24,39 +48,146 @@ class Application:
     def __init__(self):
         """Load all services and project settings"""
         self.connectors = {}
+        self.connector_configs = {}
+        self.routing = {'enhancers': {}, 'processes': {}}
+        self.entry_points = None
+        self.queue = None
 
         try:
             os.mkdir(settings.BASE_DATA_PATH)
         except OSError:
             pass
 
+        if settings.IS_PROJECT and settings.get('CONFIG_SNAPSHOT', False) and self.load_snapshot():
+            self.setup_connectors()
+            return
+
         # Load all default product types
         for code, config in default_types.items():
             DataTypeFactory.register(code, config)
 
-        self.load_services()
+        self.load_services(self.get_required_service_codes())
 
         if settings.IS_PROJECT:
             logger.debug("Loading project settings")
             self.load_project_types()
             self.load_project_services()
             self.load_project_connectors()
+            if settings.get('CONFIG_SNAPSHOT', False):
+                self.save_snapshot()
+            self.setup_connectors()
 
-    def load_services(self):
-        """Load all services registered with pkg_resources"""
-        for entry_point in iter_entry_points(group='xenops.services', name=None):
-            try:
-                config = entry_point.load()
-            except ImportError:
-                logger.error('Could not load service: ({}), check your setup.py entry_points.'.format(entry_point))
-                continue
+    def get_entry_points(self):
+        """
+        Get installed service entry points
 
-            if type(config) != dict:
-                logger.error('Service config ({}) is not an dict and will not be registered!'.format(entry_point))
+        :return list:
+        """
+        if self.entry_points is None:
+            self.entry_points = iter_service_entry_points()
+        return self.entry_points
 
-            logger.debug("Registering ({}) service".format(entry_point))
-            if not ServiceFactory.register(config):
-                logger.error('Service ({}) could not be registered!'.format(entry_point))
+    def get_config_fingerprint(self):
+        """
+        Get fingerprint of project settings and installed services
+
+        :return str:
+        """
+        return ConfigSnapshot.fingerprint(settings.BASE_PATH, self.get_entry_points())
+
+    def load_snapshot(self):
+        """
+        Load compiled config from snapshot and create connectors
+
+        :return bool: False when there is no valid snapshot
+        """
+        data = ConfigSnapshot(settings.BASE_DATA_PATH).load(self.get_config_fingerprint())
+        if not data:
+            return False
+
+        logger.debug("Loading project from config snapshot")
+        DataTypeFactory.restore(data['datatypes'])
+        ServiceFactory.restore(data['services'])
+        self.routing = data['routing']
+
+        for code, config_parsed in data['connectors'].items():
+            self.connector_configs[code] = config_parsed
+            self.connectors[code] = Connector.create_from_parsed_config(self, config_parsed)
+
+        return True
+
+    def save_snapshot(self):
+        """
+        Save compiled config in snapshot
+
+        :return bool:
+        """
+        return ConfigSnapshot(settings.BASE_DATA_PATH).save(self.get_config_fingerprint(), {
+            'datatypes': DataTypeFactory.get_all(),
+            'services': {config['service'].code: config['service'] for config in self.connector_configs.values()},
+            'connectors': self.connector_configs,
+            'routing': self.routing,
+        })
+
+    def get_required_service_codes(self):
+        """
+        Get service codes used by project connectors, None when all services are needed
+
+        :return set:
+        """
+        if not settings.IS_PROJECT:
+            return None
+
+        return {config.get('service') for config in settings.get('CONNECTORS', {}).values() if config.get('service')}
+
+    def load_services(self, codes=None):
+        """
+        Load services registered with the xenops.services entry point group
+
+        Only entry points named after one of the given service codes are imported. When a code has no entry point
+        with that name (name differs from service code) the remaining entry points are loaded to find it.
+
+        :param set codes: Service codes to load, None loads all services
+        """
+        entry_points = self.get_entry_points()
+
+        if codes is not None:
+            codes = {code for code in codes if not ServiceFactory.get(code)}
+            if not codes:
+                return
+
+            named = [entry_point for entry_point in entry_points if entry_point.name in codes]
+            for entry_point in named:
+                self.load_service(entry_point)
+
+            if all(ServiceFactory.get(code) for code in codes):
+                return
+
+            logger.debug('Not all services found by entry point name, loading remaining services')
+            entry_points = [entry_point for entry_point in entry_points if entry_point not in named]
+
+        for entry_point in entry_points:
+            self.load_service(entry_point)
+
+    def load_service(self, entry_point):
+        """
+        Import entry point and register service
+
+        :param entry_point:
+        """
+        try:
+            config = entry_point.load()
+        except ImportError:
+            logger.error('Could not load service: ({}), check your setup.py entry_points.'.format(entry_point))
+            return
+
+        if type(config) != dict:
+            logger.error('Service config ({}) is not an dict and will not be registered!'.format(entry_point))
+            return
+
+        logger.debug("Registering ({}) service".format(entry_point))
+        if not ServiceFactory.register(config):
+            logger.error('Service ({}) could not be registered!'.format(entry_point))
 
     def load_project_services(self):
         """Load project services"""
@@ -72,19 +203,79 @@ class Application:
 
     def load_project_connectors(self):
         """Load project connectors"""
+        config_parser = ConnectorConfig()
         for code, config in settings.get('CONNECTORS', {}).items():
             config['code'] = code
             try:
-                self.connectors[code] = Connector.create_connector(self, config)
+                self.connector_configs[code] = config_parser.parse(config)
             except InvalidConnectorConfig as e:
                 logger.error('Invalid connector ({}) config: {}'.format(code, e))
+                continue
+
+            self.connectors[code] = Connector.create_from_parsed_config(self, self.connector_configs[code])
+
+        self.routing = config_parser.parse_routing(self.connector_configs)
+
+    def setup_connectors(self):
+        """Set up connector contexts, a connector that fails setup is not loaded"""
+        for code, connector in list(self.connectors.items()):
+            try:
+                connector.setup()
+            except Exception as e:
+                logger.error('Could not setup connector ({}): {}'.format(code, e))
+                connector.close()
+                del self.connectors[code]
+
+    def get_queue(self):
+        """
+        Get durable work queue shared by triggers and workers
+
+        :return xenops.connector.workqueue.WorkQueue:
+        """
+        if not self.queue:
+            from xenops.connector.workqueue import WorkQueue
+
+            self.queue = WorkQueue(
+                os.path.join(settings.BASE_DATA_PATH, 'queue.sqlite'),
+                max_attempts=settings.get('QUEUE_MAX_ATTEMPTS', 5),
+                aging_seconds=settings.get('QUEUE_PRIORITY_AGING', 60)
+            )
+        return self.queue
+
+    def get_spool_path(self, connector_code, trigger_code):
+        """
+        Get directory of trigger spool segments
 
-    def trigger(self, type_code=None, connector_code=None):
+        :param str connector_code:
+        :param str trigger_code:
+        :return str:
+        """
+        return os.path.join(settings.BASE_DATA_PATH, 'spool', connector_code, trigger_code)
+
+    def close(self):
+        """Close all connectors and there pooled resources"""
+        for connector in self.connectors.values():
+            connector.close()
+
+        if self.queue:
+            self.queue.close()
+            self.queue = None
+
+    def __enter__(self):
+        """Use application as context manager, closes connectors on exit"""
+        return self
+
+    def __exit__(self, *args):
+        """Close application"""
+        self.close()
+
+    def trigger(self, type_code=None, connector_code=None, **options):
         """
         Trigger a connector data type import
 
         :param str type_code:
         :param str connector_code:
+        :param options: Override trigger config options
         """
         if not DataTypeFactory.get(type_code):
             raise Exception('Invalid type')
@@ -93,4 +284,39 @@ class Application:
             raise Exception('Connector does not exists')
 
         connector = self.connectors.get(connector_code)
-        connector.execute_trigger(type_code)
+        try:
+            connector.execute_trigger(type_code, **options)
+        finally:
+            self.write_metrics()
+
+    def trigger_all(self, concurrency=4, target_concurrency=None, **options):
+        """
+        Run all connector triggers concurrently, see xenops.scheduler.TriggerScheduler
+
+        :param int concurrency: Number of triggers that run at once
+        :param int target_concurrency: Number of triggers that process into the same connector at once, default half of
+            concurrency
+        :param options: Override trigger config options
+        :return list: Finished xenops.scheduler.TriggerJob objects
+        """
+        from xenops.scheduler import TriggerScheduler
+
+        try:
+            return TriggerScheduler(self, concurrency, target_concurrency).run(**options)
+        finally:
+            self.write_metrics()
+
+    def write_metrics(self, path=None):
+        """
+        Write collected metrics in Prometheus text format to path or settings METRICS_PATH
+
+        :param str path:
+        """
+        path = path if path else settings.get('METRICS_PATH')
+        if not path:
+            return
+
+        try:
+            metrics.write(path)
+        except OSError as e:
+            logger.error('Could not write metrics to ({}): {}'.format(path, e))
@@ -24,11 +24,94 @@ class Command:
         subparsers = parser.add_subparsers(help='sub-command help')
 
         trigger_parser = subparsers.add_parser('trigger', help='Run a trigger')
-        trigger_parser.add_argument('connector', help='Code of connector')
-        trigger_parser.add_argument('trigger', help='Code of trigger')
+        trigger_parser.add_argument('connector', nargs='?', help='Code of connector')
+        trigger_parser.add_argument('trigger', nargs='?', help='Code of trigger')
         trigger_parser.add_argument('-l', '--list', dest='list', action='store_true')
+        trigger_parser.add_argument('--all', dest='all', action='store_true',
+                                    help='Run all triggers, respecting data type dependencies')
+        trigger_parser.add_argument('--concurrency', dest='concurrency', type=int, default=4,
+                                    help='Number of triggers that run at once with --all')
+        trigger_parser.add_argument('--target-concurrency', dest='target_concurrency', type=int,
+                                    help='Number of triggers that process into the same connector at once with --all, '
+                                         'default half of --concurrency')
+        trigger_parser.add_argument('--queue', dest='queue', action='store_true', default=None,
+                                    help='Put objects on the work queue for xenops worker processes')
+        trigger_parser.add_argument('--process-pool', dest='process_pool', type=int, metavar='N',
+                                    help='Map and export objects in N processes')
+        trigger_parser.add_argument('--spool', dest='spool', action='store_true', default=None,
+                                    help='Write objects to spool segments for xenops replay')
+        trigger_parser.add_argument('--spool-format', dest='spool_format', choices=['json', 'msgpack'],
+                                    help='Spool record format, default msgpack when installed')
+        trigger_parser.add_argument('--spool-compress', dest='spool_compress', action='store_true', default=None,
+                                    help='Compress spool records with zlib')
+        trigger_parser.add_argument('--shard', dest='shard', metavar='I/K',
+                                    help='Only process shard I of K (0 based), each shard keeps its own watermark')
+        trigger_parser.add_argument('--metrics-file', dest='metrics_file',
+                                    help='Write metrics in Prometheus text format to file')
+        trigger_parser.add_argument('--metrics-port', dest='metrics_port', type=int,
+                                    help='Serve metrics on http://METRICS_HOST:PORT/metrics while running')
+        trigger_parser.add_argument('--profile', dest='profile', metavar='PATH',
+                                    help='Run trigger under cProfile and write output to PATH')
+        trigger_parser.add_argument('--profile-format', dest='profile_format', default='pstats',
+                                    choices=['pstats', 'collapsed'], help='pstats file or collapsed stacks')
+        trigger_parser.add_argument('--profile-memory', dest='profile_memory', action='store_true',
+                                    help='Also trace memory allocations with tracemalloc')
+        trigger_parser.add_argument('--profile-top', dest='profile_top', type=int, default=20,
+                                    help='Number of entries in profile summary')
         trigger_parser.add_argument('--verbose', '-v', action='count', default=0)
         trigger_parser.set_defaults(func=self.trigger)
+        self.trigger_parser = trigger_parser
+
+        worker_parser = subparsers.add_parser('worker', help='Process objects from the work queue')
+        worker_parser.add_argument('--batch-size', dest='batch_size', type=int, default=100)
+        worker_parser.add_argument('--lease', dest='lease', type=float, default=300,
+                                   help='Seconds before claimed objects are given to other workers')
+        worker_parser.add_argument('--once', dest='once', action='store_true', help='Stop when queue is empty')
+        worker_parser.add_argument('--status', dest='status', action='store_true', help='Show queue status')
+        worker_parser.add_argument('--retry-failed', dest='retry_failed', action='store_true',
+                                   help='Move failed objects back to the queue')
+        worker_parser.add_argument('--metrics-port', dest='metrics_port', type=int,
+                                   help='Serve metrics on http://METRICS_HOST:PORT/metrics while running')
+        worker_parser.add_argument('--verbose', '-v', action='count', default=0)
+        worker_parser.set_defaults(func=self.worker)
+
+        stats_parser = subparsers.add_parser('stats', help='Show trigger throughput statistics')
+        stats_parser.add_argument('connector', nargs='?', help='Code of connector, default all connectors')
+        stats_parser.add_argument('--trigger', dest='trigger', help='Code of trigger, default all triggers')
+        stats_parser.add_argument('--limit', dest='limit', type=int, default=20, help='Number of runs per trigger')
+        stats_parser.add_argument('--verbose', '-v', action='count', default=0)
+        stats_parser.set_defaults(func=self.stats)
+
+        listen_parser = subparsers.add_parser('listen', help='Process change notifications posted to a webhook')
+        listen_parser.add_argument('--host', dest='host', default='127.0.0.1', help='Interface to listen on')
+        listen_parser.add_argument('--port', dest='port', type=int, default=9098)
+        listen_parser.add_argument('--queue', dest='queue', action='store_true',
+                                   help='Put objects on the work queue for xenops worker processes')
+        listen_parser.add_argument('--batch-size', dest='batch_size', type=int, default=100)
+        listen_parser.add_argument('--verbose', '-v', action='count', default=0)
+        listen_parser.set_defaults(func=self.listen)
+
+        replay_parser = subparsers.add_parser('replay', help='Process spooled trigger objects')
+        replay_parser.add_argument('connector', help='Code of connector')
+        replay_parser.add_argument('trigger', help='Code of trigger')
+        replay_parser.add_argument('--file', dest='files', action='append', metavar='PATH',
+                                   help='Replay given segment file, default all spooled segments')
+        replay_parser.add_argument('--keep', dest='keep', action='store_true', help='Keep segments after processing')
+        replay_parser.add_argument('--verbose', '-v', action='count', default=0)
+        replay_parser.set_defaults(func=self.replay)
+        self.replay_parser = replay_parser
+
+        reconcile_parser = subparsers.add_parser('reconcile', help='Process objects that differ between connectors')
+        reconcile_parser.add_argument('source', help='Code of source connector')
+        reconcile_parser.add_argument('target', help='Code of target connector')
+        reconcile_parser.add_argument('type', help='Code of data type')
+        reconcile_parser.add_argument('--buckets', dest='buckets', type=int, default=256,
+                                      help='Number of hash tree buckets')
+        reconcile_parser.add_argument('--dry-run', dest='dry_run', action='store_true',
+                                      help='Only show the differences')
+        reconcile_parser.add_argument('--verbose', '-v', action='count', default=0)
+        reconcile_parser.set_defaults(func=self.reconcile)
+        self.reconcile_parser = reconcile_parser
 
         args = parser.parse_args()
 
@@ -49,20 +132,227 @@ class Command:
 
         :param argparse.Namespace args:
         """
-        app = Application()
+        if not args.list and not args.all and not (args.connector and args.trigger):
+            self.trigger_parser.error('connector and trigger are required, unless --list or --all is given')
+
+        with Application() as app:
+            if not args.list:
+                self.serve_metrics(args.metrics_port)
+
+            if args.list:
+                print('Active triggers:\n')
+                for connector in app.connectors.values():
+                    print('{} ({}):'.format(connector.code, connector.service.code))
+                    for trigger_code, config in connector.triggers.items():
+                        print(' - {}'.format(trigger_code))
+                        for key, value in config.items():
+                            if key in ['type', 'trigger_code']:
+                                continue
+                            print('   - {}: {}'.format(key, value))
+            elif args.profile:
+                from xenops.profiling import Profiler
+
+                profiler = Profiler(args.profile, args.profile_format, args.profile_memory, args.profile_top)
+                try:
+                    with profiler:
+                        self.run_trigger(app, args)
+                finally:
+                    print(profiler.summary())
+            else:
+                self.run_trigger(app, args)
+
+    def serve_metrics(self, port=None):
+        """
+        Serve metrics over HTTP on given port or settings METRICS_PORT
+
+        :param int port:
+        :return http.server.HTTPServer: None when no port is configured
+        """
+        from xenops.conf import settings
+        from xenops.metrics import metrics
+
+        port = port if port else settings.get('METRICS_PORT')
+        if not port:
+            return None
+
+        host = settings.get('METRICS_HOST', '127.0.0.1')
+        server = metrics.serve(host, port)
+        logger.info('Serving metrics on http://{}:{}/metrics'.format(host, port))
+        return server
+
+    def run_trigger(self, app, args):
+        """
+        Run trigger from arguments
+
+        :param xenops.app.Application app:
+        :param argparse.Namespace args:
+        """
+        options = {}
+        if args.queue:
+            options['queue'] = True
+        if args.process_pool is not None:
+            options['process_pool'] = args.process_pool
+        if args.spool:
+            options['spool'] = True
+        if args.spool_format:
+            options['spool_format'] = args.spool_format
+        if args.spool_compress:
+            options['spool_compress'] = True
+        if args.shard:
+            from xenops.connector.shard import Shard, InvalidShard
+            try:
+                options['shard'] = Shard.parse(args.shard)
+            except InvalidShard as e:
+                self.trigger_parser.error(str(e))
+
+        try:
+            if args.all:
+                jobs = app.trigger_all(args.concurrency, args.target_concurrency, **options)
+                for job in jobs:
+                    print('{}: {}'.format(job, job.status))
+                if any(job.status != job.STATUS_SUCCESS for job in jobs):
+                    sys.exit(1)
+            else:
+                app.trigger(args.trigger, args.connector, **options)
+        finally:
+            if args.metrics_file:
+                app.write_metrics(args.metrics_file)
+
+    def worker(self, args):
+        """
+        Run worker sub command
+
+        :param argparse.Namespace args:
+        """
+        from xenops.worker import Worker
+
+        with Application() as app:
+            if args.retry_failed:
+                print('Moved {} failed objects back to queue'.format(app.get_queue().retry_failed()))
+            elif args.status:
+                for status, count in sorted(app.get_queue().counts().items()):
+                    print('{}: {}'.format(status, count))
+            else:
+                self.serve_metrics(args.metrics_port)
+                worker = Worker(app, batch_size=args.batch_size, lease_seconds=args.lease)
+                try:
+                    handled = worker.run(stop_when_empty=args.once)
+                except KeyboardInterrupt:
+                    return
+                logger.info('Worker handled {} objects'.format(handled))
+
+    def listen(self, args):
+        """
+        Run listen sub command
 
-        if args.list:
-            print('Active triggers:\n')
+        :param argparse.Namespace args:
+        """
+        import time
+        from xenops.conf import settings
+        from xenops.webhook import WebhookServer
+
+        with Application() as app:
+            server = WebhookServer(
+                app,
+                host=args.host,
+                port=args.port,
+                token=settings.get('WEBHOOK_TOKEN'),
+                work_queue=app.get_queue() if args.queue else None,
+                batch_size=args.batch_size,
+            )
+            host, port = server.start()
+            print('Listening on http://{}:{}/<connector>/<type>, metrics on /metrics'.format(host, port))
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.stop()
+
+    def replay(self, args):
+        """
+        Run replay sub command
+
+        :param argparse.Namespace args:
+        """
+        with Application() as app:
+            if args.connector not in app.connectors:
+                self.replay_parser.error('connector ({}) does not exist'.format(args.connector))
+            try:
+                run_stats = app.connectors[args.connector].replay(args.trigger, keep=args.keep, paths=args.files)
+            finally:
+                app.write_metrics()
+
+        print('Replayed {} objects in {:.2f}s: {} processed, {} failed'.format(
+            run_stats.seen, run_stats.duration, run_stats.processed, run_stats.failed))
+
+    def reconcile(self, args):
+        """
+        Run reconcile sub command
+
+        :param argparse.Namespace args:
+        """
+        from xenops.data import DataTypeFactory
+        from xenops.reconcile import Reconciler
+
+        with Application() as app:
+            for code in (args.source, args.target):
+                if code not in app.connectors:
+                    self.reconcile_parser.error('connector ({}) does not exist'.format(code))
+            datatype = DataTypeFactory.get(args.type)
+            if not datatype:
+                self.reconcile_parser.error('data type ({}) does not exist'.format(args.type))
+
+            reconciler = Reconciler(app.connectors[args.source], app.connectors[args.target], datatype, args.buckets)
+            result = reconciler.run(dry_run=args.dry_run)
+
+        print('Source objects: {}'.format(result.source_count))
+        print('Target objects: {}'.format(result.target_count))
+        print('Different buckets: {}/{}'.format(result.different_buckets, args.buckets))
+        print('Different objects: {}'.format(len(result.changed)))
+        print('Objects only in target: {}'.format(len(result.extra)))
+        if not args.dry_run:
+            print('Processed: {}, failed: {}'.format(result.pushed, result.failed))
+
+    def stats(self, args):
+        """
+        Run stats sub command
+
+        :param argparse.Namespace args:
+        """
+        from xenops.connector.runstats import summarize_runs
+
+        with Application() as app:
             for connector in app.connectors.values():
-                print('{} ({}):'.format(connector.code, connector.service.code))
-                for trigger_code, config in connector.triggers.items():
-                    print(' - {}'.format(trigger_code))
-                    for key, value in config.items():
-                        if key in ['type', 'trigger_code']:
-                            continue
-                        print('   - {}: {}'.format(key, value))
-        else:
-            app.trigger(args.trigger, args.connector)
+                if args.connector and connector.code != args.connector:
+                    continue
+
+                for (target_code, type_code), count in sorted(connector.storage.count_parked().items()):
+                    print('{}: {} parked objects for {} ({})\n'.format(connector.code, count, target_code, type_code))
+
+                for trigger_code in connector.triggers:
+                    if args.trigger and trigger_code != args.trigger:
+                        continue
+
+                    summary = summarize_runs(connector.storage.get_runs(trigger_code, args.limit))
+                    print('{} ({}):'.format(connector.code, trigger_code))
+                    if not summary:
+                        print('  no runs\n')
+                        continue
+
+                    trend = summary['trend_percent']
+                    print('  runs: {} ({} failed)'.format(summary['runs'], summary['failed_runs']))
+                    print('  avg duration: {:.2f}s'.format(summary['avg_duration']))
+                    print('  objects/s: avg {:.1f}, last {:.1f}, trend {}'.format(
+                        summary['avg_objects_per_second'],
+                        summary['last_objects_per_second'],
+                        '{:+.1f}%'.format(trend) if trend is not None else '-'
+                    ))
+                    for code, latency in sorted(summary['last_latencies'].items()):
+                        print('  process {}: {} calls, p50 {:.3f}s, p90 {:.3f}s, p99 {:.3f}s'.format(
+                            code, latency['count'], latency['p50'], latency['p90'], latency['p99']))
+                    print('')
 
     def validate_service(self, args):
         """Validate service (for service developers checking there config"""
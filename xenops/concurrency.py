@@ -0,0 +1,337 @@
+"""
+xenops.concurrency
+~~~~~~~~~~~~~~~~~~
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import time
+import threading
+
+from xenops.metrics import metrics
+
+# asyncio and concurrent.futures are imported when used, they add noticeably to CLI startup time
+
+# Maximum number of timed out calls per connector that may still be running, new calls fail until some finish
+MAX_ABANDONED_CALLS = 100
+
+
+class RateLimiter:
+    """Thread safe rate limiter that spaces calls evenly to a maximum number of calls per second"""
+
+    def __init__(self, rate):
+        """
+        Init RateLimiter
+
+        :param float rate: Maximum calls per second, None or 0 for no limit
+        """
+        self.interval = 1.0 / rate if rate else 0
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        """Pickle state without lock"""
+        return {'interval': self.interval}
+
+    def __setstate__(self, state):
+        """Restore from pickled state"""
+        self.__init__(1.0 / state['interval'] if state['interval'] else None)
+
+    def reserve(self):
+        """
+        Reserve a call slot
+
+        :return float: Seconds to wait before the call can be made
+        """
+        if not self.interval:
+            return 0
+
+        with self.lock:
+            now = time.monotonic()
+            call_time = max(now, self.next_time)
+            self.next_time = call_time + self.interval
+            return call_time - now
+
+    def wait(self):
+        """Block until call can be made"""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self):
+        """Wait in event loop until call can be made"""
+        import asyncio
+
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def run_coroutine(coroutine):
+    """
+    Run coroutine in a new event loop and return result
+
+    :param coroutine:
+    :return:
+    """
+    import asyncio
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class CallTimeout(Exception):
+    """Call did not finish within timeout Exception"""
+
+    pass
+
+
+class TooManyAbandonedCalls(CallTimeout):
+    """Call was not made because too many timed out calls are still running Exception"""
+
+    pass
+
+
+class AbandonedCalls:
+    """
+    Thread safe count of timed out calls that are still running
+
+    Every connector has its own count, so a hanging service does not block the calls to other services.
+    """
+
+    def __init__(self, name=None, limit=None):
+        """
+        Init AbandonedCalls
+
+        :param str name: Connector code, used as metrics label
+        :param int limit: Maximum number of abandoned calls, default MAX_ABANDONED_CALLS
+        """
+        self.name = name
+        self.limit = limit if limit else MAX_ABANDONED_CALLS
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, count):
+        """
+        Change number of abandoned calls, must be called with lock
+
+        :param int count:
+        """
+        self.count += count
+        if self.name:
+            metrics.set('xenops_abandoned_calls', self.count, connector=self.name)
+
+    def check(self):
+        """Raise TooManyAbandonedCalls when the limit is reached"""
+        if self.count >= self.limit:
+            raise TooManyAbandonedCalls('{} timed out calls of ({}) are still running'.format(self.count, self.name))
+
+
+def call_with_timeout(function, timeout, *args, abandoned=None):
+    """
+    Call function and raise CallTimeout when it does not finish within timeout
+
+    The call runs in a daemon thread that is abandoned on timeout, Python threads can not be stopped. While the limit
+    of given abandoned calls is reached new calls raise TooManyAbandonedCalls without being made.
+
+    :param Callable function:
+    :param float timeout: Seconds, None or 0 calls function directly
+    :param args:
+    :param AbandonedCalls abandoned: Count and limit of abandoned calls
+    :return:
+    """
+    if not timeout:
+        return function(*args)
+
+    abandoned = abandoned if abandoned else AbandonedCalls()
+    abandoned.check()
+    outcome = {}
+
+    def call():
+        try:
+            outcome['result'] = function(*args)
+        except BaseException as e:
+            outcome['error'] = e
+        finally:
+            with abandoned.lock:
+                outcome['done'] = True
+                if outcome.get('abandoned'):
+                    abandoned.add(-1)
+
+    thread = threading.Thread(target=call, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    with abandoned.lock:
+        if not outcome.get('done'):
+            outcome['abandoned'] = True
+            abandoned.add(1)
+            raise CallTimeout('Call did not finish within {}s'.format(timeout))
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+
+async def await_with_timeout(coroutine, timeout):
+    """
+    Await coroutine and raise CallTimeout when it does not finish within timeout
+
+    :param coroutine:
+    :param float timeout: Seconds, None or 0 for no timeout
+    :return:
+    """
+    import asyncio
+
+    if not timeout:
+        return await coroutine
+
+    try:
+        return await asyncio.wait_for(coroutine, timeout)
+    except asyncio.TimeoutError:
+        raise CallTimeout('Call did not finish within {}s'.format(timeout))
+
+
+def _capture(function, item):
+    """
+    Call function and capture exception
+
+    :param Callable function:
+    :param item:
+    :return tuple: (result, exception)
+    """
+    try:
+        return function(item), None
+    except Exception as e:
+        return None, e
+
+
+def run_concurrent(function, items, concurrency=1):
+    """
+    Call function for every item with maximum concurrency threads
+
+    :param Callable function:
+    :param list items:
+    :param int concurrency:
+    :return list: (result, exception) tuple for every item in same order as items
+    """
+    if concurrency <= 1 or len(items) <= 1:
+        return [_capture(function, item) for item in items]
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(items))) as executor:
+        return list(executor.map(lambda item: _capture(function, item), items))
+
+
+def run_async_concurrent(function, items, concurrency=1):
+    """
+    Await coroutine function for every item in one event loop with maximum concurrency pending calls
+
+    :param Callable function: Coroutine function
+    :param list items:
+    :param int concurrency:
+    :return list: (result, exception) tuple for every item in same order as items
+    """
+    import asyncio
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def run(item):
+            async with semaphore:
+                try:
+                    return await function(item), None
+                except Exception as e:
+                    return None, e
+
+        return await asyncio.gather(*[run(item) for item in items])
+
+    return list(run_coroutine(run_all()))
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls with the same key into one call
+
+    The first caller of a key makes the call, callers that arrive while it runs wait and get the same result or
+    exception. Thread calls and coroutine calls are tracked separately, coroutine calls are shared between event loops.
+    """
+
+    def __init__(self):
+        """Init SingleFlight"""
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.async_calls = {}
+
+    def do(self, key, function, *args):
+        """
+        Call function once for all concurrent callers with key
+
+        :param key: Hashable call key
+        :param Callable function:
+        :param args:
+        :return tuple: (result, shared) shared is True when the result came from a call of another caller
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = self.calls[key] = {'event': threading.Event()}
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            call['event'].wait()
+            if 'error' in call:
+                raise call['error']
+            return call['result'], True
+
+        try:
+            call['result'] = function(*args)
+            return call['result'], False
+        except BaseException as e:
+            call['error'] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call['event'].set()
+
+    async def do_async(self, key, function, *args):
+        """
+        Await coroutine function once for all concurrent callers with key, in any event loop
+
+        The call is awaited in the loop of the first caller, the others wait on a thread safe future.
+
+        :param key: Hashable call key
+        :param Callable function: Coroutine function
+        :param args:
+        :return tuple: (result, shared) shared is True when the result came from a call of another caller
+        """
+        import asyncio
+        from concurrent.futures import Future
+
+        with self.lock:
+            future = self.async_calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.async_calls[key] = Future()
+
+        if not leader:
+            return await asyncio.shield(asyncio.wrap_future(future)), True
+
+        try:
+            result = await function(*args)
+            future.set_result(result)
+            return result, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.async_calls[key]
@@ -24,10 +24,21 @@ class Settings:
 
         project_settings = os.environ.get(ENVIRONMENT_VARIABLE)
         if project_settings:
-            self._settings = importlib.import_module(project_settings)
-            self.IS_PROJECT = True
-            self.BASE_PATH = os.path.dirname(self._settings.__file__)
-            self.BASE_DATA_PATH = os.path.join(self.BASE_PATH, 'data')
+            self.load(project_settings)
+
+    def load(self, module):
+        """
+        Load project settings module
+
+        :param module: Module or dotted module name
+        """
+        if isinstance(module, str):
+            module = importlib.import_module(module)
+
+        self._settings = module
+        self.IS_PROJECT = True
+        self.BASE_PATH = os.path.dirname(self._settings.__file__)
+        self.BASE_DATA_PATH = os.path.join(self.BASE_PATH, 'data')
 
     def __getattr__(self, name):
         """Get setting value"""
@@ -0,0 +1,117 @@
+"""
+xenops.connector.breaker
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import time
+import logging
+import threading
+import collections
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpen(Exception):
+    """Circuit breaker is open Exception"""
+
+    pass
+
+
+class CircuitBreaker:
+    """
+    Thread safe circuit breaker for calls to one connector
+
+    The breaker opens when at least min_calls calls were made in the last window seconds and the rate of failed calls
+    (errors and calls slower than slow_call_seconds) reaches error_rate. After open_seconds one trial call is allowed,
+    the breaker closes when it succeeds and opens again when it fails.
+    """
+
+    STATE_CLOSED = 'closed'
+    STATE_OPEN = 'open'
+    STATE_HALF_OPEN = 'half_open'
+
+    def __init__(self, error_rate=0.5, min_calls=20, window=60, open_seconds=30, slow_call_seconds=None, name=''):
+        """
+        Init CircuitBreaker
+
+        :param float error_rate: Rate of failed calls that opens the breaker
+        :param int min_calls: Minimum calls in window before the breaker can open
+        :param float window: Seconds of calls that are counted
+        :param float open_seconds: Seconds before a trial call is allowed
+        :param float slow_call_seconds: Calls slower than this count as failed
+        :param str name: Name used in logging
+        """
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.slow_call_seconds = slow_call_seconds
+        self.name = name
+        self.state = self.STATE_CLOSED
+        self.opened_at = 0
+        self.trial_running = False
+        self.calls = collections.deque()
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        Check if a call is allowed
+
+        :return bool:
+        """
+        with self.lock:
+            if self.state == self.STATE_CLOSED:
+                return True
+
+            if self.state == self.STATE_OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+                self.state = self.STATE_HALF_OPEN
+                self.trial_running = False
+
+            if self.state == self.STATE_HALF_OPEN and not self.trial_running:
+                self.trial_running = True
+                return True
+
+            return False
+
+    def record(self, success, seconds=0.0):
+        """
+        Record call result
+
+        :param bool success:
+        :param float seconds: Duration of call
+        """
+        failed = not success or bool(self.slow_call_seconds and seconds > self.slow_call_seconds)
+        now = time.monotonic()
+
+        with self.lock:
+            if self.state == self.STATE_HALF_OPEN:
+                if failed:
+                    self.open(now)
+                else:
+                    logger.info('Circuit breaker ({}) closed'.format(self.name))
+                    self.state = self.STATE_CLOSED
+                    self.calls.clear()
+                return
+
+            self.calls.append((now, failed))
+            while self.calls and self.calls[0][0] < now - self.window:
+                self.calls.popleft()
+
+            failures = sum(1 for _, call_failed in self.calls if call_failed)
+            if self.state == self.STATE_CLOSED and len(self.calls) >= self.min_calls \
+                    and failures >= self.error_rate * len(self.calls):
+                self.open(now)
+
+    def open(self, now):
+        """
+        Open breaker, must be called with lock
+
+        :param float now:
+        """
+        logger.warning('Circuit breaker ({}) opened for {}s'.format(self.name, self.open_seconds))
+        self.state = self.STATE_OPEN
+        self.opened_at = now
+        self.trial_running = False
+        self.calls.clear()
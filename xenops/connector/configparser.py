@@ -40,9 +40,72 @@ class ConnectorConfig:
             'mapping': self.parse_mapping(service, config),
             'triggers': self.parse_triggers(service, config),
             'enhancers': config.get('enhancers'),
-            'processes': config.get('processes')
+            'processes': config.get('processes'),
+            'timeout': config.get('timeout'),
+            'circuit_breaker': config.get('circuit_breaker'),
         }
 
+    def parse_routing(self, connector_configs):
+        """
+        Parse enhancer and process routing per data type for all connectors
+
+        :param dict connector_configs: Parsed connector configs by connector code
+        :return dict: {'enhancers': {type_code: [config]}, 'processes': {type_code: [config]}}
+        """
+        routing = {'enhancers': {}, 'processes': {}}
+
+        for code, config in connector_configs.items():
+            for enhancer_config in config.get('enhancers') or []:
+                routing['enhancers'].setdefault(enhancer_config.get('type'), []).append({
+                    'connector': code,
+                    'attributes': enhancer_config.get('attributes', {})
+                })
+
+            for process_config in config.get('processes') or []:
+                route = dict(process_config)
+                route['connector'] = code
+                routing['processes'].setdefault(process_config.get('type'), []).append(route)
+
+        self.validate_chains(routing['processes'], connector_configs)
+        return routing
+
+    def validate_chains(self, process_routing, connector_codes=None):
+        """
+        Validate that process configs with `from` name known connectors and form a DAG per data type
+
+        :param dict process_routing: Process configs by type code
+        :param connector_codes: Known connector codes, not checked when not given
+        :raises InvalidConnectorConfig:
+        """
+        for type_code, routes in process_routing.items():
+            edges = {}
+            for route in routes:
+                for source in route.get('from') or []:
+                    if connector_codes is not None and source not in connector_codes:
+                        raise InvalidConnectorConfig(
+                            'Process ({}) of ({}) is chained from unknown connector ({})'.format(
+                                type_code, route['connector'], source))
+                    edges.setdefault(source, set()).add(route['connector'])
+
+            visited = set()
+            path = []
+
+            def visit(code):
+                if code in path:
+                    cycle = path[path.index(code):] + [code]
+                    raise InvalidConnectorConfig(
+                        'Process chain cycle for ({}): {}'.format(type_code, ' -> '.join(cycle)))
+                if code in visited:
+                    return
+                path.append(code)
+                for target in sorted(edges.get(code, [])):
+                    visit(target)
+                path.pop()
+                visited.add(code)
+
+            for code in sorted(edges):
+                visit(code)
+
     def validate(self, config):
         """
         Validate base config
@@ -6,14 +6,28 @@ xenops.connector.connector
 :license: GPLv3
 """
 import os
+import copy
+import time
 import logging
 import datetime
 
 from xenops.conf import settings
-from xenops.service import TriggerRequest, GetRequest, ProcessRequest
+from xenops.metrics import metrics
+from xenops.concurrency import (
+    run_concurrent, run_async_concurrent, call_with_timeout, await_with_timeout, SingleFlight, CallTimeout,
+    AbandonedCalls, TooManyAbandonedCalls
+)
+from xenops.service import TriggerRequest, TriggerPage, GetRequest, GetManyRequest, ProcessRequest
 from xenops.data import DataMapObject, Enhancer
+from xenops.data.datamap import mapping_key, value_digest
 
+from .breaker import CircuitBreaker, CircuitOpen
 from .configparser import ConnectorConfig
+from .context import ConnectorContext
+from .pool import ExportPool
+from .prefetch import Prefetcher
+from .runstats import RunStats
+from .spool import SpoolWriter, read_segment, list_segments
 from .storage import ConnectorStorage
 
 logger = logging.getLogger(__name__)
@@ -25,11 +39,15 @@ class InvalidCode(Exception):
     pass
 
 
+# Seconds the materialized check of a data type is reused by long running processes, it is reset every trigger run
+MATERIALIZED_CHECK_SECONDS = 60
+
+
 class Connector:
     """Connector"""
 
     def __init__(self, app, storage, code, service, verbose_name=None, service_config=None, mapping=None, triggers=None,
-                 enhancers=None, processes=None):
+                 enhancers=None, processes=None, timeout=None, circuit_breaker=None):
         """
         Init Connector
 
@@ -42,6 +60,8 @@ class Connector:
         :param dict triggers:
         :param list enhancers:
         :param list processes:
+        :param float timeout: Seconds before process and get calls to this connector are abandoned
+        :param dict circuit_breaker: xenops.connector.breaker.CircuitBreaker options for calls to this connector
         """
         self.app = app
         self.storage = storage
@@ -50,9 +70,16 @@ class Connector:
         self.verbose_name = verbose_name if verbose_name else code
         self.service_config = service_config if service_config else {}
         self.mapping = mapping if mapping else {}
+        self.mapping_keys = {}
         self.triggers = triggers if triggers else {}
         self.enhancers = enhancers if enhancers else []
         self.processes = processes if processes else []
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(name=code, **circuit_breaker) if circuit_breaker else None
+        self.inflight = SingleFlight()
+        self.abandoned = AbandonedCalls(code)
+        self.materialized_checks = {}
+        self.context = ConnectorContext(self)
 
     @classmethod
     def create_connector(cls, app, config):
@@ -63,83 +90,790 @@ class Connector:
         :param dict config:
         :return Connector:
         """
-        config_parsed = ConnectorConfig().parse(config)
+        return cls.create_from_parsed_config(app, ConnectorConfig().parse(config))
+
+    @classmethod
+    def create_from_parsed_config(cls, app, config_parsed):
+        """
+        Create connector based on parsed config
+
+        :param xenops.app.Application app:
+        :param dict config_parsed:
+        :return Connector:
+        """
         storage_path = os.path.join(settings.BASE_DATA_PATH, 'connector-{}.sqlite'.format(config_parsed['code']))
         return cls(
             app,
-            ConnectorStorage(storage_path),
+            ConnectorStorage(storage_path, config_parsed['code'], settings.get('RUNS_RETENTION', 1000)),
             **config_parsed
         )
 
-    def execute_trigger(self, trigger_code):
+    def setup(self):
+        """Let service setup pooled resources in connector context"""
+        self.service.setup(self.context)
+
+    def close(self):
+        """Let service teardown connector context and close pooled resources"""
+        try:
+            self.service.teardown(self.context)
+        except Exception as e:
+            logger.error('Error in teardown of connector ({}): {}'.format(self.code, str(e)))
+        self.context.close()
+
+    def execute_trigger(self, trigger_code, **options):
         """
         Run trigger process based on trigger code
 
+        Trigger config options (can be overridden with options):
+
+        - page_size: number of objects per page when the service yields single objects (default 100)
+        - prefetch: number of pages fetched in background while current page is processed, 0 disables (default 1)
+        - queue: put raw objects on the work queue for `xenops worker` processes instead of processing them
+        - process_pool: number of processes that map and export objects, for CPU heavy mappings (default 0)
+        - chunk_size: number of objects per process pool task (default 100)
+        - shard: only process objects of given xenops.connector.shard.Shard, with its own watermark and cursor
+        - spool: write raw objects to spool segments for `xenops replay` instead of processing them
+        - spool_format: json or msgpack (default msgpack when installed)
+        - spool_compress: zlib compress spool records (default False)
+        - priority_attributes: priority per data type attribute, objects get the highest priority of their changed
+          attributes. Without queue only the objects within a page are ordered by priority
+        - materialize: save the latest raw data and mapped attributes of every object in the local store, True or a
+          list of attribute codes to index. Enhancers on this connector read the local copy instead of calling get
+        - materialize_max_age: seconds the trigger watermark may be old before enhancers call get again (default no
+          limit)
+
         :param str trigger_code:
+        :param options: Override trigger config options
         """
         trigger = self.triggers.get(trigger_code)
         if not trigger:
             raise InvalidCode('{} is not a valid trigger code for ({}) connector'.format(trigger_code, self.code))
+        trigger = dict(trigger, **options)
 
         service_type = self.service.types.get(trigger_code)
-        enhancer_configs = self.get_enhancers_config(service_type.datatype.code)
         process_configs = self.get_processes_config(service_type.datatype.code)
 
         # TODO: Lock trigger if trigger is already running
 
-        start_time = datetime.datetime.now()
+        # Local stores may change with this run, check them again
+        for connector in self.app.connectors.values():
+            connector.materialized_checks.clear()
+
+        run_stats = RunStats(trigger_code)
+        try:
+            self.run_trigger(trigger_code, trigger, service_type, process_configs, run_stats)
+        except BaseException:
+            run_stats.finish(RunStats.STATUS_FAILED)
+            raise
+        else:
+            run_stats.finish()
+        finally:
+            self.storage.add_run(run_stats)
+
+            labels = {'connector': self.code, 'datatype': service_type.datatype.code}
+            metrics.observe('xenops_trigger_seconds', run_stats.duration, **labels)
+            metrics.inc('xenops_trigger_objects_total', run_stats.seen, **labels)
+            metrics.set('xenops_trigger_objects_per_second',
+                        run_stats.seen / run_stats.duration if run_stats.duration else 0, **labels)
+
+    def run_trigger(self, trigger_code, trigger, service_type, process_configs, run_stats):
+        """
+        Fetch trigger pages and process them
+
+        :param str trigger_code:
+        :param dict trigger:
+        :param xenops.service.ServiceType service_type:
+        :param list process_configs:
+        :param xenops.connector.runstats.RunStats run_stats:
+        """
+        start_time = run_stats.start_time
+        shard = trigger.get('shard')
+        state_key = shard.storage_key(trigger_code) if shard else trigger_code
+
+        last_run = self.storage.get_last_run(state_key)
+        if last_run is None and shard:
+            last_run = self.storage.get_last_run(trigger_code)
+        cursor = self.storage.get_cursor(state_key)
+        # Only a complete listing of all objects shows which materialized objects were deleted
+        full_run = last_run is None and cursor is None and not shard
 
         trigger_request = TriggerRequest(
-            service_config={},
-            trigger_config={},
-            last_run=self.storage.get_last_run(trigger_code)
+            service_config=self.service_config,
+            trigger_config=trigger,
+            last_run=last_run,
+            cursor=cursor,
+            context=self.context,
+            shard=shard
         )
-        for object_data in service_type.trigger(trigger_request):
-            enhancers = []
-            for enhancer_config in enhancer_configs:
-                enhancers.append(Enhancer(
-                    connector=enhancer_config['connector'],
-                    mapping=enhancer_config['mapping'],
-                    attributes=enhancer_config['attributes']
-                ))
 
-            data = DataMapObject(
-                connector=self,
-                datatype=service_type.datatype,
-                enhancers=enhancers,
-                data=object_data
+        self.retry_parked(service_type.datatype, run_stats)
+
+        pages = service_type.trigger_pages(trigger_request, trigger.get('page_size', 100))
+        if trigger.get('prefetch', 1):
+            pages = Prefetcher(pages, trigger.get('prefetch', 1))
+        pages = iter(pages)
+
+        queue = self.app.get_queue() if trigger.get('queue') else None
+        spool = None
+        if trigger.get('spool') and not queue:
+            spool = SpoolWriter(
+                self.app.get_spool_path(self.code, trigger_code),
+                trigger.get('spool_format'),
+                trigger.get('spool_compress', False)
             )
 
-            # TODO: Make queue per processes and use multiple threads to call process function.
-            # TODO: dont call process from own connector trigger
+        export_pool = None
+        if trigger.get('process_pool') and not queue and not spool:
+            if self.get_enhancers_config(service_type.datatype.code):
+                logger.warning('Process pool is not used for ({}), enhancers need the connectors'.format(trigger_code))
+            else:
+                export_pool = ExportPool(
+                    ExportPool.create_state(self, service_type.datatype, process_configs),
+                    trigger['process_pool'],
+                    trigger.get('chunk_size', 100)
+                )
 
-            for process_config in process_configs:
-                logger.info('Processing {}:{} for object {}'.format(
-                    process_config['connector'].code,
-                    service_type.datatype.code,
-                    data
-                ))
+        try:
+            self.process_pages(
+                state_key, pages, service_type, process_configs, run_stats, queue, export_pool, shard, spool,
+                trigger.get('priority_attributes'), trigger.get('materialize'))
+        finally:
+            if export_pool:
+                export_pool.close()
+            if spool:
+                spool.close()
+
+        self.storage.set_cursor(state_key, None)
+        self.storage.set_last_run(state_key, start_time)
+        if shard:
+            self.merge_shard_watermarks(trigger_code, shard)
+        if full_run and trigger.get('materialize'):
+            self.storage.prune_materialized(service_type.datatype, start_time)
+        self.materialized_checks.clear()
 
+    def merge_shard_watermarks(self, trigger_code, shard):
+        """
+        Set trigger last run to the oldest shard watermark once every shard has run
+
+        :param str trigger_code:
+        :param xenops.connector.shard.Shard shard:
+        :return bool: True when the watermarks are merged
+        """
+        last_runs = []
+        for key in shard.storage_keys(trigger_code):
+            last_run = self.storage.get_last_run(key)
+            if last_run is None:
+                logger.info('Shard ({}) has not run yet, keep ({}) last run'.format(key, trigger_code))
+                return False
+            last_runs.append(last_run)
+
+        self.storage.set_last_run(trigger_code, min(last_runs))
+        return True
+
+    def process_pages(self, trigger_code, pages, service_type, process_configs, run_stats, queue=None,
+                      export_pool=None, shard=None, spool=None, priority_attributes=None, materialize=None):
+        """
+        Process trigger pages and keep trigger watermark and cursor up to date
+
+        :param str trigger_code: Storage key of trigger watermark and cursor
+        :param Iterator pages:
+        :param xenops.service.ServiceType service_type:
+        :param list process_configs:
+        :param xenops.connector.runstats.RunStats run_stats:
+        :param xenops.connector.workqueue.WorkQueue queue: Put objects on queue instead of processing them
+        :param xenops.connector.pool.ExportPool export_pool: Export objects in worker processes
+        :param xenops.connector.shard.Shard shard: Skip objects outside shard
+        :param xenops.connector.spool.SpoolWriter spool: Write objects to spool instead of processing them
+        :param dict priority_attributes: Priority per attribute, used when attribute changed
+        :param materialize: Save objects in local store, True or list of attribute codes to index
+        """
+        start_time = run_stats.start_time
+        labels = {'connector': self.code, 'datatype': service_type.datatype.code}
+        # A resumed run must get the same last run as the run that saved the cursor, else the pages differ
+        paged = self.storage.get_cursor(trigger_code) is not None
+        while True:
+            with metrics.timer('xenops_trigger_fetch_seconds', **labels):
+                page = next(pages, None)
+            if page is None:
+                break
+            paged = paged or page.cursor is not None
+
+            run_stats.add(seen=len(page))
+            if shard:
+                objects = [data for data in page if shard.contains(service_type, data)]
+                run_stats.add(skipped=len(page) - len(objects))
+                page = TriggerPage(objects, page.cursor)
+
+            data_objects = [self.create_data_object(service_type.datatype, object_data) for object_data in page]
+            if materialize:
+                indexes = materialize if isinstance(materialize, (list, tuple)) else []
+                self.materialize(service_type.datatype, data_objects, indexes)
+            if export_pool:
+                for data, exports in zip(data_objects, export_pool.export(page.objects)):
+                    data.exports = exports
+
+            if spool:
+                spool.write(page.objects)
+            else:
+                priorities, snapshots = self.get_priorities(service_type, data_objects, priority_attributes)
+                failed = []
+                if queue:
+                    queue.put_many(self.code, service_type.datatype.code, page.objects, priorities)
+                elif priorities:
+                    ordered = sorted(zip(priorities, data_objects), key=lambda item: -item[0])
+                    failed = self.process_data_objects([data for _, data in ordered], process_configs, run_stats)
+                else:
+                    failed = self.process_data_objects(data_objects, process_configs, run_stats)
+
+                # Snapshots of failed objects are kept, so they get the same priority next run
+                for data in failed:
+                    snapshots.pop(data.get_local_id(), None)
+                if snapshots:
+                    self.storage.set_attribute_snapshots(service_type.datatype, 'priority', snapshots)
+
+            # TODO: update last run with object updated_at
+            if not paged:
+                for data in data_objects:
+                    update_time = data.get_update_at()
+                    if update_time and update_time < start_time:
+                        self.storage.set_last_run(trigger_code, update_time)
+
+            if page.cursor is not None:
+                self.storage.set_cursor(trigger_code, page.cursor)
+
+    def get_priorities(self, service_type, data_objects, priority_attributes=None):
+        """
+        Get process priority of data objects, the highest of data type priority, service priority and the priority of
+        changed attributes
+
+        The attribute snapshots are returned instead of saved, they must be saved when the objects are processed or
+        queued.
+
+        :param xenops.service.ServiceType service_type:
+        :param list data_objects:
+        :param dict priority_attributes: Priority per data type attribute
+        :return tuple: (priority per data object or None when no priorities are configured, snapshots by local id)
+        """
+        datatype = service_type.datatype
+        digests = {}
+        if not datatype.priority and not service_type.priority_function and not priority_attributes:
+            return None, digests
+
+        priorities = [datatype.priority] * len(data_objects)
+        if service_type.priority_function:
+            priorities = [
+                max(priority, service_type.priority_function(data.data) or 0)
+                for priority, data in zip(priorities, data_objects)
+            ]
+
+        if priority_attributes:
+            attributes = sorted(priority_attributes)
+            previous = self.storage.get_attribute_snapshots(
+                datatype, 'priority', [data.get_local_id() for data in data_objects])
+            for index, data in enumerate(data_objects):
+                local_id = data.get_local_id()
+                digests[local_id] = {code: value_digest(data.get(code)) for code in attributes}
+                changed = [
+                    priority_attributes[code] for code in attributes
+                    if previous.get(local_id, {}).get(code) != digests[local_id][code]
+                ]
+                priorities[index] = max([priorities[index]] + changed)
+
+        return priorities, digests
+
+    def replay(self, trigger_code, keep=False, paths=None):
+        """
+        Process spooled trigger objects, the trigger watermark is not changed
+
+        :param str trigger_code:
+        :param bool keep: Keep segments after processing, for example to replay a production run again
+        :param list paths: Segment files, default all spooled segments of trigger
+        :return xenops.connector.runstats.RunStats:
+        """
+        trigger = self.triggers.get(trigger_code)
+        if not trigger:
+            raise InvalidCode('{} is not a valid trigger code for ({}) connector'.format(trigger_code, self.code))
+
+        datatype = self.service.types.get(trigger_code).datatype
+        process_configs = self.get_processes_config(datatype.code)
+        if paths is None:
+            paths = list_segments(self.app.get_spool_path(self.code, trigger_code))
+
+        run_stats = RunStats('{}:replay'.format(trigger_code))
+        try:
+            for path in paths:
+                for objects in read_segment(path):
+                    run_stats.add(seen=len(objects))
+                    data_objects = [self.create_data_object(datatype, object_data) for object_data in objects]
+                    self.process_data_objects(data_objects, process_configs, run_stats)
+                if not keep:
+                    os.remove(path)
+        except BaseException:
+            run_stats.finish(RunStats.STATUS_FAILED)
+            raise
+        else:
+            run_stats.finish()
+        finally:
+            self.storage.add_run(run_stats)
+
+        return run_stats
+
+    def materialize(self, datatype, data_objects, indexes=None):
+        """
+        Save latest raw data and mapped attributes of data objects in the local store
+
+        :param xenops.data.DataType datatype:
+        :param list data_objects:
+        :param list indexes: Attribute codes to index, the generic id attribute is always indexed
+        """
+        service_type = self.service.types.get(datatype.code)
+        if not service_type.id_converter:
+            logger.warning(
+                'Can not materialize ({}) objects of ({}) without id converter'.format(datatype.code, self.code))
+            return
+
+        mapping = self.get_mapping(datatype)
+        objects = []
+        for data in data_objects:
+            try:
+                object_id = service_type.id_converter.import_attribute(data.data)
+            except KeyError:
+                continue
+
+            attributes = {}
+            for code, converter in mapping.items():
                 try:
-                    process_config['connector'].service.types.get(service_type.datatype.code).process(
-                        ProcessRequest(
-                            connector=process_config['connector'],
-                            process_config={},
-                            data_objects=[data]
-                        ))
-                except Exception as e:
+                    attributes[code] = converter.import_attribute(data.data)
+                except KeyError:
+                    pass
+            objects.append((object_id, data.get_local_id(), data.data, attributes))
+
+        indexes = list(indexes or [])
+        if datatype.generic_attribute_id and datatype.generic_attribute_id not in indexes:
+            indexes.append(datatype.generic_attribute_id)
+        self.storage.set_materialized(datatype, objects, indexes)
+
+    def is_materialized(self, datatype):
+        """
+        Check if the local store of data type can be read: the trigger materializes objects, completed a run and its
+        watermark is not older than materialize_max_age
+
+        The watermark of a sharded trigger is the oldest shard watermark, it is read once per trigger run.
+
+        :param xenops.data.DataType datatype:
+        :return bool:
+        """
+        trigger = self.triggers.get(datatype.code)
+        if not trigger or not trigger.get('materialize'):
+            return False
+
+        check = self.materialized_checks.get(datatype.code)
+        if check is None or time.monotonic() - check[1] > MATERIALIZED_CHECK_SECONDS:
+            check = (self.get_materialized_run(datatype.code), time.monotonic())
+            self.materialized_checks[datatype.code] = check
+        last_run = check[0]
+        if last_run is None:
+            return False
+
+        max_age = trigger.get('materialize_max_age')
+        return not max_age or (datetime.datetime.now() - last_run).total_seconds() <= max_age
+
+    def get_materialized_run(self, trigger_code):
+        """
+        Get watermark of the last complete run of trigger, for a sharded trigger once every shard has run
+
+        :param str trigger_code:
+        :return datetime.datetime: None when the trigger did not complete a run
+        """
+        shard = self.triggers.get(trigger_code, {}).get('shard')
+        if not shard:
+            return self.storage.get_last_run(trigger_code)
+
+        last_runs = [self.storage.get_last_run(key) for key in shard.storage_keys(trigger_code)]
+        if None in last_runs:
+            return self.storage.get_last_run(trigger_code)
+        return min(last_runs)
+
+    def get_local(self, datatype, object_id=None, local_id=None, generic_id=None):
+        """
+        Get data object from the local store by object id, local id or generic id
+
+        :param xenops.data.DataType datatype:
+        :param str object_id:
+        :param str local_id:
+        :param str generic_id:
+        :return xenops.data.DataMapObject: None when the store can not be read or has no object
+        """
+        if not self.is_materialized(datatype):
+            return None
+
+        row = self.storage.get_materialized(datatype, object_id=object_id, local_id=local_id)
+        if row is None and object_id is None and generic_id is not None and datatype.generic_attribute_id:
+            rows = self.storage.find_materialized(datatype, datatype.generic_attribute_id, generic_id, limit=1)
+            row = rows[0] if rows else None
+
+        metrics.inc('xenops_materialized_reads_total', connector=self.code, datatype=datatype.code,
+                    result='hit' if row else 'miss')
+        return self.create_materialized_object(datatype, row) if row else None
+
+    def find_local(self, datatype, attribute, value, limit=100):
+        """
+        Find data objects in the local store by indexed attribute value
+
+        :param xenops.data.DataType datatype:
+        :param str attribute: Attribute code in the trigger materialize indexes
+        :param value:
+        :param int limit:
+        :return list:
+        """
+        return [
+            self.create_materialized_object(datatype, row)
+            for row in self.storage.find_materialized(datatype, attribute, value, limit)
+        ]
+
+    def create_materialized_object(self, datatype, row):
+        """
+        Create DataMapObject from local store row, saved mapped attributes are used as mapping cache
+
+        :param xenops.data.DataType datatype:
+        :param tuple row: (object id, local id, raw data, mapped attributes)
+        :return xenops.data.DataMapObject:
+        """
+        object_id, local_id, object_data, attributes = row
+        data_object = DataMapObject(connector=self, datatype=datatype, enhancers=[], data=object_data)
+        data_object.local_id = local_id
+        data_object.object_ids[self.code] = object_id
+        data_object.cached_mapping_data = dict(attributes)
+        return data_object
+
+    def create_data_object(self, datatype, object_data):
+        """
+        Create DataMapObject with enhancers for raw service data
+
+        :param xenops.data.DataType datatype:
+        :param dict object_data:
+        :return xenops.data.DataMapObject:
+        """
+        enhancers = []
+        for enhancer_config in self.get_enhancers_config(datatype.code):
+            enhancers.append(Enhancer(
+                connector=enhancer_config['connector'],
+                mapping=enhancer_config['mapping'],
+                attributes=enhancer_config['attributes']
+            ))
+
+        return DataMapObject(
+            connector=self,
+            datatype=datatype,
+            enhancers=enhancers,
+            data=object_data
+        )
+
+    def process_data_objects(self, data_objects, process_configs, run_stats=None, park=True):
+        """
+        Call process of all given process configs for data objects
+
+        Per process connector the service capabilities decide how process is called: data objects are send in
+        batches of batch_size and requests run with the declared concurrency (threads, or one event loop for async
+        services). Failed requests of idempotent services are retried once. A process config with attributes only
+        receives the objects for which one of these attributes changed since it was last processed. Objects for a
+        process connector with an open circuit breaker are parked and processed again by the next trigger run.
+        Objects that are processed into a connector are passed on to the process configs with that connector in
+        `from` within the same call, an object fails when it fails for one of these chained connectors.
+
+        :param list data_objects:
+        :param list process_configs:
+        :param xenops.connector.runstats.RunStats run_stats:
+        :param bool park: Park objects for an open circuit breaker, when False they are failed
+        :return list: data objects that failed for at least one process connector
+        """
+        failed = []
+        if not data_objects:
+            return failed
+
+        if process_configs:
+            self.load_enhancers(data_objects)
+
+        # TODO: dont call process from own connector trigger
+        datatype = data_objects[0].datatype
+        for process_config in process_configs:
+            connector = process_config['connector']
+            service_type = connector.service.types.get(datatype.code)
+            capabilities = service_type.capabilities
+
+            objects = data_objects
+            subscription = None
+            if process_config.get('attributes'):
+                objects, subscription = self.filter_subscribed(connector, datatype, process_config, data_objects)
+                if run_stats:
+                    run_stats.add(skipped=len(data_objects) - len(objects))
+
+            requests = [
+                ProcessRequest(
+                    connector=connector,
+                    process_config=process_config,
+                    data_objects=objects[i:i + capabilities.batch_size],
+                    run_stats=run_stats
+                )
+                for i in range(0, len(objects), capabilities.batch_size)
+            ]
+
+            for request in requests:
+                logger.info('Processing {}:{} for objects {}'.format(
+                    connector.code,
+                    datatype.code,
+                    ', '.join(str(data) for data in request.data_objects)
+                ))
+
+            chained_configs = connector.get_processes_config(datatype.code, chained=True)
+            chained = []
+
+            process, process_async = self.timed_process(service_type, connector, datatype, run_stats)
+            if capabilities.is_async and capabilities.concurrency > 1:
+                results = run_async_concurrent(process_async, requests, capabilities.concurrency)
+            else:
+                results = run_concurrent(process, requests, capabilities.concurrency)
+
+            for request, (result, error) in zip(requests, results):
+                if isinstance(error, CircuitOpen) and park:
+                    self.park(connector, request.data_objects, str(error), run_stats)
+                    continue
+
+                # A timed out call may still be running, only retry when the service allows calls at the same time
+                retry = not isinstance(error, CallTimeout) or capabilities.retry_timeout
+                if error and capabilities.idempotent and retry and not isinstance(error, CircuitOpen):
+                    logger.warning('Retry processing data for process ({}:{}): {}'.format(
+                        connector.code,
+                        datatype.code,
+                        str(error)
+                    ))
+                    result, error = run_concurrent(process, [request])[0]
+
+                if error:
                     logger.error('Error processing data for process ({}:{}): {}'.format(
-                        process_config['connector'].code,
-                        service_type.datatype.code,
-                        str(e)
+                        connector.code,
+                        datatype.code,
+                        str(error)
                     ))
 
-                # TODO: update last run with object updated_at
-                update_time = data.get_update_at()
-                if update_time and update_time < start_time:
-                    self.storage.set_last_run(trigger_code, update_time)
+                if error:
+                    failed += [data for data in request.data_objects if data not in failed]
+                else:
+                    request.save_export_snapshots()
+                    if subscription:
+                        connector.storage.set_attribute_snapshots(datatype, subscription[0], {
+                            data.get_local_id(): subscription[1][data.get_local_id()] for data in request.data_objects
+                        })
+                    if chained_configs:
+                        chained += [
+                            (connector.create_chained_object(request, data), data) for data in request.data_objects
+                        ]
+
+                if run_stats:
+                    if error:
+                        run_stats.add(failed=len(request.data_objects))
+                    else:
+                        run_stats.add(processed=len(request.data_objects))
+
+            if chained:
+                chained_failed = connector.process_data_objects(
+                    [chained_data for chained_data, _ in chained], chained_configs, run_stats, park)
+                failed += [
+                    data for chained_data, data in chained if chained_data in chained_failed and data not in failed
+                ]
+
+        return failed
+
+    def load_enhancers(self, data_objects):
+        """
+        Load enhancer data of data objects with one get_many call per enhancer connector
+
+        Objects in the local store of the enhancer connector are read from it. When the batch call fails the enhancers
+        load their data one by one when an attribute is used.
+
+        :param list data_objects:
+        """
+        pending = {}
+        for data in data_objects:
+            for enhancer in data.enhancers:
+                if enhancer.data is None:
+                    pending.setdefault(enhancer.connector.code, []).append(enhancer)
+
+        for enhancers in pending.values():
+            connector = enhancers[0].connector
+            datatype = enhancers[0].source_object.datatype
+            remote = [enhancer for enhancer in enhancers if not enhancer.load_local()]
+            if not remote:
+                continue
+
+            try:
+                with metrics.timer('xenops_enhancer_fetch_seconds', connector=connector.code, datatype=datatype.code):
+                    objects = connector.get_many(
+                        datatype, object_ids=[enhancer.source_object.get('id') for enhancer in remote])
+            except Exception as e:
+                logger.warning('Could not get enhancer data from ({}) in batch: {}'.format(connector.code, e))
+                continue
+
+            if len(objects) != len(remote):
+                logger.warning(
+                    'Enhancer connector ({}) returned {} of {} objects, objects are loaded one by one'.format(
+                        connector.code, len(objects), len(remote)))
+                continue
+
+            for enhancer, data_object in zip(remote, objects):
+                enhancer.data = data_object
+
+    def create_chained_object(self, request, data_object):
+        """
+        Create data object of this connector for an object that is processed into it
+
+        The object data is the data set by the process with request.emit, or else the export data for this connector.
+
+        :param xenops.service.ProcessRequest request:
+        :param xenops.data.DataMapObject data_object:
+        :return xenops.data.DataMapObject:
+        """
+        object_data = request.emitted.get(id(data_object))
+        if object_data is None:
+            object_data = request.get_export_data(data_object)
+
+        chained = self.create_data_object(data_object.datatype, dict(object_data))
+        chained.local_id = data_object.get_local_id()
+        return chained
+
+    def park(self, connector, data_objects, error, run_stats=None):
+        """
+        Park data objects for process connector
+
+        :param Connector connector: Process connector
+        :param list data_objects:
+        :param str error:
+        :param xenops.connector.runstats.RunStats run_stats:
+        """
+        datatype = data_objects[0].datatype
+        logger.warning('Parked {} objects for ({}:{}): {}'.format(
+            len(data_objects), connector.code, datatype.code, error))
+        self.storage.park(connector.code, datatype, [data.data for data in data_objects], error)
+        metrics.inc('xenops_parked_objects_total', len(data_objects), connector=connector.code, datatype=datatype.code)
+        if run_stats:
+            run_stats.add(skipped=len(data_objects))
+
+    def retry_parked(self, datatype, run_stats=None, limit=1000):
+        """
+        Process parked objects again for process connectors whose circuit breaker allows calls
+
+        :param xenops.data.DataType datatype:
+        :param xenops.connector.runstats.RunStats run_stats:
+        :param int limit: Maximum number of objects per call
+        :return int: Number of processed objects
+        """
+        processed = 0
+        for target_code, parked in self.storage.get_parked(datatype, limit).items():
+            process_configs = [
+                config for config in self.get_processes_config(datatype.code) if config['connector'].code == target_code
+            ]
+            if not process_configs:
+                continue
+
+            data_objects = [self.create_data_object(datatype, object_data) for _, object_data in parked]
+            failed = self.process_data_objects(data_objects, process_configs, run_stats, park=False)
+            self.storage.remove_parked([
+                parked_id for (parked_id, _), data in zip(parked, data_objects) if data not in failed
+            ])
+            processed += len(data_objects) - len(failed)
+
+        if processed:
+            logger.info('Processed {} parked ({}) objects'.format(processed, datatype.code))
+        return processed
 
-        self.storage.set_last_run(trigger_code, start_time)
+    @staticmethod
+    def filter_subscribed(connector, datatype, process_config, data_objects):
+        """
+        Filter data objects on changed subscribed attributes of process config
+
+        :param Connector connector: Process connector
+        :param xenops.data.DataType datatype:
+        :param dict process_config:
+        :param list data_objects:
+        :return tuple: (changed data objects, (snapshot scope, attribute digests by local id))
+        """
+        attributes = sorted(process_config['attributes'])
+        scope = 'attributes:{}'.format(','.join(attributes))
+        previous = connector.storage.get_attribute_snapshots(
+            datatype, scope, [data.get_local_id() for data in data_objects])
+
+        changed = []
+        digests = {}
+        for data in data_objects:
+            local_id = data.get_local_id()
+            digests[local_id] = {code: value_digest(data.get(code)) for code in attributes}
+            if previous.get(local_id) != digests[local_id]:
+                changed.append(data)
+
+        return changed, (scope, digests)
+
+    def timed_process(self, service_type, connector, datatype, run_stats=None):
+        """
+        Wrap process functions of service type to record latency in metrics and run stats
+
+        :param xenops.service.ServiceType service_type:
+        :param Connector connector: Process connector
+        :param xenops.data.DataType datatype:
+        :param xenops.connector.runstats.RunStats run_stats:
+        :return tuple: (process, process_async)
+        """
+        labels = {'connector': connector.code, 'datatype': datatype.code}
+
+        def record(seconds):
+            metrics.observe('xenops_process_seconds', seconds, **labels)
+            if run_stats:
+                run_stats.add_latency(connector.code, seconds)
+
+        def process(request):
+            connector.check_breaker()
+            start = time.perf_counter()
+            success = False
+            try:
+                result = call_with_timeout(
+                    service_type.process, connector.timeout, request, abandoned=connector.abandoned)
+                success = True
+                return result
+            except TooManyAbandonedCalls:
+                success = None  # call was not made
+                raise
+            finally:
+                if success is not None:
+                    record(time.perf_counter() - start)
+                    connector.record_call(success, time.perf_counter() - start)
+
+        async def process_async(request):
+            connector.check_breaker()
+            start = time.perf_counter()
+            success = False
+            try:
+                result = await await_with_timeout(service_type.process_async(request), connector.timeout)
+                success = True
+                return result
+            finally:
+                record(time.perf_counter() - start)
+                connector.record_call(success, time.perf_counter() - start)
+
+        return process, process_async
+
+    def check_breaker(self):
+        """Raise CircuitOpen when the circuit breaker of this connector does not allow calls"""
+        if self.breaker and not self.breaker.allow():
+            raise CircuitOpen('Circuit breaker of connector ({}) is open'.format(self.code))
+
+    def record_call(self, success, seconds):
+        """
+        Record call result in circuit breaker
+
+        :param bool success:
+        :param float seconds:
+        """
+        if self.breaker:
+            self.breaker.record(success, seconds)
 
     def get(self, datatype, object_id, generic_id=None):
         """
@@ -155,7 +889,28 @@ class Connector:
             raise Exception('There is no service type for given type code')
 
         # TODO: add id and generic_id to mapping type config
-        object_data = service_type.get(GetRequest(service_config={}, object_id=object_id, generic_id=generic_id))
+        def fetch():
+            self.check_breaker()
+            start = time.perf_counter()
+            success = False
+            try:
+                result = call_with_timeout(service_type.get, self.timeout, GetRequest(
+                    service_config=self.service_config,
+                    object_id=object_id,
+                    generic_id=generic_id,
+                    context=self.context
+                ), abandoned=self.abandoned)
+                success = True
+                return result
+            except TooManyAbandonedCalls:
+                success = None  # call was not made
+                raise
+            finally:
+                if success is not None:
+                    self.record_call(success, time.perf_counter() - start)
+
+        # Concurrent gets of the same object share one service call
+        object_data = self.unshare(datatype, *self.inflight.do((datatype.code, object_id, generic_id), fetch))
 
         enhancers = []
         for enhancer_config in self.get_enhancers_config(datatype.code):
@@ -172,6 +927,109 @@ class Connector:
             data=object_data
         )
 
+    def get_many(self, datatype, object_ids=None, generic_ids=None):
+        """
+        Get data from service for multiple ids
+
+        Uses the service get_many function when available, otherwise calls get with the declared service concurrency.
+
+        :param xenops.data.DataType datatype:
+        :param list object_ids:
+        :param list generic_ids:
+        :return list: DataMapObject for every requested id, object_ids first
+        """
+        service_type = self.service.types.get(datatype.code)
+        if not service_type:
+            raise Exception('There is no service type for given type code')
+
+        object_ids = object_ids if object_ids else []
+        generic_ids = generic_ids if generic_ids else []
+
+        self.check_breaker()
+        start = time.perf_counter()
+        success = False
+        try:
+            objects_data = self.fetch_many(service_type, datatype, object_ids, generic_ids)
+            success = True
+        except TooManyAbandonedCalls:
+            success = None  # call was not made
+            raise
+        finally:
+            if success is not None:
+                self.record_call(success, time.perf_counter() - start)
+
+        return [
+            DataMapObject(connector=self, datatype=service_type.datatype, enhancers=[], data=object_data)
+            for object_data in objects_data
+        ]
+
+    def fetch_many(self, service_type, datatype, object_ids, generic_ids):
+        """
+        Fetch raw data for multiple ids with the service get_many function or concurrent get calls
+
+        :param xenops.service.ServiceType service_type:
+        :param xenops.data.DataType datatype:
+        :param list object_ids:
+        :param list generic_ids:
+        :return list: Raw object data
+        """
+        if service_type.has_get_many():
+            objects_data = call_with_timeout(service_type.get_many, self.timeout, GetManyRequest(
+                service_config=self.service_config,
+                object_ids=object_ids,
+                generic_ids=generic_ids,
+                context=self.context
+            ), abandoned=self.abandoned)
+        else:
+            requests = [GetRequest(self.service_config, object_id, None, self.context) for object_id in object_ids]
+            requests += [GetRequest(self.service_config, None, generic_id, self.context) for generic_id in generic_ids]
+
+            def request_key(request):
+                return datatype.code, request.object_id, request.generic_id
+
+            capabilities = service_type.capabilities
+            if capabilities.is_async and capabilities.concurrency > 1:
+                results = run_async_concurrent(
+                    lambda request: self.inflight.do_async(
+                        request_key(request),
+                        lambda: await_with_timeout(service_type.get_async(request), self.timeout)
+                    ),
+                    requests,
+                    capabilities.concurrency
+                )
+            else:
+                results = run_concurrent(
+                    lambda request: self.inflight.do(
+                        request_key(request),
+                        lambda: call_with_timeout(service_type.get, self.timeout, request, abandoned=self.abandoned)
+                    ),
+                    requests,
+                    capabilities.concurrency
+                )
+
+            objects_data = []
+            for result, error in results:
+                if error:
+                    raise error
+                objects_data.append(self.unshare(datatype, *result))
+
+        return objects_data
+
+    def unshare(self, datatype, object_data, shared):
+        """
+        Copy object data that was fetched for another caller, so callers do not change each others data
+
+        :param xenops.data.DataType datatype:
+        :param object_data:
+        :param bool shared: Data came from the call of another caller
+        :return:
+        """
+        if not shared:
+            return object_data
+
+        metrics.inc('xenops_get_deduplicated_total', connector=self.code, datatype=datatype.code)
+        return copy.deepcopy(object_data)
+
     def get_enhancers_config(self, type_code):
         """
         Get list of enhancer configs
@@ -179,34 +1037,39 @@ class Connector:
         :param str type_code:
         :return list:
         """
-        # TODO: cache configs per type, maybe pre load on application
         configs = []
-        for connector in self.app.connectors.values():
-            mapping = connector.mapping.get(type_code, {})
-            for enhancer_config in connector.enhancers:
-                if enhancer_config.get('type') == type_code:
-                    configs.append({
-                        'connector': connector,
-                        'mapping': mapping,
-                        'attributes': enhancer_config.get('attributes', {})
-                    })
+        for route in self.app.routing['enhancers'].get(type_code, []):
+            connector = self.app.connectors.get(route['connector'])
+            if connector:
+                configs.append({
+                    'connector': connector,
+                    'mapping': connector.mapping.get(type_code, {}),
+                    'attributes': route['attributes']
+                })
         return configs
 
-    def get_processes_config(self, type_code):
+    def get_processes_config(self, type_code, chained=False):
         """
-        Get a list of process configs
+        Get a list of process configs for objects of this connector
+
+        A process config with `from` only gets objects from the listed connectors, polled by their trigger or chained
+        after they were processed into them.
 
         :param str type_code:
+        :param bool chained: Only process configs with this connector in `from`, for objects processed into it
         :return list:
         """
         configs = []
-        for connector in self.app.connectors.values():
-            for process_config in connector.processes:
-                if process_config.get('type') == type_code:
-                    configs.append({
-                        'connector': connector,
-                        'attributes': process_config.get('attributes')
-                    })
+        for route in self.app.routing['processes'].get(type_code, []):
+            sources = route.get('from')
+            if not (self.code in sources if sources else not chained):
+                continue
+
+            connector = self.app.connectors.get(route['connector'])
+            if connector:
+                config = dict(route)
+                config['connector'] = connector
+                configs.append(config)
         return configs
 
     def get_mapping(self, datatype):
@@ -217,3 +1080,15 @@ class Connector:
         :return:
         """
         return self.mapping.get(datatype.code, {})
+
+    def get_mapping_key(self, datatype):
+        """
+        Get identity of datatype mapping, used to share exports between connectors with the same mapping
+
+        :param datatype:
+        :return tuple:
+        """
+        key = self.mapping_keys.get(datatype.code)
+        if key is None:
+            key = self.mapping_keys[datatype.code] = mapping_key(self.get_mapping(datatype))
+        return key
@@ -0,0 +1,135 @@
+"""
+xenops.connector.context
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectorContext:
+    """
+    Pooled resources of a connector that live as long as the application
+
+    Every request object has the context of its connector, services use it to reuse clients between calls:
+
+    .. code-block:: python
+
+        def setup(context):
+            context.register('soap', lambda: SoapClient(context.service_config['url']), close=lambda c: c.logout())
+
+        def process(request):
+            request.context.get('soap').save(request.get_export_data(request.data_objects[0]))
+            request.context.http.post('https://example.com/api/product', body={})
+    """
+
+    def __init__(self, connector):
+        """
+        Init ConnectorContext
+
+        :param xenops.connector.Connector connector:
+        """
+        self.connector = connector
+        self.factories = {}
+        self.resources = {}
+        self.lock = threading.RLock()
+        self.register('http', self._create_http_pool, close=lambda pool: pool.close())
+
+    @property
+    def service_config(self):
+        """Service config of connector"""
+        return self.connector.service_config
+
+    def register(self, name, factory, close=None):
+        """
+        Register a pooled resource, factory is called on first use
+
+        :param str name:
+        :param Callable factory: Creates the resource
+        :param Callable close: Called with the resource when the context is closed
+        """
+        with self.lock:
+            previous_close = self.factories.get(name, (None, None))[1]
+            self.factories[name] = (factory, close)
+            resource = self.resources.pop(name, None)
+
+        if resource is not None:
+            self._close_resource(name, resource, previous_close)
+
+    def get(self, name):
+        """
+        Get pooled resource, creating it on first use
+
+        :param str name:
+        :return:
+        """
+        with self.lock:
+            if name in self.resources:
+                return self.resources[name]
+            if name not in self.factories:
+                raise KeyError('Resource ({}) is not registered for connector ({})'.format(
+                    name,
+                    self.connector.code
+                ))
+            factory, close = self.factories[name]
+
+        # Factory can be slow (connecting, logging in), other resources stay available while it runs
+        resource = factory()
+        with self.lock:
+            if name in self.resources or self.factories.get(name, (None,))[0] is not factory:
+                existing = self.resources.get(name)
+            else:
+                self.resources[name] = existing = resource
+
+        if existing is not resource:
+            self._close_resource(name, resource, close)
+            if existing is None:
+                return self.get(name)
+        return existing
+
+    def _create_http_pool(self):
+        """
+        Create HTTP pool with options from service config
+
+        :return xenops.connector.http.HTTPPool:
+        """
+        from .http import HTTPPool  # http.client is only imported by services that use it
+
+        return HTTPPool(**self.service_config.get('http', {}))
+
+    @property
+    def http(self):
+        """Keep-alive HTTP connection pool"""
+        return self.get('http')
+
+    def close(self):
+        """Close all created resources"""
+        with self.lock:
+            resources = list(self.resources.items())
+            self.resources = {}
+
+        for name, resource in reversed(resources):
+            self._close_resource(name, resource, self.factories[name][1])
+
+    def _close_resource(self, name, resource, close):
+        """
+        Close resource with its close function
+
+        :param str name:
+        :param resource:
+        :param Callable close:
+        """
+        if not close:
+            return
+        try:
+            close(resource)
+        except Exception as e:
+            logger.error('Could not close resource ({}) of connector ({}): {}'.format(
+                name,
+                self.connector.code,
+                str(e)
+            ))
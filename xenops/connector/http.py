@@ -0,0 +1,170 @@
+"""
+xenops.connector.http
+~~~~~~~~~~~~~~~~~~~~~
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import json
+import logging
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+
+
+class HTTPResponse:
+    """Response of a HTTPPool request"""
+
+    def __init__(self, status, headers, body):
+        """
+        Init HTTPResponse
+
+        :param int status:
+        :param dict headers:
+        :param bytes body:
+        """
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        """
+        Decode json body
+
+        :return:
+        """
+        return json.loads(self.body.decode('utf-8'))
+
+
+class HTTPPool:
+    """
+    Thread safe keep-alive HTTP(S) connection pool
+
+    Connections are reused per (scheme, host, port) so a service pays the TCP/TLS handshake once per connection
+    instead of once per object.
+    """
+
+    def __init__(self, timeout=30, max_idle=10, headers=None):
+        """
+        Init HTTPPool
+
+        :param float timeout:
+        :param int max_idle: Maximum idle connections kept per host
+        :param dict headers: Default headers send with every request
+        """
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.headers = headers if headers else {}
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def request(self, method, url, body=None, headers=None):
+        """
+        Send request over a pooled connection
+
+        :param str method:
+        :param str url:
+        :param body: bytes, str or dict/list that is json encoded
+        :param dict headers:
+        :return HTTPResponse:
+        """
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path = '{}?{}'.format(path, parts.query)
+
+        request_headers = dict(self.headers)
+        request_headers.update(headers if headers else {})
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+            request_headers.setdefault('Content-Type', 'application/json')
+
+        # A reused connection can be closed by the server, retry once on a new connection. Requests with a method
+        # that is not idempotent are only retried when sending failed, the server could have applied them already.
+        for attempt in range(2):
+            connection, reused = self._acquire(key)
+            sent = False
+            try:
+                connection.request(method, path, body=body, headers=request_headers)
+                sent = True
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                if reused and attempt == 0 and (not sent or method.upper() in IDEMPOTENT_METHODS):
+                    continue
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(key, connection)
+
+            return HTTPResponse(response.status, dict(response.getheaders()), data)
+
+    def get(self, url, headers=None):
+        """
+        Send GET request
+
+        :param str url:
+        :param dict headers:
+        :return HTTPResponse:
+        """
+        return self.request('GET', url, headers=headers)
+
+    def post(self, url, body=None, headers=None):
+        """
+        Send POST request
+
+        :param str url:
+        :param body:
+        :param dict headers:
+        :return HTTPResponse:
+        """
+        return self.request('POST', url, body=body, headers=headers)
+
+    def close(self):
+        """Close all idle connections"""
+        with self.lock:
+            connections = [conn for conns in self.idle.values() for conn in conns]
+            self.idle = {}
+
+        for connection in connections:
+            connection.close()
+
+    def _acquire(self, key):
+        """
+        Get idle connection or create a new one
+
+        :param tuple key:
+        :return tuple: (connection, reused)
+        """
+        with self.lock:
+            connections = self.idle.get(key)
+            if connections:
+                return connections.pop(), True
+
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout), False
+        return http.client.HTTPConnection(host, port, timeout=self.timeout), False
+
+    def _release(self, key, connection):
+        """
+        Return connection to pool
+
+        :param tuple key:
+        :param http.client.HTTPConnection connection:
+        """
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+
+        connection.close()
@@ -0,0 +1,171 @@
+"""
+xenops.connector.pool
+~~~~~~~~~~~~~~~~~~~~~
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import logging
+
+from xenops.data import DataMapObject
+
+logger = logging.getLogger(__name__)
+
+# Mapping state of a pool worker process, set once by init_worker
+_worker_state = None
+
+
+class MappingConnector:
+    """Stand-in for a connector in pool workers, holds only the mapping state needed for exporting"""
+
+    def __init__(self, code, mapping):
+        """
+        Init MappingConnector
+
+        :param str code:
+        :param dict mapping: Mapping of the trigger datatype
+        """
+        self.code = code
+        self.mapping = mapping
+
+    def get_mapping(self, datatype):
+        """
+        Get mapping for datatype
+
+        :param xenops.data.DataType datatype:
+        :return dict:
+        """
+        return self.mapping
+
+
+def export_chunk(state, records):
+    """
+    Map raw records and export them for every target mapping, runs in a pool worker
+
+    :param dict state: datatype, source connector code and mapping, target mappings by connector code
+    :param list records:
+    :return list: {target connector code: export data} for every record
+    """
+    datatype = state['datatype']
+    connector = MappingConnector(state['connector'], state['mapping'])
+
+    result = []
+    for record in records:
+        data = DataMapObject(connector=connector, datatype=datatype, enhancers=[], data=record)
+        result.append({code: data.export_to(mapping) for code, mapping in state['targets'].items()})
+    return result
+
+
+def init_worker(state):
+    """
+    Keep mapping state in pool worker process, so it is not send with every chunk
+
+    :param dict state:
+    """
+    global _worker_state
+    _worker_state = state
+
+
+def export_worker_chunk(records):
+    """
+    Export records with the mapping state of the pool worker
+
+    :param list records:
+    :return list:
+    """
+    return export_chunk(_worker_state, records)
+
+
+class ExportPool:
+    """
+    Process pool that maps and exports raw trigger records in chunks
+
+    Mapping and converter work is CPU bound, running it in processes uses all cores instead of one.
+    The parent creates the data objects with the precomputed exports and calls the process connectors. Workers get
+    the mapping state once when they start. Chunks that fail in the pool, for example because a record can not be
+    pickled or a worker died, are exported in the parent process.
+    """
+
+    def __init__(self, state, workers, chunk_size=100):
+        """
+        Init ExportPool
+
+        :param dict state: Mapping state created with create_state
+        :param int workers: Number of processes
+        :param int chunk_size: Records per task
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.state = state
+        self.chunk_size = max(1, chunk_size)
+        self.broken = False
+        try:
+            self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(state,))
+            self.send_state = False
+        except TypeError:
+            # Python < 3.7 has no initializer, the state is send with every chunk
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+            self.send_state = True
+
+    @staticmethod
+    def create_state(connector, datatype, process_configs):
+        """
+        Create mapping state for workers
+
+        :param xenops.connector.Connector connector: Trigger connector
+        :param xenops.data.DataType datatype:
+        :param list process_configs:
+        :return dict:
+        """
+        return {
+            'datatype': datatype,
+            'connector': connector.code,
+            'mapping': connector.get_mapping(datatype),
+            'targets': {
+                config['connector'].code: config['connector'].get_mapping(datatype) for config in process_configs
+            },
+        }
+
+    def export(self, records):
+        """
+        Export records in worker processes
+
+        :param list records:
+        :return list: {target connector code: export data} for every record
+        """
+        chunks = [records[i:i + self.chunk_size] for i in range(0, len(records), self.chunk_size)]
+        futures = [self.submit(chunk) for chunk in chunks]
+
+        exports = []
+        for chunk, future in zip(chunks, futures):
+            try:
+                if future is None:
+                    raise RuntimeError('Export pool is broken')
+                exports += future.result()
+            except Exception as e:
+                logger.warning('Export pool failed for chunk, exporting in process: {}'.format(e))
+                exports += export_chunk(self.state, chunk)
+        return exports
+
+    def submit(self, chunk):
+        """
+        Submit chunk to pool
+
+        :param list chunk:
+        :return concurrent.futures.Future: None when the pool can not be used anymore
+        """
+        from concurrent.futures.process import BrokenProcessPool
+
+        if self.broken:
+            return None
+        try:
+            if self.send_state:
+                return self.executor.submit(export_chunk, self.state, chunk)
+            return self.executor.submit(export_worker_chunk, chunk)
+        except BrokenProcessPool:
+            self.broken = True
+            return None
+
+    def close(self):
+        """Shutdown worker processes"""
+        self.executor.shutdown()
@@ -0,0 +1,91 @@
+"""
+xenops.connector.prefetch
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import queue
+import threading
+
+
+class _Error:
+    """Wrapper for an exception raised in the prefetch thread"""
+
+    def __init__(self, exception):
+        """
+        Init _Error
+
+        :param Exception exception:
+        """
+        self.exception = exception
+
+
+class Prefetcher:
+    """
+    Iterate over an iterable in a background thread
+
+    Keeps up to size items ready so the next trigger page is fetched while the current page is processed.
+    Exceptions raised by the iterable are raised again in the consuming thread.
+    """
+
+    _DONE = object()
+
+    def __init__(self, iterable, size=1):
+        """
+        Init Prefetcher
+
+        :param iterable:
+        :param int size: Number of items to fetch ahead
+        """
+        self.iterable = iterable
+        self.queue = queue.Queue(maxsize=max(1, size))
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __iter__(self):
+        """Start prefetch thread and yield items"""
+        self.thread = threading.Thread(target=self._fetch, daemon=True)
+        self.thread.start()
+
+        try:
+            while True:
+                item = self.queue.get()
+                if item is self._DONE:
+                    return
+                if isinstance(item, _Error):
+                    raise item.exception
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop prefetch thread"""
+        self.stopped.set()
+
+    def _fetch(self):
+        """Fetch items from iterable and put them on the queue"""
+        try:
+            for item in self.iterable:
+                if not self._put(item):
+                    return
+        except Exception as e:
+            self._put(_Error(e))
+            return
+
+        self._put(self._DONE)
+
+    def _put(self, item):
+        """
+        Put item on queue, gives up when prefetcher is closed
+
+        :param item:
+        :return bool:
+        """
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
@@ -0,0 +1,152 @@
+"""
+xenops.connector.runstats
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import math
+import datetime
+import threading
+
+
+def percentile(values, percent):
+    """
+    Get percentile of values with nearest rank method
+
+    :param list values:
+    :param float percent:
+    :return float:
+    """
+    if not values:
+        return None
+
+    values = sorted(values)
+    index = max(0, int(math.ceil(percent / 100.0 * len(values))) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+class RunStats:
+    """
+    Statistics of a single trigger run
+
+    Processed and failed count object/process connector pairs, skipped counts objects that did not need to be
+    processed for a process connector.
+    """
+
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCESS = 'success'
+    STATUS_FAILED = 'failed'
+
+    def __init__(self, trigger_code):
+        """
+        Init RunStats
+
+        :param str trigger_code:
+        """
+        self.trigger_code = trigger_code
+        self.start_time = datetime.datetime.now()
+        self.end_time = None
+        self.status = self.STATUS_RUNNING
+        self.seen = 0
+        self.processed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes_exported = 0
+        self.latencies = {}
+        self.lock = threading.Lock()
+
+    def add(self, seen=0, processed=0, skipped=0, failed=0, bytes_exported=0):
+        """
+        Add counts
+
+        :param int seen:
+        :param int processed:
+        :param int skipped:
+        :param int failed:
+        :param int bytes_exported:
+        """
+        with self.lock:
+            self.seen += seen
+            self.processed += processed
+            self.skipped += skipped
+            self.failed += failed
+            self.bytes_exported += bytes_exported
+
+    def add_latency(self, connector_code, seconds):
+        """
+        Add process call latency of process connector
+
+        :param str connector_code:
+        :param float seconds:
+        """
+        with self.lock:
+            self.latencies.setdefault(connector_code, []).append(seconds)
+
+    def finish(self, status=STATUS_SUCCESS):
+        """
+        Mark run as finished
+
+        :param str status:
+        """
+        self.end_time = datetime.datetime.now()
+        self.status = status
+
+    @property
+    def duration(self):
+        """Duration in seconds"""
+        end_time = self.end_time if self.end_time else datetime.datetime.now()
+        return (end_time - self.start_time).total_seconds()
+
+    def latency_percentiles(self):
+        """
+        Get latency percentiles per process connector
+
+        :return dict: {connector_code: {'count', 'p50', 'p90', 'p99'}}
+        """
+        with self.lock:
+            latencies = {code: list(values) for code, values in self.latencies.items()}
+
+        return {
+            code: {
+                'count': len(values),
+                'p50': percentile(values, 50),
+                'p90': percentile(values, 90),
+                'p99': percentile(values, 99),
+            }
+            for code, values in latencies.items()
+        }
+
+
+def summarize_runs(runs):
+    """
+    Summarize throughput of runs (oldest first)
+
+    The trend compares the average objects per second of the newest half of the runs with the oldest half.
+
+    :param list runs: Run dicts from ConnectorStorage.get_runs
+    :return dict:
+    """
+    def throughput(run):
+        return run['seen'] / run['duration'] if run['duration'] else 0.0
+
+    if not runs:
+        return None
+
+    rates = [throughput(run) for run in runs]
+    half = len(rates) // 2
+    trend = None
+    if half:
+        old_rate = sum(rates[:half]) / half
+        new_rate = sum(rates[-half:]) / half
+        trend = (new_rate - old_rate) / old_rate * 100 if old_rate else None
+
+    return {
+        'runs': len(runs),
+        'failed_runs': len([run for run in runs if run['status'] != RunStats.STATUS_SUCCESS]),
+        'avg_duration': sum(run['duration'] for run in runs) / len(runs),
+        'avg_objects_per_second': sum(rates) / len(rates),
+        'last_objects_per_second': rates[-1],
+        'trend_percent': trend,
+        'last_latencies': runs[-1]['latencies'],
+    }
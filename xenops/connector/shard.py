@@ -0,0 +1,87 @@
+"""
+xenops.connector.shard
+~~~~~~~~~~~~~~~~~~~~~~
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import zlib
+
+
+class InvalidShard(Exception):
+    """Invalid shard Exception"""
+
+    pass
+
+
+class Shard:
+    """
+    Deterministic subset of trigger objects
+
+    An object belongs to shard index when crc32 of its partition key modulo count equals index. The partition key is
+    the service partition_key function result or the id converter value.
+    """
+
+    def __init__(self, index, count):
+        """
+        Init Shard
+
+        :param int index: 0 based shard index
+        :param int count: Total number of shards
+        """
+        if count < 1 or not 0 <= index < count:
+            raise InvalidShard('Shard index must be between 0 and {} (got {})'.format(count - 1, index))
+
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def parse(cls, value):
+        """
+        Parse shard from string like 0/4
+
+        :param str value:
+        :return Shard:
+        """
+        try:
+            index, count = value.split('/')
+            return cls(int(index), int(count))
+        except ValueError:
+            raise InvalidShard('Invalid shard ({}), use index/count like 0/4'.format(value))
+
+    def storage_key(self, trigger_code):
+        """
+        Key for shard watermark and cursor in storage
+
+        :param str trigger_code:
+        :return str:
+        """
+        return '{}#shard-{}-of-{}'.format(trigger_code, self.index, self.count)
+
+    def storage_keys(self, trigger_code):
+        """
+        Storage keys of all shards
+
+        :param str trigger_code:
+        :return list:
+        """
+        return [Shard(index, self.count).storage_key(trigger_code) for index in range(self.count)]
+
+    def contains(self, service_type, data):
+        """
+        Check if raw object belongs to shard
+
+        :param xenops.service.ServiceType service_type:
+        :param dict data:
+        :return bool:
+        """
+        key = service_type.partition_key(data)
+        return zlib.crc32(str(key).encode('utf-8')) % self.count == self.index
+
+    def __str__(self):
+        """
+        Representation of shard
+
+        :return str:
+        """
+        return '{}/{}'.format(self.index, self.count)
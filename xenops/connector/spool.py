@@ -0,0 +1,199 @@
+"""
+xenops.connector.spool
+~~~~~~~~~~~~~~~~~~~~~~
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import os
+import mmap
+import zlib
+import struct
+import datetime
+
+from xenops.connector.workqueue import encode_value, decode_value, encode_payload, decode_payload
+
+MAGIC = b'XSPL'
+HEADER = struct.Struct('>4sBBB')
+LENGTH = struct.Struct('>I')
+VERSION = 1
+
+CODEC_JSON = 0
+CODEC_MSGPACK = 1
+CODECS = {'json': CODEC_JSON, 'msgpack': CODEC_MSGPACK}
+
+
+class InvalidSegment(Exception):
+    """Invalid spool segment Exception"""
+
+    pass
+
+
+def has_msgpack():
+    """
+    Check if msgpack is installed
+
+    :return bool:
+    """
+    try:
+        import msgpack  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def encode(codec, data):
+    """
+    Encode data with codec, values that are not JSON or msgpack types keep their type with the work queue encoding
+
+    :param int codec:
+    :param data:
+    :return bytes:
+    """
+    if codec == CODEC_MSGPACK:
+        import msgpack
+        return msgpack.packb(data, use_bin_type=True, default=encode_value)
+    return encode_payload(data).encode('utf-8')
+
+
+def decode(codec, payload):
+    """
+    Decode payload with codec
+
+    :param int codec:
+    :param bytes payload:
+    :return:
+    """
+    if codec == CODEC_MSGPACK:
+        import msgpack
+        return msgpack.unpackb(payload, raw=False, object_hook=decode_value)
+    return decode_payload(payload.decode('utf-8'))
+
+
+class SpoolWriter:
+    """
+    Write trigger pages to segment files
+
+    A segment starts with a header (magic, version, codec, compression) followed by records of a 4 byte big endian
+    length and the encoded, optionally zlib compressed, page objects. Segments are written to a .tmp file and renamed
+    when complete, so readers only see finished segments.
+    """
+
+    def __init__(self, directory, codec=None, compress=False, segment_size=64 * 1024 * 1024):
+        """
+        Init SpoolWriter
+
+        :param str directory:
+        :param str codec: json or msgpack, default msgpack when installed
+        :param bool compress: Compress records with zlib
+        :param int segment_size: Start new segment when segment is larger than given bytes
+        """
+        if codec is None:
+            codec = 'msgpack' if has_msgpack() else 'json'
+        if codec not in CODECS:
+            raise InvalidSegment('Unknown spool codec ({})'.format(codec))
+
+        self.directory = directory
+        self.codec = CODECS[codec]
+        self.compress = compress
+        self.segment_size = segment_size
+        self.file = None
+        self.path = None
+        self.size = 0
+        self.segments = []
+        os.makedirs(directory, exist_ok=True)
+
+    def open_segment(self):
+        """Open new segment file"""
+        name = '{}-{:04d}.seg'.format(datetime.datetime.now().strftime('%Y%m%d%H%M%S%f'), len(self.segments))
+        self.path = os.path.join(self.directory, name)
+        self.file = open(self.path + '.tmp', 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.codec, int(self.compress)))
+        self.size = HEADER.size
+
+    def close_segment(self):
+        """Close current segment and make it visible for readers"""
+        if not self.file:
+            return
+
+        self.file.close()
+        os.replace(self.path + '.tmp', self.path)
+        self.segments.append(self.path)
+        self.file = None
+
+    def write(self, objects):
+        """
+        Write page objects as one record
+
+        :param list objects: Raw trigger objects
+        """
+        if self.file and self.size >= self.segment_size:
+            self.close_segment()
+        if not self.file:
+            self.open_segment()
+
+        payload = encode(self.codec, objects)
+        if self.compress:
+            payload = zlib.compress(payload)
+
+        self.file.write(LENGTH.pack(len(payload)))
+        self.file.write(payload)
+        self.size += LENGTH.size + len(payload)
+
+    def close(self):
+        """
+        Close writer
+
+        :return list: Paths of written segments
+        """
+        self.close_segment()
+        return self.segments
+
+    def __enter__(self):
+        """Enter context"""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Close writer on exit"""
+        self.close()
+
+
+def read_segment(path):
+    """
+    Read pages from segment file with memory mapped I/O
+
+    :param str path:
+    :return Iterator: List of raw objects per page
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if len(data) < HEADER.size:
+            raise InvalidSegment('Segment ({}) is too small'.format(path))
+
+        magic, version, codec, compressed = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise InvalidSegment('Segment ({}) has an unknown format'.format(path))
+
+        offset = HEADER.size
+        while offset < len(data):
+            length, = LENGTH.unpack_from(data, offset)
+            offset += LENGTH.size
+            if offset + length > len(data):
+                raise InvalidSegment('Segment ({}) is truncated'.format(path))
+
+            payload = data[offset:offset + length]
+            offset += length
+            if compressed:
+                payload = zlib.decompress(payload)
+            yield decode(codec, payload)
+
+
+def list_segments(directory):
+    """
+    List finished segments in write order
+
+    :param str directory:
+    :return list:
+    """
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith('.seg')]
@@ -5,10 +5,15 @@ xenops.connector.storage
 :copyright: 2017 by Maikel Martens
 :license: GPLv3
 """
+import json
 import logging
 import sqlite3
+import threading
 from datetime import datetime
 
+from xenops.metrics import metrics
+from xenops.connector.workqueue import encode_payload, decode_payload
+
 logger = logging.getLogger(__name__)
 
 
@@ -16,15 +21,22 @@ class ConnectorStorage:
     """Connector storage class"""
 
     DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+    RUN_DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
 
-    def __init__(self, db_path):
+    def __init__(self, db_path, name=None, runs_retention=1000):
         """
         Init ConnectorStorage
 
         :param str db_path:
+        :param str name: Name used in metrics, default db_path
+        :param int runs_retention: Number of runs kept per trigger, None or 0 keeps all runs
         """
         self.db_path = db_path
-        self.connection = sqlite3.connect(db_path)
+        self.name = name if name else db_path
+        self.runs_retention = runs_retention
+        # Connection is shared by process threads, queries are serialized with lock
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.RLock()
         self.create_tables()
 
     def create_tables(self):
@@ -46,10 +58,88 @@ class ConnectorStorage:
         );
         """
 
+        cursors_table_query = """
+        CREATE TABLE IF NOT EXISTS trigger_cursors (
+            trigger_code varchar NOT NULL,
+            cursor text NOT NULL,
+            PRIMARY KEY (trigger_code)
+        );
+        """
+
+        snapshots_table_query = """
+        CREATE TABLE IF NOT EXISTS attribute_snapshots (
+            type_code varchar NOT NULL,
+            scope varchar NOT NULL,
+            local_id varchar NOT NULL,
+            digests text NOT NULL,
+            PRIMARY KEY (type_code, scope, local_id)
+        );
+        """
+
+        parked_table_query = """
+        CREATE TABLE IF NOT EXISTS parked_objects (
+            id integer PRIMARY KEY AUTOINCREMENT,
+            target_code varchar NOT NULL,
+            type_code varchar NOT NULL,
+            payload text NOT NULL,
+            error text,
+            parked_at datetime NOT NULL
+        );
+        """
+
+        materialized_table_query = """
+        CREATE TABLE IF NOT EXISTS materialized_objects (
+            type_code varchar NOT NULL,
+            object_id varchar NOT NULL,
+            local_id varchar,
+            data text NOT NULL,
+            attributes text NOT NULL,
+            updated_at datetime NOT NULL,
+            PRIMARY KEY (type_code, object_id)
+        );
+        """
+
+        materialized_index_table_query = """
+        CREATE TABLE IF NOT EXISTS materialized_index (
+            type_code varchar NOT NULL,
+            attribute varchar NOT NULL,
+            value text NOT NULL,
+            object_id varchar NOT NULL,
+            PRIMARY KEY (type_code, attribute, value, object_id)
+        );
+        """
+
+        runs_table_query = """
+        CREATE TABLE IF NOT EXISTS runs (
+            id integer PRIMARY KEY AUTOINCREMENT,
+            trigger_code varchar NOT NULL,
+            status varchar NOT NULL,
+            start_time datetime NOT NULL,
+            end_time datetime NOT NULL,
+            seen integer NOT NULL,
+            processed integer NOT NULL,
+            skipped integer NOT NULL,
+            failed integer NOT NULL,
+            bytes_exported integer NOT NULL,
+            latencies text NOT NULL
+        );
+        """
+
         with self.connection as conn:
             cursor = conn.cursor()
             cursor.execute(trigger_table_query)
             cursor.execute(identifiers_table_query)
+            cursor.execute(cursors_table_query)
+            cursor.execute(runs_table_query)
+            cursor.execute("""CREATE INDEX IF NOT EXISTS runs_trigger ON runs (trigger_code, id)""")
+            cursor.execute(snapshots_table_query)
+            cursor.execute(parked_table_query)
+            cursor.execute(materialized_table_query)
+            cursor.execute(materialized_index_table_query)
+            cursor.execute(
+                """CREATE INDEX IF NOT EXISTS materialized_local_id ON materialized_objects (type_code, local_id)""")
+            cursor.execute(
+                """CREATE INDEX IF NOT EXISTS materialized_index_object ON materialized_index (type_code, object_id)""")
 
     def get_last_run(self, trigger_code):
         """
@@ -67,6 +157,23 @@ class ConnectorStorage:
 
         return None
 
+    def get_cursor(self, trigger_code):
+        """
+        Get continuation cursor of last unfinished run from given trigger code
+
+        :param str trigger_code:
+        :return:
+        """
+        query = """SELECT cursor FROM trigger_cursors WHERE trigger_code = ?"""
+
+        value = self.fetch_one_col(query, [trigger_code])
+        try:
+            return json.loads(value) if value is not None else None
+        except ValueError as e:
+            logger.error(e)
+
+        return None
+
     def get_local_id(self, datatype, object_id):
         """
         Get local id
@@ -101,7 +208,7 @@ class ConnectorStorage:
         """
         params = params if params else []
 
-        with self.connection as conn:
+        with self.lock, self.connection as conn, self.timer(query):
             cursor = conn.cursor()
 
             cursor.execute(query, params)
@@ -133,6 +240,105 @@ class ConnectorStorage:
 
         return self.execute_query(query, [trigger_code, date.strftime(self.DATE_FORMAT)])
 
+    def set_cursor(self, trigger_code, cursor):
+        """
+        Set continuation cursor, None removes the cursor
+
+        :param str trigger_code:
+        :param cursor: json serializable value
+        :return bool:
+        """
+        if cursor is None:
+            return self.execute_query("""DELETE FROM trigger_cursors WHERE trigger_code = ?""", [trigger_code])
+
+        query = """REPLACE INTO trigger_cursors (trigger_code, cursor) VALUES (?, ?)"""
+
+        return self.execute_query(query, [trigger_code, json.dumps(cursor)])
+
+    def add_run(self, run_stats):
+        """
+        Save statistics of a trigger run
+
+        :param xenops.connector.runstats.RunStats run_stats:
+        :return bool:
+        """
+        if not run_stats.end_time:
+            return False
+
+        query = """
+        INSERT INTO runs (trigger_code, status, start_time, end_time, seen, processed, skipped, failed,
+                          bytes_exported, latencies)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """
+
+        added = self.execute_query(query, [
+            run_stats.trigger_code,
+            run_stats.status,
+            run_stats.start_time.strftime(self.RUN_DATE_FORMAT),
+            run_stats.end_time.strftime(self.RUN_DATE_FORMAT),
+            run_stats.seen,
+            run_stats.processed,
+            run_stats.skipped,
+            run_stats.failed,
+            run_stats.bytes_exported,
+            json.dumps(run_stats.latency_percentiles()),
+        ])
+        if added and self.runs_retention:
+            self.prune_runs(run_stats.trigger_code, self.runs_retention)
+        return added
+
+    def prune_runs(self, trigger_code, keep):
+        """
+        Remove all but the latest runs of trigger
+
+        :param str trigger_code:
+        :param int keep: Number of runs to keep
+        :return bool:
+        """
+        query = """
+        DELETE FROM runs WHERE trigger_code = ? AND id <= (
+            SELECT id FROM runs WHERE trigger_code = ? ORDER BY id DESC LIMIT 1 OFFSET ?
+        )
+        """
+
+        return self.execute_query(query, [trigger_code, trigger_code, keep])
+
+    def get_runs(self, trigger_code=None, limit=20):
+        """
+        Get latest runs, oldest first
+
+        :param str trigger_code:
+        :param int limit:
+        :return list: list of dicts
+        """
+        query = """
+        SELECT trigger_code, status, start_time, end_time, seen, processed, skipped, failed, bytes_exported, latencies
+        FROM runs {} ORDER BY id DESC LIMIT ?
+        """.format('WHERE trigger_code = ?' if trigger_code else '')
+        params = [trigger_code, limit] if trigger_code else [limit]
+
+        with self.lock, self.connection as conn, self.timer(query):
+            rows = conn.execute(query, params).fetchall()
+
+        runs = []
+        for row in reversed(rows):
+            start_time = datetime.strptime(row[2], self.RUN_DATE_FORMAT)
+            end_time = datetime.strptime(row[3], self.RUN_DATE_FORMAT)
+            runs.append({
+                'trigger_code': row[0],
+                'status': row[1],
+                'start_time': start_time,
+                'end_time': end_time,
+                'duration': (end_time - start_time).total_seconds(),
+                'seen': row[4],
+                'processed': row[5],
+                'skipped': row[6],
+                'failed': row[7],
+                'bytes_exported': row[8],
+                'latencies': json.loads(row[9]),
+            })
+        return runs
+
     def set_object_id(self, datatype, local_id, object_id):
         """
         Set object id
@@ -146,6 +352,274 @@ class ConnectorStorage:
 
         return self.execute_query(query, [datatype.code, local_id, object_id])
 
+    def get_attribute_snapshots(self, datatype, scope, local_ids):
+        """
+        Get attribute digests of last processed values
+
+        :param DataType datatype:
+        :param str scope: Snapshot scope, for example export
+        :param list local_ids:
+        :return dict: Attribute digests by local id, local ids without snapshot are left out
+        """
+        query = """
+        SELECT local_id, digests FROM attribute_snapshots WHERE type_code = ? AND scope = ? AND local_id IN ({})
+        """
+
+        snapshots = {}
+        local_ids = list(local_ids)
+        with self.lock, self.connection as conn:
+            cursor = conn.cursor()
+            for start in range(0, len(local_ids), 500):
+                chunk = local_ids[start:start + 500]
+                chunk_query = query.format(', '.join('?' * len(chunk)))
+                with self.timer(chunk_query):
+                    cursor.execute(chunk_query, [datatype.code, scope] + chunk)
+                    snapshots.update((local_id, json.loads(digests)) for local_id, digests in cursor.fetchall())
+        return snapshots
+
+    def set_attribute_snapshots(self, datatype, scope, snapshots):
+        """
+        Save attribute digests of processed values
+
+        :param DataType datatype:
+        :param str scope: Snapshot scope, for example export
+        :param dict snapshots: Attribute digests by local id
+        :return bool:
+        """
+        query = """REPLACE INTO attribute_snapshots (type_code, scope, local_id, digests) VALUES (?, ?, ?, ?)"""
+
+        try:
+            with self.lock, self.connection as conn, self.timer(query):
+                conn.executemany(query, [
+                    (datatype.code, scope, local_id, json.dumps(digests, separators=(',', ':'), sort_keys=True))
+                    for local_id, digests in snapshots.items()
+                ])
+            return True
+        except Exception as e:
+            logger.error(e)
+
+        return False
+
+    def delete_attribute_snapshots(self, datatype, scope, local_ids):
+        """
+        Remove attribute digests, the next delta of the objects is the full export
+
+        :param DataType datatype:
+        :param str scope: Snapshot scope, for example export
+        :param list local_ids:
+        :return bool:
+        """
+        query = """DELETE FROM attribute_snapshots WHERE type_code = ? AND scope = ? AND local_id = ?"""
+
+        try:
+            with self.lock, self.connection as conn, self.timer(query):
+                conn.executemany(query, [(datatype.code, scope, local_id) for local_id in local_ids])
+            return True
+        except Exception as e:
+            logger.error(e)
+
+        return False
+
+    def park(self, target_code, datatype, objects, error=None):
+        """
+        Park raw objects that could not be processed by target, for example because its circuit breaker is open
+
+        :param str target_code:
+        :param DataType datatype:
+        :param list objects: Raw object data
+        :param str error:
+        :return bool:
+        """
+        query = """
+        INSERT INTO parked_objects (target_code, type_code, payload, error, parked_at) VALUES (?, ?, ?, ?, ?)
+        """
+        parked_at = datetime.now().strftime(self.RUN_DATE_FORMAT)
+
+        try:
+            with self.lock, self.connection as conn, self.timer(query):
+                conn.executemany(query, [
+                    (target_code, datatype.code, encode_payload(data), error, parked_at) for data in objects
+                ])
+            return True
+        except Exception as e:
+            logger.error(e)
+
+        return False
+
+    def get_parked(self, datatype, limit=1000):
+        """
+        Get oldest parked objects of data type
+
+        :param DataType datatype:
+        :param int limit:
+        :return dict: (parked id, raw object) tuples by target code
+        """
+        query = """SELECT id, target_code, payload FROM parked_objects WHERE type_code = ? ORDER BY id LIMIT ?"""
+
+        objects = {}
+        with self.lock, self.connection as conn, self.timer(query):
+            for parked_id, target_code, payload in conn.execute(query, [datatype.code, limit]).fetchall():
+                objects.setdefault(target_code, []).append((parked_id, decode_payload(payload)))
+        return objects
+
+    def remove_parked(self, ids):
+        """
+        Remove parked objects that are processed
+
+        :param list ids:
+        :return bool:
+        """
+        query = """DELETE FROM parked_objects WHERE id = ?"""
+
+        try:
+            with self.lock, self.connection as conn, self.timer(query):
+                conn.executemany(query, [(parked_id,) for parked_id in ids])
+            return True
+        except Exception as e:
+            logger.error(e)
+
+        return False
+
+    def count_parked(self):
+        """
+        Count parked objects per target and type code
+
+        :return dict: {(target_code, type_code): count}
+        """
+        query = """SELECT target_code, type_code, COUNT(*) FROM parked_objects GROUP BY target_code, type_code"""
+
+        with self.lock, self.connection as conn, self.timer(query):
+            return {(row[0], row[1]): row[2] for row in conn.execute(query).fetchall()}
+
+    def set_materialized(self, datatype, objects, indexes=None):
+        """
+        Save latest raw data and mapped attributes of objects, replacing the saved version
+
+        :param DataType datatype:
+        :param list objects: (object id, local id, raw data, mapped attributes) tuples
+        :param list indexes: Attribute codes to index for find_materialized
+        :return bool:
+        """
+        query = """
+        REPLACE INTO materialized_objects (type_code, object_id, local_id, data, attributes, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """
+        delete_index_query = """DELETE FROM materialized_index WHERE type_code = ? AND object_id = ?"""
+        index_query = """REPLACE INTO materialized_index (type_code, attribute, value, object_id) VALUES (?, ?, ?, ?)"""
+        updated_at = datetime.now().strftime(self.RUN_DATE_FORMAT)
+
+        index_rows = [
+            (datatype.code, code, self.index_value(attributes[code]), str(object_id))
+            for object_id, _, _, attributes in objects
+            for code in indexes or [] if code in attributes
+        ]
+
+        try:
+            with self.lock, self.connection as conn, self.timer(query):
+                conn.executemany(query, [
+                    (datatype.code, str(object_id), local_id, encode_payload(data), encode_payload(attributes),
+                     updated_at)
+                    for object_id, local_id, data, attributes in objects
+                ])
+                conn.executemany(delete_index_query, [(datatype.code, str(row[0])) for row in objects])
+                conn.executemany(index_query, index_rows)
+            return True
+        except Exception as e:
+            logger.error(e)
+
+        return False
+
+    def prune_materialized(self, datatype, before):
+        """
+        Remove saved objects that were not saved since given time, used after a run that listed all objects
+
+        :param DataType datatype:
+        :param datetime before:
+        :return int: Number of removed objects
+        """
+        query = """DELETE FROM materialized_objects WHERE type_code = ? AND updated_at < ?"""
+        index_query = """
+        DELETE FROM materialized_index WHERE type_code = ? AND object_id NOT IN (
+            SELECT object_id FROM materialized_objects WHERE type_code = ?
+        )
+        """
+
+        try:
+            with self.lock, self.connection as conn, self.timer(query):
+                removed = conn.execute(query, [datatype.code, before.strftime(self.RUN_DATE_FORMAT)]).rowcount
+                if removed:
+                    conn.execute(index_query, [datatype.code, datatype.code])
+            return removed
+        except Exception as e:
+            logger.error(e)
+
+        return 0
+
+    def get_materialized(self, datatype, object_id=None, local_id=None):
+        """
+        Get saved object by object id or local id
+
+        :param DataType datatype:
+        :param str object_id:
+        :param str local_id:
+        :return tuple: (object id, local id, raw data, mapped attributes) or None
+        """
+        if object_id is not None:
+            where, value = 'object_id = ?', str(object_id)
+        elif local_id is not None:
+            where, value = 'local_id = ?', local_id
+        else:
+            return None
+
+        query = """
+        SELECT object_id, local_id, data, attributes FROM materialized_objects WHERE type_code = ? AND {}
+        """.format(where)
+
+        with self.lock, self.connection as conn, self.timer(query):
+            row = conn.execute(query, [datatype.code, value]).fetchone()
+
+        return (row[0], row[1], decode_payload(row[2]), decode_payload(row[3])) if row else None
+
+    def find_materialized(self, datatype, attribute, value, limit=100):
+        """
+        Find saved objects by indexed attribute value
+
+        :param DataType datatype:
+        :param str attribute:
+        :param value:
+        :param int limit:
+        :return list: (object id, local id, raw data, mapped attributes) tuples
+        """
+        query = """
+        SELECT o.object_id, o.local_id, o.data, o.attributes FROM materialized_index i
+        JOIN materialized_objects o ON o.type_code = i.type_code AND o.object_id = i.object_id
+        WHERE i.type_code = ? AND i.attribute = ? AND i.value = ? ORDER BY o.object_id LIMIT ?
+        """
+
+        with self.lock, self.connection as conn, self.timer(query):
+            rows = conn.execute(query, [datatype.code, attribute, self.index_value(value), limit]).fetchall()
+
+        return [(row[0], row[1], decode_payload(row[2]), decode_payload(row[3])) for row in rows]
+
+    @staticmethod
+    def index_value(value):
+        """
+        Index representation of attribute value
+
+        :param value:
+        :return str:
+        """
+        return json.dumps(value, sort_keys=True, default=str)
+
+    def timer(self, query):
+        """
+        Metrics timer for query
+
+        :param str query:
+        :return:
+        """
+        return metrics.timer('xenops_storage_seconds', storage=self.name, operation=query.split(None, 1)[0].upper())
+
     def execute_query(self, query, params=None):
         """
         Execute given query
@@ -157,7 +631,7 @@ class ConnectorStorage:
         params = params if params else []
 
         try:
-            with self.connection as conn:
+            with self.lock, self.connection as conn, self.timer(query):
                 cursor = conn.cursor()
                 cursor.execute(query, params)
             return True
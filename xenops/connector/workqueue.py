@@ -0,0 +1,296 @@
+"""
+xenops.connector.workqueue
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import json
+import time
+import uuid
+import base64
+import decimal
+import logging
+import sqlite3
+import datetime
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def _utc_offset(value):
+    """
+    UTC offset of datetime or time in seconds
+
+    :param value:
+    :return float: None for naive values
+    """
+    offset = value.utcoffset()
+    return offset.total_seconds() if offset is not None else None
+
+
+def _timezone(offset):
+    """
+    Timezone for UTC offset in seconds
+
+    :param float offset:
+    :return datetime.timezone: None for naive values
+    """
+    return datetime.timezone(datetime.timedelta(seconds=offset)) if offset is not None else None
+
+
+TYPE_KEY = '__xenops_type__'
+TYPES = {
+    'datetime': (
+        datetime.datetime,
+        lambda value: list(value.timetuple()[:6]) + [value.microsecond, _utc_offset(value)],
+        lambda value: datetime.datetime(*value[:7], tzinfo=_timezone(value[7]))
+    ),
+    'date': (datetime.date, lambda value: [value.year, value.month, value.day], lambda value: datetime.date(*value)),
+    'time': (
+        datetime.time,
+        lambda value: [value.hour, value.minute, value.second, value.microsecond, _utc_offset(value)],
+        lambda value: datetime.time(*value[:4], tzinfo=_timezone(value[4]))
+    ),
+    'decimal': (decimal.Decimal, str, decimal.Decimal),
+    'uuid': (uuid.UUID, str, uuid.UUID),
+    'bytes': (bytes, lambda value: base64.b64encode(value).decode('ascii'), base64.b64decode),
+}
+
+
+def encode_value(value):
+    """
+    Encode value that is not JSON serializable as tagged dict, unknown types as string
+
+    :param value:
+    :return:
+    """
+    for name, (value_type, encode, _) in TYPES.items():
+        if isinstance(value, value_type):
+            return {TYPE_KEY: name, 'value': encode(value)}
+    return str(value)
+
+
+def decode_value(value):
+    """
+    Decode dict tagged by encode_value, other dicts are returned as is
+
+    :param dict value:
+    :return:
+    """
+    if len(value) == 2 and value.get(TYPE_KEY) in TYPES and 'value' in value:
+        return TYPES[value[TYPE_KEY]][2](value['value'])
+    return value
+
+
+def encode_payload(data):
+    """
+    Encode raw object to JSON, datetimes, dates, times, decimals, UUIDs and bytes keep their type when decoded
+
+    Other values that are not JSON serializable are stored as string.
+
+    :param data:
+    :return str:
+    """
+    return json.dumps(data, default=encode_value)
+
+
+def decode_payload(payload):
+    """
+    Decode raw object encoded with encode_payload
+
+    :param str payload:
+    :return:
+    """
+    return json.loads(payload, object_hook=decode_value)
+
+
+class WorkQueue:
+    """
+    Durable sqlite backed queue of raw trigger objects
+
+    Triggers put raw objects on the queue, workers claim items with a lease. Items of a worker that crashed are claimed
+    again when the lease is expired, items that failed max_attempts times are marked failed.
+
+    Items are claimed in order of due time: the time they were added minus priority * aging_seconds. A higher priority
+    item goes before lower priority items added up to aging_seconds per priority step earlier, so low priority items
+    are never starved while the due index keeps claiming cheap.
+    """
+
+    STATUS_PENDING = 'pending'
+    STATUS_LEASED = 'leased'
+    STATUS_FAILED = 'failed'
+
+    def __init__(self, db_path, max_attempts=5, aging_seconds=60):
+        """
+        Init WorkQueue
+
+        :param str db_path:
+        :param int max_attempts:
+        :param float aging_seconds: Waiting time that equals one priority step
+        """
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.aging_seconds = aging_seconds
+        self.connection = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.create_tables()
+
+    def create_tables(self):
+        """Create queue tables"""
+        with self.lock:
+            self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                id integer PRIMARY KEY AUTOINCREMENT,
+                connector_code varchar NOT NULL,
+                type_code varchar NOT NULL,
+                payload text NOT NULL,
+                status varchar NOT NULL,
+                attempts integer NOT NULL DEFAULT 0,
+                lease_until real,
+                worker varchar,
+                error text,
+                priority integer NOT NULL DEFAULT 0,
+                due real
+            );
+            """)
+            columns = [row[1] for row in self.connection.execute('PRAGMA table_info(items)')]
+            if 'priority' not in columns:
+                self.connection.execute("""ALTER TABLE items ADD COLUMN priority integer NOT NULL DEFAULT 0""")
+                self.connection.execute("""ALTER TABLE items ADD COLUMN due real""")
+            self.connection.execute("""CREATE INDEX IF NOT EXISTS items_status ON items (status, lease_until)""")
+            self.connection.execute("""CREATE INDEX IF NOT EXISTS items_due ON items (status, due)""")
+
+    @contextmanager
+    def transaction(self):
+        """Write transaction, taken immediately so concurrent workers never claim the same items"""
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+
+    def put_many(self, connector_code, type_code, objects, priorities=None):
+        """
+        Put raw objects on queue
+
+        :param str connector_code:
+        :param str type_code:
+        :param list objects:
+        :param list priorities: Priority per object, higher is claimed earlier (default 0)
+        :return int: number of added items
+        """
+        now = time.time()
+        priorities = priorities if priorities else [0] * len(objects)
+        rows = [
+            (
+                connector_code, type_code, encode_payload(data), self.STATUS_PENDING, priority,
+                now - priority * self.aging_seconds
+            )
+            for data, priority in zip(objects, priorities)
+        ]
+        with self.transaction() as conn:
+            conn.executemany(
+                """
+                INSERT INTO items (connector_code, type_code, payload, status, priority, due)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                rows
+            )
+        return len(rows)
+
+    def claim(self, worker, limit=100, lease_seconds=300):
+        """
+        Claim pending items or items with an expired lease
+
+        Pending and expired items are selected with separate queries so both use an index, the oldest due items of
+        both are claimed. Expired items that reached max attempts, for example because they crash the worker, are
+        marked failed.
+
+        :param str worker:
+        :param int limit:
+        :param float lease_seconds:
+        :return list: dicts with id, connector_code, type_code, data and attempts
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute("""
+                UPDATE items SET status = ?, lease_until = NULL, error = ?
+                WHERE status = ? AND lease_until < ? AND attempts >= ?
+            """, [self.STATUS_FAILED, 'lease expired', self.STATUS_LEASED, now, self.max_attempts])
+            rows = conn.execute("""
+                SELECT id, connector_code, type_code, payload, attempts, due FROM items
+                WHERE status = ? ORDER BY due, id LIMIT ?
+            """, [self.STATUS_PENDING, limit]).fetchall()
+            rows += conn.execute("""
+                SELECT id, connector_code, type_code, payload, attempts, due FROM items
+                WHERE status = ? AND lease_until < ? ORDER BY due, id LIMIT ?
+            """, [self.STATUS_LEASED, now, limit]).fetchall()
+            # Same order as SQLite, items without due time (added before priorities) first
+            rows = sorted(rows, key=lambda row: (row[5] is not None, row[5] or 0, row[0]))[:limit]
+
+            conn.executemany(
+                """UPDATE items SET status = ?, lease_until = ?, worker = ?, attempts = attempts + 1 WHERE id = ?""",
+                [(self.STATUS_LEASED, now + lease_seconds, worker, row[0]) for row in rows]
+            )
+
+        return [{
+            'id': row[0],
+            'connector_code': row[1],
+            'type_code': row[2],
+            'data': decode_payload(row[3]),
+            'attempts': row[4] + 1,
+        } for row in rows]
+
+    def ack(self, ids):
+        """
+        Remove finished items
+
+        :param list ids:
+        """
+        with self.transaction() as conn:
+            conn.executemany("""DELETE FROM items WHERE id = ?""", [(item_id,) for item_id in ids])
+
+    def release(self, ids, error=None):
+        """
+        Release items that could not be processed, items that reached max attempts are marked failed
+
+        :param list ids:
+        :param str error:
+        """
+        with self.transaction() as conn:
+            conn.executemany("""
+                UPDATE items SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, lease_until = NULL, error = ?
+                WHERE id = ?
+            """, [(self.max_attempts, self.STATUS_FAILED, self.STATUS_PENDING, error, item_id) for item_id in ids])
+
+    def retry_failed(self):
+        """
+        Move failed items back to pending
+
+        :return int: number of items
+        """
+        with self.transaction() as conn:
+            return conn.execute(
+                """UPDATE items SET status = ?, attempts = 0, error = NULL WHERE status = ?""",
+                [self.STATUS_PENDING, self.STATUS_FAILED]
+            ).rowcount
+
+    def counts(self):
+        """
+        Count items per status
+
+        :return dict:
+        """
+        with self.lock:
+            rows = self.connection.execute("""SELECT status, COUNT(*) FROM items GROUP BY status""").fetchall()
+        return dict(rows)
+
+    def close(self):
+        """Close connection"""
+        self.connection.close()
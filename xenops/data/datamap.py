@@ -5,12 +5,36 @@ xenops.data.datamap
 :copyright: 2017 by Maikel Martens
 :license: GPLv3
 """
-import logging
+import json
 import uuid
+import hashlib
+import logging
+
+from xenops.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
 
+def value_digest(value):
+    """
+    Short digest of attribute value, used to detect changed attributes
+
+    :param value:
+    :return str:
+    """
+    return hashlib.md5(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def mapping_key(mapping):
+    """
+    Identity of a mapping, mappings with the same converters for the same attributes get the same key
+
+    :param dict mapping:
+    :return tuple:
+    """
+    return tuple(sorted((code, id(converter)) for code, converter in mapping.items()))
+
+
 class DataMapObject:
     """DataMapObject for converting raw service data to datatype data"""
 
@@ -32,9 +56,15 @@ class DataMapObject:
         self.local_id = None
         self.object_ids = {}
         """Object_ids hold object id by connector code"""
+        self.exports = {}
+        """Precomputed export data by connector code"""
+        self.export_cache = {}
+        """Export data by mapping key, shared by process connectors with the same mapping"""
+        self.payload_cache = {}
+        """Serialized export data by mapping key and serializer"""
 
         for enhancer in self.enhancers:
-            pass
+            enhancer.source_object = self
 
     def set_object_id(self, object_id):
         """
@@ -268,6 +298,24 @@ class Enhancer:
 
         return self.data.get(attribute_code, default, raise_keyerror)
 
+    def load_local(self):
+        """
+        Load DataMapObject from the connector local store when materialized
+
+        :return bool: True when loaded
+        """
+        self.data = self.connector.get_local(
+            self.source_object.datatype,
+            local_id=self.source_object.get_local_id(),
+            generic_id=self.source_object.get_generic_id()
+        )
+        return self.data is not None
+
     def _load_data(self):
-        """Load DataMapObject"""
-        self.data = self.connector.get(self.source_object.datatype.code, self.source_object.get('id'))
+        """Load DataMapObject from the connector local store when materialized, otherwise get it from the connector"""
+        if self.load_local():
+            return
+
+        datatype = self.source_object.datatype
+        with metrics.timer('xenops_enhancer_fetch_seconds', connector=self.connector.code, datatype=datatype.code):
+            self.data = self.connector.get(datatype, self.source_object.get('id'))
@@ -35,6 +35,8 @@ class DataTypeFactory:
         if code in cls._datatypes:
             datatype = cls._datatypes[code]
             datatype.generic_attribute_id = config.get('generic_attribute_id', datatype.generic_attribute_id)
+            datatype.depends_on = config.get('depends_on', datatype.depends_on)
+            datatype.priority = config.get('priority', datatype.priority)
 
             if mode == cls.MODE_MERGE:
                 for attribute_code, attribute_config in attributes.items():
@@ -45,7 +47,9 @@ class DataTypeFactory:
             else:
                 datatype.attributes = attributes
         else:
-            datatype = DataType(code, attributes, config.get('generic_attribute_id', 'id'))
+            datatype = DataType(
+                code, attributes, config.get('generic_attribute_id', 'id'), depends_on=config.get('depends_on'),
+                priority=config.get('priority', 0))
 
         cls._datatypes[code] = datatype
 
@@ -59,11 +63,29 @@ class DataTypeFactory:
         """
         return cls._datatypes.get(code)
 
+    @classmethod
+    def get_all(cls):
+        """
+        Get all registered data types
+
+        :return dict:
+        """
+        return dict(cls._datatypes)
+
+    @classmethod
+    def restore(cls, datatypes):
+        """
+        Restore registered data types, used when loading a config snapshot
+
+        :param dict datatypes:
+        """
+        cls._datatypes.update(datatypes)
+
 
 class DataType:
     """DataType class"""
 
-    def __init__(self, code, attributes, generic_attribute_id, verbose_name=''):
+    def __init__(self, code, attributes, generic_attribute_id, verbose_name='', depends_on=None, priority=0):
         """
         Init DataType
 
@@ -71,10 +93,14 @@ class DataType:
         :param dict attributes:
         :param str generic_attribute_id:
         :param str verbose_name:
+        :param list depends_on: Data type codes whose triggers must run first with xenops trigger --all
+        :param int priority: Priority of process work for objects of data type, higher goes first
         """
         self.code = code
         self.attributes = attributes
         self.generic_attribute_id = generic_attribute_id
+        self.depends_on = list(depends_on) if depends_on else []
+        self.priority = priority
         self.verbose_name = verbose_name if verbose_name else code.replace('_', '').title()
 
     def is_valid_attribute(self, code):
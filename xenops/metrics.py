@@ -0,0 +1,266 @@
+"""
+xenops.metrics
+~~~~~~~~~~~~~~
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRICS_HELP = {
+    'xenops_trigger_fetch_seconds': 'Time waiting for a trigger page from the service',
+    'xenops_export_seconds': 'Time mapping and exporting a data object for a process connector',
+    'xenops_export_cache_hits_total': 'Exports reused from a process connector with the same mapping',
+    'xenops_enhancer_fetch_seconds': 'Time fetching enhancer data from a connector',
+    'xenops_process_seconds': 'Latency of process calls per process connector',
+    'xenops_storage_seconds': 'Time of connector storage queries',
+    'xenops_trigger_seconds': 'Duration of trigger runs',
+    'xenops_trigger_objects_total': 'Objects handled by triggers',
+    'xenops_trigger_objects_per_second': 'Objects per second of last trigger run',
+    'xenops_webhook_notifications_total': 'Change notifications accepted by the webhook listener',
+    'xenops_parked_objects_total': 'Objects parked because the circuit breaker of the process connector was open',
+    'xenops_abandoned_calls': 'Timed out service calls per connector that are still running in an abandoned thread',
+    'xenops_get_deduplicated_total': 'Connector get calls answered by a concurrent call for the same object',
+    'xenops_materialized_reads_total': 'Enhancer reads from the local store of a connector by result (hit or miss)',
+}
+
+
+class Histogram:
+    """Histogram with cumulative buckets"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Init Histogram
+
+        :param tuple buckets: Upper bounds of buckets
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Add observed value
+
+        :param float value:
+        """
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+    def cumulative_counts(self):
+        """
+        Get cumulative count per bucket upper bound
+
+        :return list: [(bound, count)]
+        """
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class MetricsRegistry:
+    """
+    Registry of histograms, counters and gauges by metric name and labels
+
+    Metrics are exported in the Prometheus text format with render/write or served by serve.
+    """
+
+    def __init__(self):
+        """Init MetricsRegistry"""
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Remove all collected metrics"""
+        with self.lock:
+            self.histograms = {}
+            self.counters = {}
+            self.gauges = {}
+
+    @staticmethod
+    def _key(name, labels):
+        """
+        Metric key
+
+        :param str name:
+        :param dict labels:
+        :return tuple:
+        """
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def observe(self, name, value, **labels):
+        """
+        Observe value in histogram
+
+        :param str name:
+        :param float value:
+        :param labels:
+        """
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if not histogram:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increase counter
+
+        :param str name:
+        :param float value:
+        :param labels:
+        """
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """
+        Set gauge value
+
+        :param str name:
+        :param float value:
+        :param labels:
+        """
+        with self.lock:
+            self.gauges[self._key(name, labels)] = value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Observe duration of with block in seconds
+
+        :param str name:
+        :param labels:
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render(self):
+        """
+        Render metrics in Prometheus text format
+
+        :return str:
+        """
+        with self.lock:
+            histograms = sorted((key, histogram) for key, histogram in self.histograms.items())
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+
+        lines = []
+        described = set()
+
+        def describe(name, metric_type):
+            if name in described:
+                return
+            described.add(name)
+            if name in METRICS_HELP:
+                lines.append('# HELP {} {}'.format(name, METRICS_HELP[name]))
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+
+        for (name, labels), histogram in histograms:
+            describe(name, 'histogram')
+            for bound, count in histogram.cumulative_counts():
+                lines.append('{}_bucket{} {}'.format(name, format_labels(labels, le=repr(float(bound))), count))
+            lines.append('{}_bucket{} {}'.format(name, format_labels(labels, le='+Inf'), histogram.count))
+            lines.append('{}_sum{} {}'.format(name, format_labels(labels), repr(histogram.sum)))
+            lines.append('{}_count{} {}'.format(name, format_labels(labels), histogram.count))
+
+        for metric_type, items in [('counter', counters), ('gauge', gauges)]:
+            for (name, labels), value in items:
+                describe(name, metric_type)
+                lines.append('{}{} {}'.format(name, format_labels(labels), repr(float(value))))
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+        Write metrics in Prometheus text format to file (for node exporter textfile collector)
+
+        :param str path:
+        """
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def send_response(self, handler):
+        """
+        Answer GET request of http.server request handler, /metrics gets the metrics and other paths 404
+
+        :param http.server.BaseHTTPRequestHandler handler:
+        """
+        if handler.path.split('?')[0] != '/metrics':
+            handler.send_error(404)
+            return
+
+        body = self.render().encode('utf-8')
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/plain; version=0.0.4')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def serve(self, host='127.0.0.1', port=9099):
+        """
+        Serve metrics on http://host:port/metrics in a background thread
+
+        :param str host:
+        :param int port:
+        :return http.server.HTTPServer:
+        """
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                registry.send_response(self)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        server = HTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def format_labels(labels, **extra):
+    """
+    Format labels for Prometheus text format
+
+    :param tuple labels: Sorted (key, value) pairs
+    :param extra: Extra labels added at the end
+    :return str:
+    """
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    return '{' + ','.join('{}="{}"'.format(key, escape(value)) for key, value in items) + '}'
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,216 @@
+"""
+xenops.profiling
+~~~~~~~~~~~~~~~~
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import os
+import sys
+import time
+import pstats
+import cProfile
+import sysconfig
+import threading
+import tracemalloc
+from collections import Counter
+
+XENOPS_PATH = os.path.dirname(os.path.abspath(__file__))
+STDLIB_PATHS = tuple({os.path.abspath(sysconfig.get_paths()[key]) for key in ['stdlib', 'platstdlib']})
+
+FORMAT_PSTATS = 'pstats'
+FORMAT_COLLAPSED = 'collapsed'
+
+
+def code_group(filename):
+    """
+    Group of source file: xenops, python (stdlib/builtins) or service (everything else)
+
+    :param str filename:
+    :return str:
+    """
+    if not filename or filename == '~' or filename.startswith('<'):
+        return 'python'
+
+    filename = os.path.abspath(filename)
+    if filename.startswith(XENOPS_PATH + os.sep):
+        return 'xenops'
+    if 'site-packages' not in filename and filename.startswith(STDLIB_PATHS):
+        return 'python'
+    return 'service'
+
+
+class StackSampler:
+    """Sample stacks of all threads to create collapsed stack output (flamegraph.pl / speedscope format)"""
+
+    def __init__(self, interval=0.005):
+        """
+        Init StackSampler
+
+        :param float interval: Seconds between samples
+        """
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Start sampling in background thread"""
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop sampling"""
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+
+    def _run(self):
+        """Sample loop"""
+        own_ident = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame:
+                    stack.append('{}:{}'.format(frame.f_globals.get('__name__', '?'), frame.f_code.co_name))
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        """
+        Write collapsed stacks
+
+        :param str path:
+        """
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+class Profiler:
+    """
+    Profile a block of code with cProfile and optionally tracemalloc
+
+    cProfile only sees the calling thread, the collapsed format samples all threads so it also shows process calls
+    running in concurrent worker threads.
+
+    .. code-block:: python
+
+        with Profiler('trigger.pstats', memory=True) as profiler:
+            app.trigger('product', 'pim')
+        print(profiler.summary())
+    """
+
+    def __init__(self, output, output_format=FORMAT_PSTATS, memory=False, top=20):
+        """
+        Init Profiler
+
+        :param str output: Path of pstats or collapsed stack file
+        :param str output_format: pstats or collapsed
+        :param bool memory: Trace memory allocations
+        :param int top: Number of entries in summary
+        """
+        self.output = output
+        self.output_format = output_format
+        self.memory = memory
+        self.top = top
+        self.profile = cProfile.Profile()
+        self.sampler = StackSampler() if output_format == FORMAT_COLLAPSED else None
+        self.memory_snapshot = None
+        self.duration = 0
+
+    def __enter__(self):
+        """Start profiling"""
+        if self.memory:
+            tracemalloc.start()
+        if self.sampler:
+            self.sampler.start()
+        self.start_time = time.perf_counter()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *args):
+        """Stop profiling and write output"""
+        self.profile.disable()
+        self.duration = time.perf_counter() - self.start_time
+        if self.sampler:
+            self.sampler.stop()
+        if self.memory:
+            self.memory_snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        self.write()
+
+    def write(self):
+        """Write profile output"""
+        if self.sampler:
+            self.sampler.write(self.output)
+        else:
+            self.profile.dump_stats(self.output)
+
+    def time_stats(self):
+        """
+        Get own time per function
+
+        :return list: [(group, location, calls, own time, cumulative time)] sorted by own time
+        """
+        stats = pstats.Stats(self.profile).stats
+        result = []
+        for (filename, line, name), (calls, total_calls, own_time, cumulative_time, callers) in stats.items():
+            location = '{}:{}({})'.format(filename, line, name)
+            result.append((code_group(filename), location, total_calls, own_time, cumulative_time))
+        return sorted(result, key=lambda item: item[3], reverse=True)
+
+    def memory_stats(self):
+        """
+        Get allocated memory per source line
+
+        :return list: [(group, location, size, count)] sorted by size
+        """
+        if not self.memory_snapshot:
+            return []
+
+        result = []
+        for stat in self.memory_snapshot.statistics('lineno'):
+            frame = stat.traceback[0]
+            location = '{}:{}'.format(frame.filename, frame.lineno)
+            result.append((code_group(frame.filename), location, stat.size, stat.count))
+        return result
+
+    def summary(self):
+        """
+        Top-N summary of time and allocations grouped by xenops, service and python code
+
+        :return str:
+        """
+        time_stats = self.time_stats()
+        lines = ['Profile ({:.3f}s), output written to {}'.format(self.duration, self.output), '', 'Time per group:']
+
+        group_times = Counter()
+        for group, location, calls, own_time, cumulative_time in time_stats:
+            group_times[group] += own_time
+        for group, own_time in group_times.most_common():
+            lines.append('  {:<8} {:>10.3f}s'.format(group, own_time))
+
+        lines += ['', 'Top {} functions by own time:'.format(self.top)]
+        lines.append('  {:<8} {:>10} {:>10} {:>10}  {}'.format('group', 'calls', 'own', 'cumulative', 'function'))
+        for group, location, calls, own_time, cumulative_time in time_stats[:self.top]:
+            lines.append('  {:<8} {:>10} {:>10.3f} {:>10.3f}  {}'.format(
+                group, calls, own_time, cumulative_time, location))
+
+        memory_stats = self.memory_stats()
+        if memory_stats:
+            group_sizes = Counter()
+            for group, location, size, count in memory_stats:
+                group_sizes[group] += size
+
+            lines += ['', 'Allocated memory per group:']
+            for group, size in group_sizes.most_common():
+                lines.append('  {:<8} {:>10.1f} KiB'.format(group, size / 1024))
+
+            lines += ['', 'Top {} allocations:'.format(self.top)]
+            for group, location, size, count in memory_stats[:self.top]:
+                lines.append('  {:<8} {:>10.1f} KiB {:>8} blocks  {}'.format(group, size / 1024, count, location))
+
+        return '\n'.join(lines)
@@ -0,0 +1,301 @@
+"""
+xenops.reconcile
+~~~~~~~~~~~~~~~~
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import json
+import hashlib
+import logging
+
+from xenops.service import TriggerRequest, not_implemented
+
+logger = logging.getLogger(__name__)
+
+
+class HashTree:
+    """
+    Two level hash tree of objects bucketed by local id
+
+    The root hash covers the bucket hashes and a bucket hash covers the object hashes in the bucket, so two trees are
+    compared by root, then by bucket and only the objects of different buckets are compared one by one.
+    """
+
+    def __init__(self, buckets=256):
+        """
+        Init HashTree
+
+        :param int buckets: Number of buckets
+        """
+        self.buckets = [dict() for _ in range(buckets)]
+        self.bucket_hashes = None
+
+    def bucket(self, local_id):
+        """
+        Get bucket index of local id
+
+        :param str local_id:
+        :return int:
+        """
+        return int(hashlib.md5(local_id.encode('utf-8')).hexdigest()[:8], 16) % len(self.buckets)
+
+    def add(self, local_id, values):
+        """
+        Add object values to tree
+
+        :param str local_id:
+        :param dict values: Attribute values of object
+        """
+        digest = hashlib.md5(json.dumps(values, sort_keys=True, default=str).encode('utf-8')).digest()
+        self.buckets[self.bucket(local_id)][local_id] = digest
+        self.bucket_hashes = None
+
+    def get_bucket_hashes(self):
+        """
+        Get hash per bucket
+
+        :return list:
+        """
+        if self.bucket_hashes is None:
+            self.bucket_hashes = []
+            for bucket in self.buckets:
+                digest = hashlib.md5()
+                for local_id in sorted(bucket):
+                    digest.update(local_id.encode('utf-8'))
+                    digest.update(bucket[local_id])
+                self.bucket_hashes.append(digest.digest())
+        return self.bucket_hashes
+
+    @property
+    def root(self):
+        """Root hash of tree"""
+        return hashlib.md5(b''.join(self.get_bucket_hashes())).hexdigest()
+
+    def __len__(self):
+        """
+        Count objects in tree
+
+        :return int:
+        """
+        return sum(len(bucket) for bucket in self.buckets)
+
+    def diff(self, other):
+        """
+        Compare tree with other tree with the same number of buckets
+
+        :param HashTree other:
+        :return tuple: (local ids that differ or are missing in other, local ids only in other, different buckets)
+        """
+        if self.root == other.root:
+            return [], [], 0
+
+        changed = []
+        extra = []
+        buckets = 0
+        for index, (bucket_hash, other_hash) in enumerate(zip(self.get_bucket_hashes(), other.get_bucket_hashes())):
+            if bucket_hash == other_hash:
+                continue
+
+            buckets += 1
+            bucket = self.buckets[index]
+            other_bucket = other.buckets[index]
+            changed += [local_id for local_id, digest in bucket.items() if other_bucket.get(local_id) != digest]
+            extra += [local_id for local_id in other_bucket if local_id not in bucket]
+
+        return changed, extra, buckets
+
+
+class ReconcileResult:
+    """Result of a reconcile run"""
+
+    def __init__(self):
+        """Init ReconcileResult"""
+        self.source_count = 0
+        self.target_count = 0
+        self.different_buckets = 0
+        self.changed = []
+        self.extra = []
+        self.pushed = 0
+        self.failed = 0
+
+
+class Reconciler:
+    """
+    Find objects that are out of sync between a source and target connector and process only those again
+
+    Both sides are hashed on the data type values of the attributes mapped by the source and the target, converted
+    from the raw data with the mapping of each connector. The target is listed with its own trigger when the service
+    has one, otherwise target objects are fetched for the known object ids. Comparing does not write to the storage,
+    source objects unknown to xenops are keyed by their object id and always differ.
+    """
+
+    def __init__(self, source, target, datatype, buckets=256, page_size=100):
+        """
+        Init Reconciler
+
+        :param xenops.connector.Connector source:
+        :param xenops.connector.Connector target:
+        :param xenops.data.DataType datatype:
+        :param int buckets: Number of hash tree buckets
+        :param int page_size: Number of objects fetched and pushed at once
+        """
+        self.source = source
+        self.target = target
+        self.datatype = datatype
+        self.buckets = buckets
+        self.page_size = page_size
+        self.process_configs = [
+            config for config in source.get_processes_config(datatype.code) if config['connector'].code == target.code
+        ]
+        if not self.process_configs:
+            raise Exception('Connector ({}) does not process ({}) from ({})'.format(
+                target.code, datatype.code, source.code))
+
+        attributes = set(source.get_mapping(datatype)) & set(target.get_mapping(datatype))
+        for config in self.process_configs:
+            if config.get('attributes'):
+                attributes &= set(config['attributes'])
+        self.attributes = sorted(attributes)
+
+    def get_values(self, connector, object_data):
+        """
+        Get compared attribute values of raw object data with the connector mapping
+
+        :param xenops.connector.Connector connector:
+        :param dict object_data:
+        :return dict:
+        """
+        mapping = connector.get_mapping(self.datatype)
+        values = {}
+        for code in self.attributes:
+            try:
+                values[code] = mapping[code].import_attribute(object_data)
+            except KeyError:
+                values[code] = None
+        return values
+
+    def list_objects(self, connector):
+        """
+        List all objects of connector with its trigger
+
+        :param xenops.connector.Connector connector:
+        :return Iterator: Raw object data
+        """
+        service_type = connector.service.types.get(self.datatype.code)
+        request = TriggerRequest(connector.service_config, {}, last_run=None, context=connector.context)
+        for page in service_type.trigger_pages(request, self.page_size):
+            for object_data in page:
+                yield object_data
+
+    def build_source_tree(self):
+        """
+        Build hash tree of all source objects
+
+        :return tuple: (HashTree, source object id by local id)
+        """
+        tree = HashTree(self.buckets)
+        object_ids = {}
+        service_type = self.source.service.types.get(self.datatype.code)
+        for object_data in self.list_objects(self.source):
+            try:
+                object_id = service_type.id_converter.import_attribute(object_data)
+            except KeyError:
+                continue
+            local_id = self.source.storage.get_local_id(self.datatype, object_id) or 'new:{}'.format(object_id)
+            object_ids[local_id] = object_id
+            tree.add(local_id, self.get_values(self.source, object_data))
+        return tree, object_ids
+
+    def build_target_tree(self, local_ids):
+        """
+        Build hash tree of target objects, objects unknown to xenops are skipped
+
+        :param list local_ids: Local ids of source objects
+        :return HashTree:
+        """
+        tree = HashTree(self.buckets)
+        service_type = self.target.service.types.get(self.datatype.code)
+
+        if service_type.trigger_function is not not_implemented:
+            objects = self.list_objects(self.target)
+        else:
+            object_ids = [self.target.storage.get_object_id(self.datatype, local_id) for local_id in local_ids]
+            object_ids = [object_id for object_id in object_ids if object_id]
+            objects = (
+                data_object.data
+                for start in range(0, len(object_ids), self.page_size)
+                for data_object in self.target.get_many(self.datatype, object_ids[start:start + self.page_size])
+            )
+
+        for object_data in objects:
+            try:
+                object_id = service_type.id_converter.import_attribute(object_data)
+            except KeyError:
+                continue
+            local_id = self.target.storage.get_local_id(self.datatype, object_id)
+            if local_id:
+                tree.add(local_id, self.get_values(self.target, object_data))
+        return tree
+
+    def run(self, dry_run=False):
+        """
+        Compare source with target and process the objects that differ
+
+        :param bool dry_run: Only compare
+        :return ReconcileResult:
+        """
+        result = ReconcileResult()
+
+        source_tree, object_ids = self.build_source_tree()
+        target_tree = self.build_target_tree(list(object_ids))
+        result.source_count = len(source_tree)
+        result.target_count = len(target_tree)
+        result.changed, result.extra, result.different_buckets = source_tree.diff(target_tree)
+
+        logger.info('Reconcile ({}) {} -> {}: {} of {} buckets and {} objects differ'.format(
+            self.datatype.code, self.source.code, self.target.code, result.different_buckets, self.buckets,
+            len(result.changed)))
+
+        if dry_run:
+            return result
+
+        # Attribute subscriptions and export deltas would skip objects that only changed in the target
+        process_configs = [dict(config, attributes=None) for config in self.process_configs]
+        self.target.storage.delete_attribute_snapshots(self.datatype, 'export', result.changed)
+        for data_objects in self.get_source_objects([object_ids[local_id] for local_id in result.changed]):
+            failed = self.source.process_data_objects(data_objects, process_configs)
+            result.failed += len(failed)
+            result.pushed += len(data_objects) - len(failed)
+
+        return result
+
+    def get_source_objects(self, object_ids):
+        """
+        Get source objects for object ids in pages, lists the source again when the service has no get
+
+        :param list object_ids:
+        :return Iterator: Lists of DataMapObject
+        """
+        service_type = self.source.service.types.get(self.datatype.code)
+        if service_type.has_get_many() or service_type.get_function is not not_implemented:
+            objects = (
+                data_object.data
+                for start in range(0, len(object_ids), self.page_size)
+                for data_object in self.source.get_many(self.datatype, object_ids[start:start + self.page_size])
+            )
+        else:
+            wanted = set(object_ids)
+            objects = (
+                object_data for object_data in self.list_objects(self.source)
+                if service_type.id_converter.import_attribute(object_data) in wanted
+            )
+
+        page = []
+        for object_data in objects:
+            page.append(self.source.create_data_object(self.datatype, object_data))
+            if len(page) >= self.page_size:
+                yield page
+                page = []
+        if page:
+            yield page
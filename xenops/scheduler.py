@@ -0,0 +1,231 @@
+"""
+xenops.scheduler
+~~~~~~~~~~~~~~~~
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import logging
+import collections
+
+from xenops.data import DataTypeFactory
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidDependencies(Exception):
+    """Invalid data type dependencies Exception"""
+
+    pass
+
+
+class TriggerJob:
+    """Trigger run of a connector within a scheduler run"""
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCESS = 'success'
+    STATUS_FAILED = 'failed'
+    STATUS_SKIPPED = 'skipped'
+
+    def __init__(self, connector, trigger_code, type_code, targets):
+        """
+        Init TriggerJob
+
+        :param xenops.connector.Connector connector:
+        :param str trigger_code:
+        :param str type_code:
+        :param set targets: Codes of connectors the trigger processes into
+        """
+        self.connector = connector
+        self.trigger_code = trigger_code
+        self.type_code = type_code
+        self.targets = targets
+        self.dependencies = []
+        self.status = self.STATUS_PENDING
+        self.error = None
+
+    def __str__(self):
+        """
+        Representation of job
+
+        :return str:
+        """
+        return '{}.{}'.format(self.connector.code, self.trigger_code)
+
+
+class TriggerScheduler:
+    """
+    Run all connector triggers in one process with a thread pool
+
+    A trigger starts when all triggers of the data types in its data type `depends_on` succeeded, it is skipped when
+    one of them failed. Ready triggers whose targets have the least running triggers start first and a target runs
+    at most target_concurrency triggers at once, so a trigger can not hold all workers for a shared target.
+    """
+
+    def __init__(self, app, concurrency=4, target_concurrency=None):
+        """
+        Init TriggerScheduler
+
+        :param xenops.app.Application app:
+        :param int concurrency: Number of triggers that run at once
+        :param int target_concurrency: Number of triggers that process into the same connector at once, default half of
+            concurrency
+        """
+        self.app = app
+        self.concurrency = max(1, concurrency)
+        self.target_concurrency = target_concurrency if target_concurrency else max(1, self.concurrency // 2)
+        self.jobs = self.create_jobs()
+
+    def create_jobs(self):
+        """
+        Create a job for every connector trigger and resolve dependencies
+
+        :return list:
+        """
+        jobs = []
+        for connector in self.app.connectors.values():
+            for trigger_code, trigger in connector.triggers.items():
+                type_code = trigger.get('type', trigger_code)
+                targets = self.get_targets(connector.code, type_code)
+                jobs.append(TriggerJob(connector, trigger_code, type_code, targets))
+
+        jobs_by_type = collections.defaultdict(list)
+        for job in jobs:
+            jobs_by_type[job.type_code].append(job)
+
+        for job in jobs:
+            datatype = DataTypeFactory.get(job.type_code)
+            for type_code in datatype.depends_on if datatype else []:
+                job.dependencies.extend(jobs_by_type.get(type_code, []))
+
+        self.check_cycles(jobs)
+        return jobs
+
+    def get_targets(self, connector_code, type_code):
+        """
+        Get codes of the connectors a trigger processes into, including connectors chained with process `from`
+
+        :param str connector_code:
+        :param str type_code:
+        :return set:
+        """
+        routes = self.app.routing['processes'].get(type_code, [])
+        targets = set()
+        pending = [(connector_code, False)]
+        while pending:
+            code, chained = pending.pop()
+            for route in routes:
+                sources = route.get('from')
+                if (code in sources if sources else not chained) and route['connector'] not in targets:
+                    targets.add(route['connector'])
+                    pending.append((route['connector'], True))
+        return targets
+
+    @staticmethod
+    def check_cycles(jobs):
+        """
+        Raise InvalidDependencies when the data type dependencies contain a cycle
+
+        :param list jobs:
+        """
+        visited = set()
+        path = []
+
+        def visit(job):
+            if job in path:
+                cycle = path[path.index(job):] + [job]
+                raise InvalidDependencies('Trigger dependency cycle: {}'.format(' -> '.join(map(str, cycle))))
+            if job in visited:
+                return
+            path.append(job)
+            for dependency in job.dependencies:
+                visit(dependency)
+            path.pop()
+            visited.add(job)
+
+        for job in jobs:
+            visit(job)
+
+    def run(self, **options):
+        """
+        Run all triggers
+
+        :param options: Override trigger config options
+        :return list: Finished jobs
+        """
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+        pending = list(self.jobs)
+        running = {}
+        target_load = collections.Counter()
+
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            while pending or running:
+                self.skip_failed_dependencies(pending)
+
+                for job in self.ready_jobs(pending, target_load):
+                    if len(running) >= self.concurrency:
+                        break
+                    if any(target_load[target] >= self.target_concurrency for target in job.targets):
+                        continue
+
+                    logger.info('Start trigger {}'.format(job))
+                    pending.remove(job)
+                    job.status = TriggerJob.STATUS_RUNNING
+                    target_load.update(job.targets)
+                    future = executor.submit(job.connector.execute_trigger, job.trigger_code, **options)
+                    running[future] = job
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    target_load.subtract(job.targets)
+                    job.error = future.exception()
+                    if job.error:
+                        logger.error('Trigger {} failed: {}'.format(job, job.error))
+                        job.status = TriggerJob.STATUS_FAILED
+                    else:
+                        job.status = TriggerJob.STATUS_SUCCESS
+
+        return self.jobs
+
+    @staticmethod
+    def skip_failed_dependencies(pending):
+        """
+        Skip pending jobs with a failed or skipped dependency
+
+        :param list pending:
+        """
+        skipped = True
+        while skipped:
+            skipped = False
+            for job in list(pending):
+                failed = [dependency for dependency in job.dependencies
+                          if dependency.status in (TriggerJob.STATUS_FAILED, TriggerJob.STATUS_SKIPPED)]
+                if failed:
+                    logger.warning('Skip trigger {}, dependency {} did not succeed'.format(job, failed[0]))
+                    job.status = TriggerJob.STATUS_SKIPPED
+                    pending.remove(job)
+                    skipped = True
+
+    @staticmethod
+    def ready_jobs(pending, target_load):
+        """
+        Get jobs whose dependencies succeeded, least loaded targets first and then by data type priority
+
+        :param list pending:
+        :param collections.Counter target_load: Number of running jobs per target
+        :return list:
+        """
+        ready = [
+            job for job in pending
+            if all(dependency.status == TriggerJob.STATUS_SUCCESS for dependency in job.dependencies)
+        ]
+        return sorted(ready, key=lambda job: (
+            max([target_load[target] for target in job.targets] or [0]),
+            -getattr(DataTypeFactory.get(job.type_code), 'priority', 0)
+        ))
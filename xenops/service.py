@@ -5,65 +5,157 @@ xenops.service
 :copyright: 2017 by Maikel Martens
 :license: GPLv3
 """
+import json
+import inspect
 import logging
 
+from xenops.concurrency import RateLimiter, run_coroutine
 from xenops.data import DataTypeFactory
+from xenops.data.datamap import value_digest
+from xenops.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
 
+def not_implemented(*args, **kwargs):
+    """Do nothing, used for service functions that are not given"""
+    pass
+
+
+def serialize_json(data):
+    """
+    Serialize export data to JSON
+
+    :param dict data:
+    :return str:
+    """
+    return json.dumps(data, default=str)
+
+
 class TriggerRequest:
     """Trigger request"""
 
-    def __init__(self, service_config, trigger_config, last_run):
+    def __init__(self, service_config, trigger_config, last_run, cursor=None, context=None, shard=None):
         """
         Init trigger request
 
         :param dict service_config:
         :param dict trigger_config:
         :param datetime.datetime last_run:
+        :param cursor: Continuation cursor of last unfinished run, as given by a TriggerPage
+        :param xenops.connector.context.ConnectorContext context:
+        :param xenops.connector.shard.Shard shard: Shard of this run, services can use it to only fetch shard objects
         """
         self.service_config = service_config
         self.trigger_config = trigger_config
         self.last_run = last_run
+        self.cursor = cursor
+        self.context = context
+        self.shard = shard
+
+
+class TriggerPage:
+    """
+    Page of raw objects yielded by a trigger
+
+    A trigger can yield pages instead of single dicts, the cursor is an opaque (json serializable) value that is
+    stored after the page is processed and given back as ``request.cursor`` when an unfinished run is resumed.
+
+    .. code-block:: python
+
+        def trigger(request):
+            page = request.cursor or 1
+            while page:
+                result = api.products(updated_since=request.last_run, page=page)
+                page = result.next_page
+                yield TriggerPage(result.items, cursor=page)
+    """
+
+    def __init__(self, objects, cursor=None):
+        """
+        Init trigger page
+
+        :param list objects:
+        :param cursor:
+        """
+        self.objects = list(objects) if objects else []
+        self.cursor = cursor
+
+    def __iter__(self):
+        """Iterate over page objects"""
+        return iter(self.objects)
+
+    def __len__(self):
+        """Return number of objects in page"""
+        return len(self.objects)
 
 
 class GetRequest:
     """Get request"""
 
-    def __init__(self, service_config, object_id, generic_id):
+    def __init__(self, service_config, object_id, generic_id, context=None):
         """
         Init get request
 
         :param dict service_config:
         :param str object_id:
         :param str generic_id:
+        :param xenops.connector.context.ConnectorContext context:
         """
         self.service_config = service_config
         self.object_id = object_id
         self.generic_id = generic_id
+        self.context = context
+
+
+class GetManyRequest:
+    """Get many request"""
+
+    def __init__(self, service_config, object_ids=None, generic_ids=None, context=None):
+        """
+        Init get many request
+
+        :param dict service_config:
+        :param list object_ids:
+        :param list generic_ids:
+        :param xenops.connector.context.ConnectorContext context:
+        """
+        self.service_config = service_config
+        self.object_ids = object_ids if object_ids else []
+        self.generic_ids = generic_ids if generic_ids else []
+        self.context = context
 
 
 class ProcessRequest:
     """Process request"""
 
-    def __init__(self, connector, process_config, data_objects):
+    def __init__(self, connector, process_config, data_objects, run_stats=None):
         """
         Init process request
 
         :param xenops.connector.Connector connector:
         :param dict process_config:
         :param xenops.data.DataMapObject[] data_objects:
+        :param xenops.connector.runstats.RunStats run_stats: Trigger run stats for counting exported bytes
         """
         self.connector = connector
         self.process_config = process_config
         self.data_objects = data_objects
+        self.run_stats = run_stats
+        self.export_snapshots = None
+        self.new_export_snapshots = {}
+        self.emitted = {}
 
     @property
     def service_config(self):
         """Service config"""
         return self.connector.service_config
 
+    @property
+    def context(self):
+        """Connector context with pooled resources"""
+        return self.connector.context
+
     def get_object_id(self, data_object):
         """
         Get object id for current connector
@@ -73,38 +165,201 @@ class ProcessRequest:
         """
         return data_object.get_object_id(self.connector)
 
+    def emit(self, data_object, object_data):
+        """
+        Set data of object as written to the service, chained process configs get this data instead of the export data
+
+        :param xenops.data.DataMapObject data_object:
+        :param dict object_data: Raw service data, for example the response with the created object id
+        """
+        self.emitted[id(data_object)] = object_data
+
     def get_export_data(self, data_object):
         """
         Get exported data for current connector mapping
 
+        The export is shared with other process connectors that use the same mapping, treat it as read only.
+
         :param data_object:
         :return dict:
         """
-        return data_object.export_to(self.connector.get_mapping(data_object.datatype))
+        return self.export(data_object)
+
+    def get_export_delta(self, data_object):
+        """
+        Get exported attributes that changed since the last successful process of the object for this connector
+
+        Compares the top level export keys with a snapshot of digests that is saved when the request succeeds. Keys
+        that are no longer exported are given as None. Objects that were never processed get the full export.
+
+        :param data_object:
+        :return dict:
+        """
+        if self.export_snapshots is None:
+            self.export_snapshots = self.connector.storage.get_attribute_snapshots(
+                data_object.datatype, 'export', [data.get_local_id() for data in self.data_objects])
+
+        data = self.export(data_object)
+        digests = {key: value_digest(value) for key, value in data.items()}
+        previous = self.export_snapshots.get(data_object.get_local_id(), {})
+        delta = {key: value for key, value in data.items() if previous.get(key) != digests[key]}
+        delta.update((key, None) for key in previous if key not in digests)
+        self.new_export_snapshots[data_object.get_local_id()] = digests
+
+        return delta
+
+    def save_export_snapshots(self):
+        """Save snapshots of delta exports, called when the request succeeded"""
+        if self.new_export_snapshots:
+            self.connector.storage.set_attribute_snapshots(
+                self.data_objects[0].datatype, 'export', self.new_export_snapshots)
+
+    def get_export_payload(self, data_object, serializer=None):
+        """
+        Get serialized export data, reused by process connectors with the same mapping and serializer
+
+        The payload size is counted in the run stats bytes exported, exports that are not serialized by xenops are
+        not counted.
+
+        :param data_object:
+        :param Callable serializer: Function that serializes export data, default JSON
+        :return:
+        """
+        serializer = serializer if serializer else serialize_json
+        key = (self.connector.get_mapping_key(data_object.datatype), serializer)
+        payload = data_object.payload_cache.get(key)
+        if payload is None:
+            payload = data_object.payload_cache[key] = serializer(self.export(data_object))
+
+        if self.run_stats:
+            self.run_stats.add(bytes_exported=len(payload))
+        return payload
+
+    def export(self, data_object):
+        """
+        Export data object once per distinct mapping
+
+        :param data_object:
+        :return dict:
+        """
+        data = data_object.exports.get(self.connector.code)
+        if data is not None:
+            return data
+
+        key = self.connector.get_mapping_key(data_object.datatype)
+        data = data_object.export_cache.get(key)
+        if data is not None:
+            metrics.inc('xenops_export_cache_hits_total', connector=self.connector.code,
+                        datatype=data_object.datatype.code)
+            return data
+
+        with metrics.timer('xenops_export_seconds', connector=self.connector.code, datatype=data_object.datatype.code):
+            data = data_object.export_to(self.connector.get_mapping(data_object.datatype))
+
+        data_object.export_cache[key] = data
+        return data
 
 
 class Service:
     """Service class"""
 
-    def __init__(self, code, verbose_name, service_types):
+    def __init__(self, code, verbose_name, service_types, setup=None, teardown=None):
         """
         Init Service
 
         :param str code:
         :param str verbose_name:
         :param dict service_types:
+        :param Callable setup: Called with connector context when connector is opened
+        :param Callable teardown: Called with connector context when connector is closed
         """
         self.code = code
         self.verbose_name = verbose_name
         self.types = service_types
+        self.setup_function = setup
+        self.teardown_function = teardown
+
+    def setup(self, context):
+        """
+        Set up pooled resources for connector context
+
+        :param xenops.connector.context.ConnectorContext context:
+        """
+        if self.setup_function:
+            self.setup_function(context)
+
+    def teardown(self, context):
+        """
+        Teardown pooled resources of connector context
+
+        :param xenops.connector.context.ConnectorContext context:
+        """
+        if self.teardown_function:
+            self.teardown_function(context)
 
     # TODO: Maybe add trigger/get/process(type_code, request)
 
 
+class ServiceCapabilities:
+    """
+    Capabilities of a service type, used by the connector to pick the fastest way of calling the service
+
+    .. code-block:: python
+
+        'capabilities': {
+            'batch_size': 50,  # process accepts up to 50 data objects per request
+            'concurrency': 4,  # maximum number of calls running at the same time
+            'rate_limit': 10,  # maximum number of calls per second
+            'idempotent': True,  # process can safely be called again for the same object (failed calls are retried)
+            'retry_timeout': True,  # timed out process calls are retried too, while the first call may still run
+            'async': True,  # get/process are coroutine functions, default detected from the functions
+        }
+    """
+
+    def __init__(self, batch_size=1, concurrency=1, rate_limit=None, idempotent=False, is_async=False,
+                 retry_timeout=False):
+        """
+        Init ServiceCapabilities
+
+        :param int batch_size:
+        :param int concurrency:
+        :param float rate_limit:
+        :param bool idempotent:
+        :param bool is_async:
+        :param bool retry_timeout:
+        """
+        self.batch_size = max(1, int(batch_size or 1))
+        self.concurrency = max(1, int(concurrency or 1))
+        self.rate_limit = rate_limit
+        self.idempotent = bool(idempotent)
+        self.is_async = bool(is_async)
+        self.retry_timeout = bool(retry_timeout)
+
+    @classmethod
+    def from_config(cls, config, is_async=False):
+        """
+        Create capabilities from service type capabilities config
+
+        :param dict config:
+        :param bool is_async: Default for async when not in config
+        :return ServiceCapabilities:
+        """
+        config = config if config else {}
+        return cls(
+            batch_size=config.get('batch_size', 1),
+            concurrency=config.get('concurrency', 1),
+            rate_limit=config.get('rate_limit'),
+            idempotent=config.get('idempotent', False),
+            is_async=config.get('async', is_async),
+            retry_timeout=config.get('retry_timeout', False),
+        )
+
+
 class ServiceType:
     """Service type"""
 
-    def __init__(self, datatype, id_converter, update_converter, mapping, trigger, get, process):
+    def __init__(self, datatype, id_converter, update_converter, mapping, trigger, get, process, get_many=None,
+                 capabilities=None, partition_key=None, priority=None):
         """
         Init Service type
 
@@ -113,6 +368,10 @@ class ServiceType:
         :param Callable trigger:
         :param Callable get:
         :param Callable process:
+        :param Callable get_many:
+        :param ServiceCapabilities capabilities:
+        :param Callable partition_key: Returns shard partition key for raw data, default id converter value
+        :param Callable priority: Returns process priority for raw data, higher goes first
         """
         self.datatype = datatype
         self.id_converter = id_converter
@@ -121,6 +380,57 @@ class ServiceType:
         self.trigger_function = trigger
         self.get_function = get
         self.process_function = process
+        self.get_many_function = get_many
+        self.partition_key_function = partition_key
+        self.priority_function = priority
+        self.capabilities = capabilities if capabilities else ServiceCapabilities()
+        self.rate_limiter = RateLimiter(self.capabilities.rate_limit)
+
+    def partition_key(self, data):
+        """
+        Get partition key of raw data used for sharding
+
+        :param dict data:
+        :return:
+        """
+        if self.partition_key_function:
+            return self.partition_key_function(data)
+
+        if self.id_converter:
+            try:
+                return self.id_converter.import_attribute(data)
+            except KeyError:
+                pass
+
+        return None
+
+    def _call(self, function, request):
+        """
+        Call service function, respecting rate limit and running coroutines to completion
+
+        :param Callable function:
+        :param request:
+        :return:
+        """
+        self.rate_limiter.wait()
+        result = function(request)
+        if inspect.iscoroutine(result):
+            return run_coroutine(result)
+        return result
+
+    async def _call_async(self, function, request):
+        """
+        Call service function in running event loop, respecting rate limit
+
+        :param Callable function:
+        :param request:
+        :return:
+        """
+        await self.rate_limiter.wait_async()
+        result = function(request)
+        if inspect.iscoroutine(result):
+            return await result
+        return result
 
     def trigger(self, request):
         """
@@ -130,7 +440,37 @@ class ServiceType:
         :return Generator[dict]:
         """
         for data in self.trigger_function(request):
-            yield data
+            if isinstance(data, TriggerPage):
+                yield from data.objects
+            else:
+                yield data
+
+    def trigger_pages(self, request, page_size=100):
+        """
+        Run trigger and group result in pages
+
+        Pages yielded by the trigger function are passed on as is, single dicts are grouped in pages of page_size.
+
+        :param xenops.service.TriggerRequest request:
+        :param int page_size:
+        :return Generator[xenops.service.TriggerPage]:
+        """
+        objects = []
+        for data in self.trigger_function(request) or []:
+            if isinstance(data, TriggerPage):
+                if objects:
+                    yield TriggerPage(objects)
+                    objects = []
+                yield data
+                continue
+
+            objects.append(data)
+            if len(objects) >= page_size:
+                yield TriggerPage(objects)
+                objects = []
+
+        if objects:
+            yield TriggerPage(objects)
 
     def get(self, request):
         """
@@ -139,7 +479,20 @@ class ServiceType:
         :param xenops.service.GetRequest request:
         :return dict:
         """
-        return self.get_function(request)
+        return self._call(self.get_function, request)
+
+    def get_many(self, request):
+        """
+        Get data for multiple objects from service
+
+        :param xenops.service.GetManyRequest request:
+        :return list: list of dicts in same order as requested ids
+        """
+        return self._call(self.get_many_function, request)
+
+    def has_get_many(self):
+        """Check if service type supports getting multiple objects in one call"""
+        return self.get_many_function is not None
 
     def process(self, request):
         """
@@ -148,7 +501,25 @@ class ServiceType:
         :param xenops.service.ProcessRequest request:
         :return int: data object id from service
         """
-        return self.process_function(request)
+        return self._call(self.process_function, request)
+
+    async def process_async(self, request):
+        """
+        Process data from trigger in running event loop
+
+        :param xenops.service.ProcessRequest request:
+        :return int: data object id from service
+        """
+        return await self._call_async(self.process_function, request)
+
+    async def get_async(self, request):
+        """
+        Get data from service in running event loop
+
+        :param xenops.service.GetRequest request:
+        :return dict:
+        """
+        return await self._call_async(self.get_function, request)
 
 
 class ServiceFactory:
@@ -184,25 +555,29 @@ class ServiceFactory:
                 )
                 continue
 
-            def trigger_function(*args, **kwargs):
-                pass
-
-            def get_function(*args, **kwargs):
-                pass
-
-            def process_function(*args, **kwargs):
-                pass
+            trigger_function = get_function = process_function = not_implemented
 
             # TODO: Rename to objects
             if 'trigger' in type_config and callable(type_config['trigger']):
-                trigger_function = type_config['trigger']  # noqa F811
+                trigger_function = type_config['trigger']
 
             # TODO: Rename to object
             if 'get' in type_config and callable(type_config['get']):
-                get_function = type_config['get']  # noqa F811
+                get_function = type_config['get']
 
             if 'process' in type_config and callable(type_config['process']):
-                process_function = type_config['process']  # noqa F811
+                process_function = type_config['process']
+
+            get_many_function = None
+            if 'get_many' in type_config and callable(type_config['get_many']):
+                get_many_function = type_config['get_many']
+
+            if type_config.get('capabilities') is not None and not isinstance(type_config['capabilities'], dict):
+                logger.error('Service ({}) capabilities for ({}) is not an dict and will be ignored!'.format(
+                    config['code'],
+                    type_code
+                ))
+                type_config = dict(type_config, capabilities={})
 
             types[datatype.code] = ServiceType(
                 datatype=datatype,
@@ -211,13 +586,22 @@ class ServiceFactory:
                 mapping=type_config.get('mapping', {}),  # @TODO validate mapping
                 trigger=trigger_function,
                 get=get_function,
-                process=process_function
+                process=process_function,
+                get_many=get_many_function,
+                partition_key=type_config.get('partition_key') if callable(type_config.get('partition_key')) else None,
+                priority=type_config.get('priority') if callable(type_config.get('priority')) else None,
+                capabilities=ServiceCapabilities.from_config(
+                    type_config.get('capabilities'),
+                    is_async=inspect.iscoroutinefunction(process_function) or inspect.iscoroutinefunction(get_function)
+                )
             )
 
         cls._services[config['code']] = Service(
             code=config['code'],
             verbose_name=config.get('verbose_name'),
-            service_types=types
+            service_types=types,
+            setup=config.get('setup') if callable(config.get('setup')) else None,
+            teardown=config.get('teardown') if callable(config.get('teardown')) else None
         )
 
         return True
@@ -231,3 +615,12 @@ class ServiceFactory:
         :return xenops.service.Service:
         """
         return cls._services.get(code)
+
+    @classmethod
+    def restore(cls, services):
+        """
+        Restore registered services, used when loading a config snapshot
+
+        :param dict services:
+        """
+        cls._services.update(services)
@@ -0,0 +1,157 @@
+"""
+xenops.snapshot
+~~~~~~~~~~~~~~~
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import os
+import sys
+import pickle
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+SKIP_DIRECTORIES = {'__pycache__', 'node_modules', 'site-packages'}
+
+
+def iter_source_files(path, exclude=None):
+    """
+    Iterate over Python files in path, hidden directories and virtualenvs are skipped
+
+    :param str path:
+    :param list exclude: Directories to skip
+    :return Iterator: Absolute file paths
+    """
+    exclude = set(exclude if exclude else [])
+    for root, directories, files in os.walk(path):
+        directories[:] = sorted(
+            name for name in directories
+            if not name.startswith('.') and name not in SKIP_DIRECTORIES
+            and os.path.join(root, name) not in exclude
+            and not os.path.exists(os.path.join(root, name, 'pyvenv.cfg'))
+        )
+        for name in sorted(files):
+            if name.endswith('.py'):
+                yield os.path.join(root, name)
+
+
+class ConfigSnapshot:
+    """
+    Compiled project configuration stored under BASE_DATA_PATH
+
+    The snapshot holds the resolved datatypes, services, parsed connector configs and routing so startup can skip
+    parsing the settings. It is invalidated by a fingerprint of the project source files, the installed xenops and
+    the installed service versions.
+    """
+
+    VERSION = 4
+    FILENAME = 'config-snapshot.pickle'
+
+    def __init__(self, data_path):
+        """
+        Init ConfigSnapshot
+
+        :param str data_path:
+        """
+        self.path = os.path.join(data_path, self.FILENAME)
+
+    @classmethod
+    def fingerprint(cls, base_path, entry_points=None):
+        """
+        Create fingerprint of project configuration
+
+        Hashes the source of the Python files in the project base path (the settings module and the project
+        packages), the version and source files of the installed xenops, so pickled objects of another xenops version
+        are never loaded, and the versions of installed services. The same files are hashed before and after the
+        project is loaded.
+
+        :param str base_path: Project base path
+        :param list entry_points: Installed service entry points
+        :return str:
+        """
+        import xenops
+
+        digest = hashlib.sha256()
+        digest.update('{}:{}:{}'.format(cls.VERSION, xenops.__version__, sys.version).encode())
+
+        # Installed xenops files change rarely, size and modification time are enough to detect an update
+        for filename in iter_source_files(os.path.dirname(os.path.abspath(xenops.__file__))):
+            stat = os.stat(filename)
+            digest.update('{}:{}:{}'.format(filename, stat.st_size, stat.st_mtime_ns).encode())
+
+        base_path = os.path.abspath(base_path)
+        for filename in iter_source_files(base_path, exclude=[os.path.join(base_path, 'data')]):
+            digest.update(filename.encode())
+            try:
+                with open(filename, 'rb') as f:
+                    digest.update(f.read())
+            except OSError:
+                continue
+
+        for entry_point in entry_points if entry_points else []:
+            dist = getattr(entry_point, 'dist', None)
+            digest.update('{}={}@{}'.format(
+                entry_point.name,
+                getattr(entry_point, 'value', entry_point),
+                getattr(dist, 'version', ''),
+            ).encode())
+
+        return digest.hexdigest()
+
+    def load(self, fingerprint):
+        """
+        Load snapshot data when it matches the fingerprint
+
+        :param str fingerprint:
+        :return dict: None when there is no valid snapshot
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                snapshot = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning('Could not load config snapshot ({}): {}'.format(self.path, e))
+            return None
+
+        if snapshot.get('fingerprint') != fingerprint:
+            logger.debug('Config snapshot is outdated')
+            return None
+
+        return snapshot.get('data')
+
+    def save(self, fingerprint, data):
+        """
+        Save snapshot data
+
+        Configurations with objects that can not be pickled (like lambda functions) are not cached.
+
+        :param str fingerprint:
+        :param dict data:
+        :return bool:
+        """
+        try:
+            content = pickle.dumps({'fingerprint': fingerprint, 'data': data}, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.warning('Config can not be cached in snapshot: {}'.format(e))
+            return False
+
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning('Could not save config snapshot ({}): {}'.format(self.path, e))
+            return False
+
+        return True
+
+    def clear(self):
+        """Remove snapshot"""
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
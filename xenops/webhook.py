@@ -0,0 +1,256 @@
+"""
+xenops.webhook
+~~~~~~~~~~~~~~
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import hmac
+import json
+import queue
+import logging
+import threading
+
+from xenops.data import DataTypeFactory
+from xenops.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidNotification(Exception):
+    """Invalid notification Exception"""
+
+    def __init__(self, message, status=400):
+        """
+        Init InvalidNotification
+
+        :param str message:
+        :param int status: HTTP status for the response
+        """
+        super().__init__(message)
+        self.status = status
+
+
+class WebhookServer:
+    """
+    HTTP listener that accepts change notifications and processes them with the connector process routing
+
+    POST /<connector>/<type> with a JSON body ``{"objects": [...], "ids": [...]}``. Objects are raw service data and
+    become data objects directly, ids are fetched with Connector.get_many. Notifications are accepted with status 202
+    and processed in batches by a dispatcher thread, or put on the work queue for `xenops worker` processes.
+    GET /metrics returns the metrics in Prometheus text format.
+    """
+
+    def __init__(self, app, host='127.0.0.1', port=9098, token=None, work_queue=None, batch_size=100):
+        """
+        Init WebhookServer
+
+        :param xenops.app.Application app:
+        :param str host: Interface to bind to
+        :param int port:
+        :param str token: Required X-Xenops-Token header value
+        :param xenops.connector.workqueue.WorkQueue work_queue: Put objects on queue instead of processing them
+        :param int batch_size: Maximum number of objects processed at once per connector and type
+        """
+        self.app = app
+        self.host = host
+        self.port = port
+        self.token = token
+        self.work_queue = work_queue
+        self.batch_size = batch_size
+        self.notifications = queue.Queue()
+        self.server = None
+        self.threads = []
+
+    def notify(self, connector_code, type_code, body):
+        """
+        Validate notification and add it to the dispatch queue
+
+        :param str connector_code:
+        :param str type_code:
+        :param body: Decoded JSON body
+        :return int: Number of accepted objects and ids
+        """
+        connector = self.app.connectors.get(connector_code)
+        if not connector or type_code not in connector.service.types or not DataTypeFactory.get(type_code):
+            raise InvalidNotification('Unknown connector or type ({}/{})'.format(connector_code, type_code), 404)
+
+        if type(body) is not dict:
+            raise InvalidNotification('Body must be a JSON object with objects and/or ids')
+
+        objects = body.get('objects', [])
+        ids = body.get('ids', [])
+        if type(objects) is not list or type(ids) is not list or not all(type(data) is dict for data in objects):
+            raise InvalidNotification('Objects must be a list of JSON objects and ids a list')
+
+        self.notifications.put((connector_code, type_code, objects, ids))
+        metrics.inc('xenops_webhook_notifications_total', connector=connector_code, datatype=type_code)
+        return len(objects) + len(ids)
+
+    def fetch(self, connector, datatype, ids):
+        """
+        Fetch raw data of ids in batches, ids of a failed batch are fetched one by one
+
+        :param xenops.connector.Connector connector:
+        :param xenops.data.DataType datatype:
+        :param list ids:
+        :return list: Raw object data
+        """
+        objects = []
+        for start in range(0, len(ids), self.batch_size):
+            batch = ids[start:start + self.batch_size]
+            try:
+                objects += [data_object.data for data_object in connector.get_many(datatype, batch)]
+                continue
+            except Exception as e:
+                logger.warning('Fetching {} notified ({}/{}) ids failed, fetching them one by one: {}'.format(
+                    len(batch), connector.code, datatype.code, e))
+
+            for object_id in batch:
+                try:
+                    objects.append(connector.get(datatype, object_id).data)
+                except Exception as e:
+                    logger.error('Fetching notified ({}/{}) id ({}) failed: {}'.format(
+                        connector.code, datatype.code, object_id, e))
+        return [object_data for object_data in objects if object_data]
+
+    def dispatch(self, notifications):
+        """
+        Fetch and process notifications grouped by connector and type
+
+        :param list notifications: (connector code, type code, objects, ids)
+        """
+        groups = {}
+        for connector_code, type_code, objects, ids in notifications:
+            group = groups.setdefault((connector_code, type_code), ([], []))
+            group[0].extend(objects)
+            group[1].extend(ids)
+
+        for (connector_code, type_code), (objects, ids) in groups.items():
+            connector = self.app.connectors[connector_code]
+            datatype = DataTypeFactory.get(type_code)
+            objects += self.fetch(connector, datatype, ids)
+
+            for start in range(0, len(objects), self.batch_size):
+                page = objects[start:start + self.batch_size]
+                try:
+                    if self.work_queue:
+                        self.work_queue.put_many(connector_code, type_code, page)
+                        continue
+
+                    data_objects = [connector.create_data_object(datatype, object_data) for object_data in page]
+                    failed = connector.process_data_objects(data_objects, connector.get_processes_config(type_code))
+                    if failed:
+                        logger.error('Processing {} of {} notified ({}/{}) objects failed'.format(
+                            len(failed), len(page), connector_code, type_code))
+                except Exception as e:
+                    logger.error('Error handling {} notified ({}/{}) objects: {}'.format(
+                        len(page), connector_code, type_code, e))
+
+    def run_dispatcher(self):
+        """Dispatch notifications until stopped"""
+        while True:
+            notification = self.notifications.get()
+            if notification is None:
+                return
+
+            notifications = [notification]
+            stop = False
+            while len(notifications) < self.batch_size:
+                try:
+                    notification = self.notifications.get_nowait()
+                except queue.Empty:
+                    break
+                if notification is None:
+                    stop = True
+                    break
+                notifications.append(notification)
+
+            self.dispatch(notifications)
+            if stop:
+                return
+
+    def create_handler(self):
+        """
+        Create request handler class bound to this server
+
+        :return type:
+        """
+        from http.server import BaseHTTPRequestHandler
+
+        webhook = self
+
+        class WebhookHandler(BaseHTTPRequestHandler):
+            def send_json(self, status, data):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                metrics.send_response(self)
+
+            def do_POST(self):
+                token = self.headers.get('X-Xenops-Token', '')
+                if webhook.token and not hmac.compare_digest(token.encode('utf-8'), webhook.token.encode('utf-8')):
+                    self.send_json(401, {'error': 'Invalid token'})
+                    return
+
+                parts = self.path.split('?')[0].strip('/').split('/')
+                if len(parts) != 2:
+                    self.send_json(404, {'error': 'Use /<connector>/<type>'})
+                    return
+
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    body = json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+                    accepted = webhook.notify(parts[0], parts[1], body)
+                except ValueError:
+                    self.send_json(400, {'error': 'Invalid JSON body'})
+                except InvalidNotification as e:
+                    self.send_json(e.status, {'error': str(e)})
+                else:
+                    self.send_json(202, {'accepted': accepted})
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return WebhookHandler
+
+    def start(self):
+        """
+        Start listener and dispatcher threads
+
+        :return tuple: Bound (host, port)
+        """
+        import socketserver
+        from http.server import HTTPServer
+
+        class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.server = ThreadingHTTPServer((self.host, self.port), self.create_handler())
+        self.threads = [
+            threading.Thread(target=self.server.serve_forever, daemon=True),
+            threading.Thread(target=self.run_dispatcher, daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+        logger.info('Listening for notifications on http://{}:{}'.format(*self.server.server_address[:2]))
+        return self.server.server_address[:2]
+
+    def stop(self):
+        """Stop listening and process the accepted notifications"""
+        if not self.server:
+            return
+
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+        self.notifications.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
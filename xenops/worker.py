@@ -0,0 +1,94 @@
+"""
+xenops.worker
+~~~~~~~~~~~~~
+
+:copyright: 2017 by Maikel Martens
+:license: GPLv3
+"""
+import os
+import time
+import socket
+import logging
+
+from xenops.data import DataTypeFactory
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    """
+    Worker that claims raw objects from the work queue, maps them and calls the process connectors
+
+    Run any number of workers (`xenops worker`) next to a trigger that runs with the queue option.
+    Delivery is at least once: an object that fails for one process connector is retried for all of them.
+    """
+
+    def __init__(self, app, batch_size=100, lease_seconds=300, poll_interval=1.0):
+        """
+        Init Worker
+
+        :param xenops.app.Application app:
+        :param int batch_size: Number of items claimed at once
+        :param float lease_seconds: Time before claimed items are given to other workers
+        :param float poll_interval: Seconds to wait when queue is empty
+        """
+        self.app = app
+        self.queue = app.get_queue()
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.name = '{}:{}'.format(socket.gethostname(), os.getpid())
+
+    def run(self, stop_when_empty=False, max_items=None):
+        """
+        Process queue items until stopped
+
+        :param bool stop_when_empty: Stop when there are no items to claim
+        :param int max_items: Stop after processing this number of items
+        :return int: number of handled items
+        """
+        handled = 0
+        while max_items is None or handled < max_items:
+            limit = self.batch_size if max_items is None else min(self.batch_size, max_items - handled)
+            items = self.queue.claim(self.name, limit, self.lease_seconds)
+            if not items:
+                if stop_when_empty:
+                    break
+                time.sleep(self.poll_interval)
+                continue
+
+            self.handle_items(items)
+            handled += len(items)
+
+        return handled
+
+    def handle_items(self, items):
+        """
+        Map and process claimed items, grouped by connector and type
+
+        :param list items:
+        """
+        groups = {}
+        for item in items:
+            groups.setdefault((item['connector_code'], item['type_code']), []).append(item)
+
+        for (connector_code, type_code), group in groups.items():
+            connector = self.app.connectors.get(connector_code)
+            datatype = DataTypeFactory.get(type_code)
+            if not connector or not datatype:
+                logger.error('Queue items for unknown connector/type ({}:{})'.format(connector_code, type_code))
+                self.queue.release([item['id'] for item in group], 'Unknown connector or type')
+                continue
+
+            try:
+                data_objects = [connector.create_data_object(datatype, item['data']) for item in group]
+                failed = connector.process_data_objects(data_objects, connector.get_processes_config(type_code))
+            except Exception as e:
+                logger.error('Error handling queue items ({}:{}): {}'.format(connector_code, type_code, e))
+                self.queue.release([item['id'] for item in group], str(e))
+                continue
+
+            failed_ids = [item['id'] for item, data in zip(group, data_objects) if data in failed]
+            if failed_ids:
+                self.queue.release(failed_ids, 'Process failed')
+            self.queue.ack([item['id'] for item, data in zip(group, data_objects) if data not in failed])